@@ -0,0 +1,191 @@
+"""
+Асинхронный доступ к базе.
+
+Все функции database.py выполняются в одном выделенном потоке, поэтому
+commit и fsync не блокируют event loop, а запросы к SQLite идут строго
+по очереди и не конкурируют за блокировку.
+
+В режиме cluster несколько процессов работают с одной базой: функции записи
+уходят в единственный процесс-писатель (cluster.WriterClient), чтение
+остаётся локальным — WAL позволяет читать параллельно с записью.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+
+import database
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+_writer = None
+
+
+async def run(func, *args, **kwargs):
+    """Выполнить синхронную функцию базы в потоке БД"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(func, *args, **kwargs))
+
+
+async def write(func, *args):
+    """Выполнить функцию записи: в процессе-писателе, если он подключён, иначе в потоке БД"""
+    if _writer is not None:
+        return await _writer.call(func.__name__, *args)
+    return await run(func, *args)
+
+
+def use_writer(writer):
+    """Направлять запись в процесс-писатель (объект с async call(name, *args) и close())"""
+    global _writer
+    _writer = writer
+
+
+def shutdown():
+    """Дождаться записи и закрыть соединение"""
+    if _writer is not None:
+        _writer.close()
+    _executor.submit(database.close_db).result()
+    _executor.shutdown(wait=True)
+
+
+async def init_db():
+    """Подготовить базу (один раз при запуске)"""
+    return await run(database.init_db)
+
+
+# === Машины ===
+# Чтение идёт из кеша машин чата прямо в event loop, в поток БД — только
+# пока кеш этого чата не загружен
+
+def _loaded_registry(chat_id: int) -> database.CarRegistry | None:
+    registry = database.car_registries.get(chat_id)
+    return registry if registry is not None and registry.loaded else None
+
+
+def _cars_changed(chat_id: int):
+    """Машины чата изменил процесс-писатель: локальный кеш перечитается из базы"""
+    if _writer is not None and (registry := database.car_registries.get(chat_id)):
+        registry.invalidate()
+
+
+async def claim_legacy_fleet(chat_id: int) -> tuple[int, int]:
+    """
+    Отдать ничей общий парк (машины по умолчанию или парк прежней версии)
+    и его историю чату — по команде администратора. Возвращает (машин, заказов).
+    """
+    claimed = await write(database.claim_legacy_fleet, chat_id)
+    _cars_changed(chat_id)
+    return claimed
+
+
+async def get_car_registry(chat_id: int) -> database.CarRegistry:
+    if registry := _loaded_registry(chat_id):
+        return registry
+    return await run(database.get_car_registry, chat_id)
+
+
+async def get_all_cars(chat_id: int) -> list[tuple]:
+    if registry := _loaded_registry(chat_id):
+        return registry.all()
+    return await run(database.get_all_cars, chat_id)
+
+
+async def get_car_by_name(chat_id: int, name: str) -> tuple | None:
+    if registry := _loaded_registry(chat_id):
+        return registry.by_name(name)
+    return await run(database.get_car_by_name, chat_id, name)
+
+
+async def get_car_by_id(chat_id: int, car_id: int) -> tuple | None:
+    if registry := _loaded_registry(chat_id):
+        return registry.by_id(car_id)
+    return await run(database.get_car_by_id, chat_id, car_id)
+
+
+async def match_car_prefix(chat_id: int, text: str) -> tuple[tuple, int] | None:
+    if registry := _loaded_registry(chat_id):
+        return registry.match_prefix(text)
+    return await run(database.match_car_prefix, chat_id, text)
+
+
+async def cars_starting_with(chat_id: int, prefix: str, limit: int | None = None) -> list[tuple]:
+    if registry := _loaded_registry(chat_id):
+        return registry.starting_with(prefix, limit)
+    return await run(database.cars_starting_with, chat_id, prefix, limit)
+
+
+async def add_car(chat_id: int, name: str, number: str, model: str) -> bool:
+    added = await write(database.add_car, chat_id, name, number, model)
+    _cars_changed(chat_id)
+    return added
+
+
+async def delete_car(chat_id: int, name: str) -> bool:
+    deleted = await write(database.delete_car, chat_id, name)
+    _cars_changed(chat_id)
+    return deleted
+
+
+async def delete_car_by_id(chat_id: int, car_id: int) -> bool:
+    deleted = await write(database.delete_car_by_id, chat_id, car_id)
+    _cars_changed(chat_id)
+    return deleted
+
+
+# === Заказы парковки ===
+
+async def add_parking_order(chat_id: int, car_name: str, car_number: str, car_model: str,
+                            entry_time: datetime, response: str) -> int:
+    return await write(database.add_parking_order, chat_id, car_name, car_number, car_model, entry_time, response)
+
+
+async def add_parking_orders(chat_id: int, orders: list[tuple]) -> int:
+    return await write(database.add_parking_orders, chat_id, orders)
+
+
+async def get_active_orders(chat_id: int) -> list[tuple]:
+    return await run(database.get_active_orders, chat_id)
+
+
+async def get_recent_orders(chat_id: int, limit: int = 10, before: tuple[int, int] | None = None) -> list[tuple]:
+    return await run(database.get_recent_orders, chat_id, limit, before)
+
+
+async def archive_orders(older_than_days: int, batch_size: int = database.ARCHIVE_BATCH_SIZE) -> int:
+    return await write(database.archive_orders, older_than_days, batch_size)
+
+
+# === Плановые заказы ===
+
+async def add_scheduled_order(chat_id: int, car_id: int, weekdays: int,
+                              hour: int, minute: int, once_date: str | None) -> tuple:
+    return await write(database.add_scheduled_order, chat_id, car_id, weekdays, hour, minute, once_date)
+
+
+async def get_scheduled_orders() -> list[tuple]:
+    return await run(database.get_scheduled_orders)
+
+
+async def mark_scheduled_order_fired(order_id: int, entry_time: datetime):
+    return await write(database.mark_scheduled_order_fired, order_id, entry_time)
+
+
+async def delete_scheduled_order(order_id: int) -> bool:
+    return await write(database.delete_scheduled_order, order_id)
+
+
+# === Состояния диалогов ===
+
+async def save_state(namespace: str, user_id: int, value: str, expires_at: float):
+    return await write(database.save_state, namespace, user_id, value, expires_at)
+
+
+async def delete_state(namespace: str, user_id: int):
+    return await write(database.delete_state, namespace, user_id)
+
+
+async def purge_states(now: float):
+    return await write(database.purge_states, now)
+
+
+async def load_states(namespace: str) -> list[tuple]:
+    return await write(database.load_states, namespace)
@@ -0,0 +1,478 @@
+"""
+Микробенчмарки отдельных оптимизаций, без сети. Каждый сравнивает прежний
+способ с текущим на одних и тех же данных во временной базе.
+
+    python bench.py db
+    python bench.py trie --cars 10000
+
+db — стоимость одного вызова: новое соединение sqlite3 на каждый запрос
+(как было) против общего соединения с WAL и кешем выражений.
+
+trie — поиск машины в начале сообщения: перебор всех машин со startswith
+(как было) против префиксного дерева; и добавление/удаление машины в кеше.
+
+    python bench.py extract --page-kb 8 64 1024
+
+extract — текст ответа parkspot.ru для Telegram: проходы re.sub по всей
+странице и обрезка (как было) с поиском блока статуса регулярным выражением
+против потокового парсера; перед замером ответы сверяются. Страницы
+синтетические, по образцу ответа сайта: большие inline-скрипты и стили,
+меню, форма и блок статуса в начале, в конце или без него.
+
+    python bench.py history --orders 1000000
+
+history — /history и активные заказы на большой таблице: запросы по
+индексам (chat_id, created_ts, id) и (chat_id, entry_ts) против тех же
+запросов с NOT INDEXED — полного прохода, как до индексов.
+
+    python bench.py timeparse
+
+timeparse — разбор времени въезда на корпусе сообщений, какие пишут боту:
+прежний bot.parse_time (список шаблонов на каждый вызов, до двух re.search)
+против timeparse.parse_time (один заранее скомпилированный шаблон, один
+проход). До замера оба сверяются с ожидаемым ответом: прежний — на
+сообщениях, которые он понимал, новый — на всём корпусе.
+
+    python bench.py webhook --updates 200
+
+webhook — задержка от появления обновления до ответа бота: long polling
+против webhook. Bot API подменён локальным сервером: getUpdates отдаёт
+обновление, как только оно появилось, sendMessage отмечает ответ. Сеть до
+Telegram и задержка его очереди в замер не входят — только путь внутри бота.
+
+Без аргументов запускаются все бенчмарки.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import sqlite3
+import statistics
+import tempfile
+import time
+import timeit
+from datetime import datetime, timedelta
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """Регистрирует bench_<имя> как бенчмарк <имя>"""
+    BENCHMARKS[func.__name__.removeprefix("bench_")] = func
+    return func
+
+
+def per_call(func, number: int, repeat: int = 5) -> float:
+    """Медиана времени одного вызова func, с"""
+    return statistics.median(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(label: str, old: float, new: float):
+    change = f"в {old / new:.1f} раза быстрее" if new <= old else f"в {new / old:.1f} раза медленнее"
+    print(f"  {label}: было {old * 1e6:9.1f} мкс, стало {new * 1e6:9.1f} мкс — {change}")
+
+
+@benchmark
+def bench_db(args, tmp: str):
+    """Соединение на каждый вызов против общего соединения"""
+    import database
+
+    database.init_db()
+    entry = datetime(2026, 10, 14, 15, 30)
+    chat_id = 1
+
+    # Прежний database.py: connect/close на каждый вызов, журнал по умолчанию
+    old_path = os.path.join(tmp, "old.db")
+    with sqlite3.connect(old_path) as conn:
+        conn.execute('''
+            CREATE TABLE parking_orders (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, car_name TEXT NOT NULL, car_number TEXT NOT NULL,
+                car_model TEXT NOT NULL, entry_time TEXT NOT NULL, created_at TEXT NOT NULL, response TEXT
+            )
+        ''')
+
+    def old_add_order():
+        conn = sqlite3.connect(old_path)
+        conn.execute(
+            'INSERT INTO parking_orders (car_name, car_number, car_model, entry_time, created_at, response) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            ("секвойя", "А606ВО 797", "Тойота", entry.isoformat(), datetime.now().isoformat(), "ok"),
+        )
+        conn.commit()
+        conn.close()
+
+    def old_recent_orders():
+        conn = sqlite3.connect(old_path)
+        rows = conn.execute('SELECT * FROM parking_orders ORDER BY created_at DESC LIMIT 10').fetchall()
+        conn.close()
+        return rows
+
+    def new_add_order():
+        database.add_parking_order(chat_id, "секвойя", "А606ВО 797", "Тойота", entry, "ok")
+
+    def new_recent_orders():
+        return database.get_recent_orders(chat_id, 10)
+
+    print(f"db: {args.calls} вызовов на замер")
+    report("запись заказа", per_call(old_add_order, args.calls), per_call(new_add_order, args.calls))
+    report("последние заказы", per_call(old_recent_orders, args.calls), per_call(new_recent_orders, args.calls))
+    database.close_db()
+
+
+@benchmark
+def bench_trie(args, tmp: str):
+    """Поиск имени машины: перебор против trie"""
+    from database import CarRegistry
+
+    rng = random.Random(1)
+    letters = "абвгдежзиклмнопрстуфхцчшэюя"
+    names = {"".join(rng.choices(letters, k=rng.randint(4, 10))) for _ in range(args.cars)}
+    cars = [(car_id, name, f"А{car_id:03d}ВО 797", "Тойота") for car_id, name in enumerate(sorted(names), 1)]
+    registry = CarRegistry()
+    registry.load(cars)
+    messages = [f"{rng.choice(cars)[1]} 15:30" for _ in range(100)] + ["15:30"] * 10
+
+    # Прежний handle_message: первая машина, с имени которой начинается текст
+    def old_match():
+        for text in messages:
+            for car in cars:
+                if text.startswith(car[1].lower()):
+                    break
+
+    def new_match():
+        for text in messages:
+            registry.match_prefix(text)
+
+    extra = (len(cars) + 1, "новаямашина", "Б001ВО 797", "Порше")
+
+    def add_remove():
+        registry.put(extra)
+        registry.remove(extra[0])
+
+    print(f"trie: {len(cars)} машин, {len(messages)} сообщений на вызов")
+    report("разбор сообщений", per_call(old_match, 3), per_call(new_match, 3))
+    print(f"  добавить и удалить машину в кеше: {per_call(add_remove, 20) * 1e6:.1f} мкс")
+
+
+def make_page(size: int, status: str | None) -> str:
+    """Страница около size байт; status — где блок статуса: 'top', 'bottom' или None"""
+    script = "<script>" + "var config = {\"key\": \"value\", \"list\": [1, 2, 3]};\n" * 40 + "</script>"
+    style = "<style>" + ".menu-item { color: #333; padding: 4px 8px; }\n" * 40 + "</style>"
+    block = (
+        '<div class="row"><ul class="menu"><li><a href="/">Главная</a></li><li><a href="/help">Помощь</a></li></ul>'
+        "<p>Пропуск на парковку оформляется заранее. Укажите номер и модель машины.</p></div>"
+    )
+    alert = '<div class="alert alert-success">Заявка принята. Пропуск А606ВО 797 на 14.10.2026 15:30</div>'
+    head = f"<html><head>{script}{style}</head><body>"
+    parts = [head, alert if status == "top" else ""]
+    filler = (block + script) * 3
+    while sum(map(len, parts)) < size:
+        parts.append(filler)
+    parts.append((alert if status == "bottom" else "") + "</body></html>")
+    return "".join(parts)
+
+
+@benchmark
+def bench_extract(args, tmp: str):
+    """Текст ответа сайта: регулярные выражения против потокового парсера"""
+    from parkspot import STATUS_ATTR_RE, extract_text
+
+    # Прежний parkspot.extract_text с обрезкой из submit_pass, дополненный
+    # поиском блока статуса регулярным выражением — чтобы сравнивать
+    # одинаковый результат
+    status_re = re.compile(
+        rf'<(\w+)[^>]*\b(?:id|class)="[^"]*(?:{STATUS_ATTR_RE.pattern})[^"]*"[^>]*>(.*?)</\1>',
+        re.DOTALL | re.IGNORECASE,
+    )
+
+    def old_extract(html: str) -> str:
+        html = re.sub(r'<script[^>]*>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
+        html = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
+        if match := status_re.search(html):
+            html = match.group(2)
+        text = re.sub(r'<[^>]+>', ' ', html)
+        text = re.sub(r'\s+', ' ', text).strip()
+        return text[:2000] + "..." if len(text) > 2000 else text
+
+    for page_kb in args.page_kb:
+        print(f"extract: страница {page_kb} КБ")
+        for status, label in (("top", "статус в начале"), ("bottom", "статус в конце"), (None, "без статуса")):
+            html = make_page(page_kb * 1024, status)
+            old, new = old_extract(html), extract_text(html)
+            # Время сравниваем, только если ответ одинаковый
+            assert old == new, f"{label}: {old[:80]!r} != {new[:80]!r}"
+            if status:
+                assert new.startswith("Заявка принята"), new[:80]
+            report(label, per_call(lambda: old_extract(html), 3), per_call(lambda: extract_text(html), 3))
+
+
+@benchmark
+def bench_history(args, tmp: str):
+    """История заказов чата на большой таблице: индекс против полного прохода"""
+    import database
+
+    database.init_db()
+    conn = database.get_connection()
+    chats = 1000
+    now = int(time.time())
+    rng = random.Random(1)
+    batch = 100_000
+    for start in range(0, args.orders, batch):
+        rows = []
+        for order_id in range(start, min(start + batch, args.orders)):
+            created = now - 90 * 86400 + order_id * 90 * 86400 // args.orders
+            rows.append((
+                rng.randrange(chats), "секвойя", "А606ВО 797", "Тойота",
+                created + rng.randrange(86400), created, "Заявка принята",
+            ))
+        with conn:
+            conn.executemany(database.SQL_ADD_ORDER, rows)
+    conn.execute("ANALYZE")
+
+    chat_id = 7
+    last = database.get_recent_orders(chat_id, 5)[-1]
+    queries = {
+        "первая страница /history": (database.SQL_RECENT_ORDERS, (chat_id, 5)),
+        "следующая страница": (database.SQL_ORDERS_BEFORE, (chat_id, *database.order_page_key(last), 5)),
+        "активные заказы": (database.SQL_ACTIVE_ORDERS, (chat_id, now)),
+    }
+
+    print(f"history: {args.orders} заказов в {chats} чатах")
+    for label, (sql, params) in queries.items():
+        plan = " / ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+        full_scan = sql.replace("FROM parking_orders", "FROM parking_orders NOT INDEXED")
+        report(
+            label,
+            per_call(lambda: conn.execute(full_scan, params).fetchall(), 1, repeat=3),
+            per_call(lambda: conn.execute(sql, params).fetchall(), 100),
+        )
+        print(f"    план: {plan}")
+    database.close_db()
+
+
+# Сообщения боту и ожидаемое время въезда от TIMEPARSE_NOW: (смещение в днях, "ЧЧ:ММ")
+# или None — времени в сообщении нет. old=False — прежний парсер их не понимал
+TIMEPARSE_NOW = datetime(2026, 10, 14, 12, 0)  # среда
+TIME_CORPUS = [
+    ("15:30", (0, "15:30"), True),
+    ("секвойя 15:30", (0, "15:30"), True),
+    ("Секвойя 9:00", (0, "09:00"), True),
+    ("панама 18.45", (0, "18:45"), True),
+    ("секвойя, панама 15:30", (0, "15:30"), True),
+    ("паджеро завтра 10:00", (1, "10:00"), True),
+    ("завтра 9.30", (1, "09:30"), True),
+    ("Завтра в 8:15 секвойя", (1, "08:15"), True),
+    ("1530", (0, "15:30"), True),
+    ("0900", (0, "09:00"), True),
+    ("сегодня 23:59", (0, "23:59"), True),
+    ("гость приедет к 14:00, закажи панаму", (0, "14:00"), True),
+    ("15:00-17:00", (0, "15:00"), True),
+    ("+", None, True),
+    ("/start", None, True),
+    ("/history", None, True),
+    ("привет", None, True),
+    ("секвойя", None, True),
+    ("спасибо!", None, True),
+    ("что с пропуском?", None, True),
+    ("послезавтра 10:00", (2, "10:00"), False),
+    ("в пятницу 10:00", (2, "10:00"), False),
+    ("пт 1000", (2, "10:00"), False),
+    ("в среду 9:00", (7, "09:00"), False),
+    ("через 2 часа", (0, "14:00"), False),
+    ("через полчаса", (0, "12:30"), False),
+    ("через 15 минут", (0, "12:15"), False),
+]
+
+
+def expected_time(expected: tuple | None) -> datetime | None:
+    if expected is None:
+        return None
+    days, clock = expected
+    hours, minutes = map(int, clock.split(":"))
+    return datetime.combine(TIMEPARSE_NOW.date() + timedelta(days=days), datetime.min.time()).replace(
+        hour=hours, minute=minutes,
+    )
+
+
+@benchmark
+def bench_timeparse(args, tmp: str):
+    """Разбор времени: прежний bot.parse_time против timeparse.parse_time"""
+    from timeparse import parse_time
+
+    # Прежний bot.parse_time; now — параметром, чтобы сравнивать с ожидаемым
+    def old_parse_time(time_str: str, now: datetime) -> datetime | None:
+        time_str = time_str.strip().lower()
+        target_date = now.date()
+
+        if "завтра" in time_str:
+            target_date = (now + timedelta(days=1)).date()
+            time_str = time_str.replace("завтра", "").strip()
+
+        patterns = [
+            r"(\d{1,2})[:\.](\d{2})",
+            r"^(\d{2})(\d{2})$",
+        ]
+
+        for pattern in patterns:
+            match = re.search(pattern, time_str)
+            if match:
+                hours, minutes = int(match.group(1)), int(match.group(2))
+                if 0 <= hours <= 23 and 0 <= minutes <= 59:
+                    return datetime.combine(target_date, datetime.min.time().replace(hour=hours, minute=minutes))
+
+        return None
+
+    # Время сравниваем, только если ответы правильные
+    for text, expected, old_understands in TIME_CORPUS:
+        expected = expected_time(expected)
+        assert parse_time(text, TIMEPARSE_NOW) == expected, text
+        if old_understands:
+            assert old_parse_time(text, TIMEPARSE_NOW) == expected, text
+
+    texts = [text for text, _, _ in TIME_CORPUS]
+    common = [text for text, _, old_understands in TIME_CORPUS if old_understands]
+    print(f"timeparse: корпус {len(texts)} сообщений, {len(common)} из них понимал прежний парсер")
+    for label, corpus in (("сообщения, понятные обоим", common), ("весь корпус", texts)):
+        old = per_call(lambda: [old_parse_time(text, TIMEPARSE_NOW) for text in corpus], 500)
+        new = per_call(lambda: [parse_time(text, TIMEPARSE_NOW) for text in corpus], 500)
+        report(f"{label}, на сообщение", old / len(corpus), new / len(corpus))
+
+
+class FakeTelegram:
+    """Локальный Bot API: getUpdates из очереди, sendMessage будит ожидающего ответа"""
+
+    def __init__(self):
+        self.updates: asyncio.Queue = asyncio.Queue()
+        self.replies: dict[int, asyncio.Future] = {}
+
+    async def handle(self, request):
+        from aiohttp import web
+
+        method = request.match_info["method"].lower()
+        data = await request.post()
+        if method == "getme":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif method == "getupdates":
+            try:
+                result = [await asyncio.wait_for(self.updates.get(), float(data.get("timeout") or 0) or 0.1)]
+            except asyncio.TimeoutError:
+                result = []
+        elif method == "sendmessage":
+            chat_id = int(data["chat_id"])
+            result = {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": data["text"]}
+            if (future := self.replies.get(chat_id)) and not future.done():
+                future.set_result(time.perf_counter())
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+@benchmark
+def bench_webhook(args, tmp: str):
+    """Задержка ответа: long polling против webhook"""
+    asyncio.run(_webhook_vs_polling(args.updates))
+
+
+async def _webhook_vs_polling(count: int):
+    import aiohttp
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiohttp import web
+
+    import bot as bot_module
+    from scheduler import Scheduler
+
+    telegram = FakeTelegram()
+    api_runner, api_url = await telegram.start()
+    bot = Bot(token="123456:BENCH", session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    dp = bot_module.create_dispatcher(Scheduler(lambda order, entry_time: True))
+
+    def update(n: int) -> dict:
+        chat = {"id": 1000 + n, "type": "private"}
+        return {"update_id": n, "message": {
+            "message_id": n, "date": int(time.time()), "chat": chat,
+            "from": {"id": chat["id"], "is_bot": False, "first_name": "bench"}, "text": "/start",
+        }}
+
+    async def measure(deliver) -> list[float]:
+        latencies = []
+        for n in range(1, count + 1):
+            reply = telegram.replies[1000 + n] = asyncio.get_running_loop().create_future()
+            started = time.perf_counter()
+            await deliver(update(n))
+            latencies.append(await reply - started)
+        return latencies
+
+    # Long polling: обновление ждёт, пока его заберёт очередной getUpdates
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    await asyncio.sleep(0.5)
+    polled = await measure(telegram.updates.put)
+    await dp.stop_polling()
+    await polling
+
+    # Webhook: Telegram сам присылает POST на WEBHOOK_PATH
+    runner = web.AppRunner(bot_module.create_webhook_app(bot, dp))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}{bot_module.WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": bot_module.WEBHOOK_SECRET} if bot_module.WEBHOOK_SECRET else {}
+    async with aiohttp.ClientSession() as client:
+        async def post(data: dict):
+            async with client.post(url, data=json.dumps(data), headers=headers) as response:
+                response.raise_for_status()
+
+        hooked = await measure(post)
+
+    await runner.cleanup()
+    await bot.session.close()
+    await api_runner.cleanup()
+
+    print(f"webhook: {count} обновлений /start, задержка до sendMessage")
+    for label, latencies in (("long polling", polled), ("webhook", hooked)):
+        latencies.sort()
+        print(f"  {label:>12}: p50 {latencies[len(latencies) // 2] * 1000:.2f} мс, "
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.2f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"бенчмарки: {', '.join(BENCHMARKS)} (по умолчанию все)")
+    parser.add_argument("--calls", type=int, default=200, help="вызовов на замер (db)")
+    parser.add_argument("--cars", type=int, default=10000, help="машин в парке (trie)")
+    parser.add_argument("--updates", type=int, default=200, help="обновлений на замер (webhook)")
+    parser.add_argument("--orders", type=int, default=1_000_000, help="заказов в таблице (history)")
+    parser.add_argument("--page-kb", type=int, nargs="+", default=[8, 64, 1024],
+                        help="размеры страниц, КБ (extract)")
+    args = parser.parse_args()
+    if unknown := set(args.names) - set(BENCHMARKS):
+        parser.error(f"нет бенчмарков: {', '.join(sorted(unknown))}")
+
+    # База — временный файл, лимиты частоты не мешают замерам;
+    # задаётся до импорта модулей бота
+    tmp = tempfile.mkdtemp(prefix="parkspot-bench-")
+    os.environ["PARKSPOT_DB"] = os.path.join(tmp, "parkspot.db")
+    os.environ.setdefault("GLOBAL_RATE_LIMIT", "1000000")
+    os.environ.setdefault("GLOBAL_RATE_BURST", "1000000")
+    os.environ.setdefault("METRICS_PORT", "0")
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name](args, tmp)
+
+
+if __name__ == "__main__":
+    main()
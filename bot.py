@@ -1,91 +1,204 @@
 import asyncio
+import json
 import re
-from datetime import datetime, timedelta, timezone
-from aiogram import Bot, Dispatcher, types, F
-
-# Московский часовой пояс (UTC+3)
-MSK = timezone(timedelta(hours=3))
+import signal
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from functools import partial
+from aiogram import Bot, Dispatcher, Router, types, F
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
+from aiogram.types import (
+    InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery,
+    InlineQuery, InlineQueryResultArticle, InlineQueryResultsButton, InputTextMessageContent,
+)
 
-from config import BOT_TOKEN
-from database import (
-    get_all_cars, get_car_by_name, get_car_by_id,
+from config import (
+    get_bot_token, MSK, RUN_MODE, SCHEDULE_LEAD_MINUTES, ORDER_RETENTION_DAYS,
+    STATE_TTL, STATE_MAX_SIZE, STATE_PERSIST, METRICS_HOST, METRICS_PORT, INLINE_CACHE_TTL,
+    PROFILE_ON_START, ADMIN_IDS,
+    USER_RATE_LIMIT, USER_RATE_BURST, GLOBAL_RATE_LIMIT, GLOBAL_RATE_BURST,
+    SEND_RATE_LIMIT, SEND_CHAT_RATE_LIMIT, SEND_CHAT_RATE_BURST,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, check_webhook_config,
+)
+from async_db import (
+    get_car_registry, get_all_cars, get_car_by_name, get_car_by_id, match_car_prefix, cars_starting_with,
     add_car, delete_car_by_id,
-    add_parking_order, get_active_orders, get_recent_orders
+    add_parking_order, add_parking_orders, get_active_orders, get_recent_orders,
+    add_scheduled_order, archive_orders, init_db,
 )
-from parkspot import submit_pass
+from database import ARCHIVE_BATCH_SIZE, car_cache_stats, order_page_key
+from metrics import handler_metrics_middleware, registry, start_metrics_server
+from parkspot import parkspot_breaker, parkspot_session
+from profiling import profiler, profiling_router
+from submit_queue import submit_queue
+import async_db
+from scheduler import Scheduler
+from state_store import SQLiteStateBackend, StateStore
+from throttling import SendLimiter, ThrottlingMiddleware
+from timeparse import EVERY_DAY, WEEKEND, WORKDAYS, parse_time, parse_time_or_hour, parse_weekdays
+
+
+# Обработчики регистрируются на роутере; Bot и Dispatcher создаются при запуске
+router = Router()
+
+# Ограничение частоты: входящие обновления и исходящие сообщения
+throttling = ThrottlingMiddleware(USER_RATE_LIMIT, USER_RATE_BURST, GLOBAL_RATE_LIMIT, GLOBAL_RATE_BURST)
+send_limiter = SendLimiter(SEND_RATE_LIMIT, SEND_CHAT_RATE_LIMIT, SEND_CHAT_RATE_BURST)
+
+# Время обработчиков в метриках
+router.message.middleware(handler_metrics_middleware)
+router.callback_query.middleware(handler_metrics_middleware)
+router.inline_query.middleware(handler_metrics_middleware)
+
+
+def create_bot(token: str | None = None) -> Bot:
+    """Bot с ограничением исходящих сообщений"""
+    bot = Bot(token=token or get_bot_token())
+    bot.session.middleware(send_limiter)
+    return bot
+
+
+def create_dispatcher(scheduler: Scheduler) -> Dispatcher:
+    """
+    Dispatcher с обработчиками бота. Роутер подключается к одному
+    диспетчеру, поэтому вызывается один раз на процесс.
+    scheduler попадает в обработчики параметром scheduler.
+    """
+    dp = Dispatcher(scheduler=scheduler)
+    dp.update.outer_middleware(throttling)
+    dp.update.outer_middleware(profiler)
+    dp.include_router(profiling_router)
+    dp.include_router(router)
+    return dp
 
 
-bot = Bot(token=BOT_TOKEN)
-dp = Dispatcher()
-
 # Временное хранение данных для интерактивного меню
-pending_time = {}
-pending_car = {}  # для меню "+"
-
-
-def parse_time(time_str: str) -> datetime | None:
-    """Парсит время из строки"""
-    time_str = time_str.strip().lower()
-    now = datetime.now(MSK)
-    target_date = now.date()
-
-    if "завтра" in time_str:
-        target_date = (now + timedelta(days=1)).date()
-        time_str = time_str.replace("завтра", "").strip()
-
-    patterns = [
-        r"(\d{1,2})[:\.](\d{2})",
-        r"^(\d{2})(\d{2})$",
-    ]
-
-    for pattern in patterns:
-        match = re.search(pattern, time_str)
-        if match:
-            hours, minutes = int(match.group(1)), int(match.group(2))
-            if 0 <= hours <= 23 and 0 <= minutes <= 59:
-                return datetime.combine(target_date, datetime.min.time().replace(hour=hours, minute=minutes))
-
-    return None
-
-
-def get_cars_keyboard(action: str = "park") -> InlineKeyboardMarkup:
+def _state_backend(namespace: str, encode=json.dumps, decode=json.loads) -> SQLiteStateBackend | None:
+    return SQLiteStateBackend(namespace, encode, decode) if STATE_PERSIST else None
+
+
+pending_time = StateStore(STATE_TTL, STATE_MAX_SIZE, _state_backend(
+    "time", encode=datetime.isoformat, decode=datetime.fromisoformat,
+))
+# Отмеченные машины (id) для заказа на несколько машин
+pending_picks = StateStore(STATE_TTL, STATE_MAX_SIZE, _state_backend("picks"))
+
+# Разделители между именами машин в пакетном заказе: "секвойя, панама и паджеро 15:30"
+CAR_SEPARATOR_RE = re.compile(r"^(?:[\s,;+]|и\s)*")
+
+
+class KeyboardCache:
+    """
+    Кеш готовых клавиатур: неизменившаяся разметка переиспользуется, а не
+    собирается заново. Целиком сбрасывается в полночь по Москве, потому что
+    в подписях кнопок стоят даты. Ключи старых версий машин никто не удаляет,
+    поэтому сверх max_size вытесняются давно не использованные.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._items: OrderedDict[tuple, InlineKeyboardMarkup] = OrderedDict()
+        self._date = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> InlineKeyboardMarkup | None:
+        today = datetime.now(MSK).date()
+        if today != self._date:
+            self._items.clear()
+            self._date = today
+        markup = self._items.get(key)
+        if markup is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._items.move_to_end(key)
+        return markup
+
+    def put(self, key: tuple, markup: InlineKeyboardMarkup) -> InlineKeyboardMarkup:
+        self._items[key] = markup
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        return markup
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+keyboard_cache = KeyboardCache(STATE_MAX_SIZE)
+
+
+async def _cached_cars_keyboard(chat_id: int, key: tuple, build) -> InlineKeyboardMarkup:
+    """Клавиатура по списку машин чата, пересобирается только после изменения списка"""
+    car_registry = await get_car_registry(chat_id)
+    key = (*key, chat_id, car_registry.version)
+    markup = keyboard_cache.get(key)
+    if markup is None:
+        markup = keyboard_cache.put(key, build(car_registry.all()))
+    return markup
+
+
+async def get_cars_keyboard(chat_id: int, action: str = "park") -> InlineKeyboardMarkup:
     """Создаёт клавиатуру с машинами"""
-    cars = get_all_cars()
+    def build(cars):
+        buttons = []
+        for car_id, name, number, model in cars:
+            buttons.append([InlineKeyboardButton(
+                text=f"{name} ({number})",
+                callback_data=f"{action}:{car_id}"
+            )])
+        if action == "park" and len(cars) > 1:
+            buttons.append([InlineKeyboardButton(text="☑️ Несколько машин", callback_data="pick:start")])
+        return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+    return await _cached_cars_keyboard(chat_id, ("cars", action), build)
+
+
+async def get_pick_keyboard(chat_id: int, selected: set[int]) -> InlineKeyboardMarkup:
+    """Клавиатура с отметками для заказа на несколько машин"""
     buttons = []
-    for car_id, name, number, model in cars:
+    for car_id, name, number, model in await get_all_cars(chat_id):
+        mark = "✅" if car_id in selected else "⬜"
         buttons.append([InlineKeyboardButton(
-            text=f"{name} ({number})",
-            callback_data=f"{action}:{car_id}"
+            text=f"{mark} {name} ({number})",
+            callback_data=f"pick:{car_id}"
         )])
+    buttons.append([InlineKeyboardButton(text=f"Оформить ({len(selected)})", callback_data="pick:go")])
+    buttons.append([InlineKeyboardButton(text="Отмена", callback_data="cancel")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_delete_keyboard() -> InlineKeyboardMarkup:
+async def get_delete_keyboard(chat_id: int) -> InlineKeyboardMarkup:
     """Клавиатура для удаления машин"""
-    cars = get_all_cars()
-    buttons = []
-    for car_id, name, number, model in cars:
-        buttons.append([InlineKeyboardButton(
-            text=f"❌ {name} ({number})",
-            callback_data=f"del:{car_id}"
-        )])
-    buttons.append([InlineKeyboardButton(text="Отмена", callback_data="cancel")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    def build(cars):
+        buttons = []
+        for car_id, name, number, model in cars:
+            buttons.append([InlineKeyboardButton(
+                text=f"❌ {name} ({number})",
+                callback_data=f"del:{car_id}"
+            )])
+        buttons.append([InlineKeyboardButton(text="Отмена", callback_data="cancel")])
+        return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+    return await _cached_cars_keyboard(chat_id, ("del",), build)
 
 
-def get_menu_cars_keyboard() -> InlineKeyboardMarkup:
+async def get_menu_cars_keyboard(chat_id: int) -> InlineKeyboardMarkup:
     """Клавиатура с машинами для меню +"""
-    cars = get_all_cars()
-    buttons = []
-    for car_id, name, number, model in cars:
-        buttons.append([InlineKeyboardButton(
-            text=f"🚗 {name} ({number})",
-            callback_data=f"menu:{car_id}"
-        )])
-    buttons.append([InlineKeyboardButton(text="Отмена", callback_data="cancel")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    def build(cars):
+        buttons = []
+        for car_id, name, number, model in cars:
+            buttons.append([InlineKeyboardButton(
+                text=f"🚗 {name} ({number})",
+                callback_data=f"menu:{car_id}"
+            )])
+        buttons.append([InlineKeyboardButton(text="Отмена", callback_data="cancel")])
+        return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+    return await _cached_cars_keyboard(chat_id, ("menu",), build)
 
 
 def get_day_label(tomorrow: bool = False) -> str:
@@ -100,8 +213,25 @@ def get_day_label(tomorrow: bool = False) -> str:
     return f"{target.strftime('%d.%m')} ({day_name})"
 
 
+def describe_weekdays(weekdays: int) -> str:
+    """Дни недели из маски планового заказа"""
+    if weekdays == EVERY_DAY:
+        return "ежедневно"
+    if weekdays == WORKDAYS:
+        return "по будням"
+    if weekdays == WEEKEND:
+        return "по выходным"
+    days_ru = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+    return ", ".join(day for i, day in enumerate(days_ru) if weekdays >> i & 1)
+
+
 def get_time_keyboard(car_id: int, tomorrow: bool = False) -> InlineKeyboardMarkup:
     """Клавиатура с выбором времени (6-21 с шагом 1 час)"""
+    key = ("time", car_id, tomorrow, datetime.now(MSK).date())
+    markup = keyboard_cache.get(key)
+    if markup is not None:
+        return markup
+
     buttons = []
     row = []
     prefix = "tomorrow" if tomorrow else "today"
@@ -128,30 +258,103 @@ def get_time_keyboard(car_id: int, tomorrow: bool = False) -> InlineKeyboardMark
         buttons.append([InlineKeyboardButton(text=f"Завтра {tomorrow_label} ➡️", callback_data=f"day:{car_id}:tomorrow")])
 
     buttons.append([InlineKeyboardButton(text="Отмена", callback_data="cancel")])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+    return keyboard_cache.put(key, InlineKeyboardMarkup(inline_keyboard=buttons))
+
+
+async def submit_and_record(chat_id: int, car: tuple, entry_time: datetime) -> dict:
+    """Оформляет пропуск через очередь заявок и сохраняет в историю чата"""
+    car_id, car_name, car_number, car_model = car
+
+    result, fresh = await submit_queue.submit(chat_id, car_number, car_model, entry_time)
+
+    # Такую же заявку этот чат уже ждёт — она попадёт в историю один раз.
+    # Другие чаты, ждущие тот же ответ, пишут её каждый в свою
+    if fresh:
+        await add_parking_order(chat_id, car_name, car_number, car_model, entry_time, result.get("message", ""))
+
+    return result
+
+
+async def order_pass(message: types.Message, car: tuple, entry_time: datetime):
+    """Оформляет пропуск и отвечает в чат"""
+    result = await submit_and_record(message.chat.id, car, entry_time)
+    response_text = result.get("message", "Нет ответа")
+    await message.answer(f"Ответ сайта:\n\n{response_text}")
+
+
+async def order_passes(message: types.Message, cars: list[tuple], entry_time: datetime):
+    """
+    Оформляет пропуска на несколько машин одновременно, пишет их в историю
+    одной транзакцией и отвечает одним сообщением
+    """
+    results = await asyncio.gather(*(
+        submit_queue.submit(message.chat.id, car_number, car_model, entry_time)
+        for car_id, car_name, car_number, car_model in cars
+    ))
+
+    await add_parking_orders(message.chat.id, [
+        (car_name, car_number, car_model, entry_time, result.get("message", ""))
+        for (car_id, car_name, car_number, car_model), (result, fresh) in zip(cars, results)
+        if fresh
+    ])
+
+    # Делим лимит сообщения Telegram между машинами
+    limit = 3500 // len(cars)
+    text = f"Ответы сайта ({entry_time.strftime('%d.%m.%Y %H:%M')}):\n"
+    for (car_id, car_name, car_number, car_model), (result, fresh) in zip(cars, results):
+        mark = "✅" if result.get("success") else "❌"
+        response_text = result.get("message", "Нет ответа")
+        if len(response_text) > limit:
+            response_text = response_text[:limit] + "..."
+        text += f"\n{mark} {car_name} ({car_number}):\n{response_text}\n"
+
+    await message.answer(text)
+
+
+async def fire_scheduled_order(bot: Bot, order: tuple, entry_time: datetime) -> bool:
+    """Срабатывание планового заказа. False — машины больше нет, план отменяется"""
+    order_id, chat_id, car_id = order[:3]
+    car = await get_car_by_id(chat_id, car_id)
+    if not car:
+        await bot.send_message(chat_id, f"План #{order_id}: машина удалена, план отменён.")
+        return False
+
+    result = await submit_and_record(chat_id, car, entry_time)
+    response_text = result.get("message", "Нет ответа")
+    await bot.send_message(
+        chat_id,
+        f"План #{order_id}: {car[1]} ({car[2]}), въезд {entry_time.strftime('%d.%m.%Y %H:%M')}\n\n"
+        f"Ответ сайта:\n\n{response_text}"
+    )
+    return True
 
 
 # === Команды ===
 
-@dp.message(Command("start"))
+@router.message(Command("start"))
 async def cmd_start(message: types.Message):
     await message.answer(
         "Привет! Я помогу заказать пропуск на parkspot.ru\n\n"
         "Быстрый заказ:\n"
         "+ — интерактивное меню\n"
         "15:30 — выбрать машину и оформить\n"
-        "секвойя 15:30 — сразу оформить\n\n"
+        "секвойя 15:30 — сразу оформить\n"
+        "секвойя, панама 15:30 — на несколько машин\n"
+        "@бот сек 15 в личном чате с ботом — подсказки для заказа в одно касание\n\n"
+        "У каждого чата свой список машин.\n\n"
         "Команды:\n"
         "/cars — список машин\n"
         "/add — добавить машину\n"
         "/del — удалить машину\n"
-        "/history — активные парковки"
+        "/history — активные парковки\n"
+        "/plan — плановый заказ (по будням 09:00 секвойя)\n"
+        "/plans — список планов"
     )
 
 
-@dp.message(Command("cars"))
+@router.message(Command("cars"))
 async def cmd_cars(message: types.Message):
-    cars = get_all_cars()
+    cars = await get_all_cars(message.chat.id)
     if not cars:
         await message.answer("База машин пуста. Добавь машину: /add")
         return
@@ -163,7 +366,17 @@ async def cmd_cars(message: types.Message):
     await message.answer(text)
 
 
-@dp.message(Command("add"))
+@router.message(Command("legacy"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_legacy(message: types.Message):
+    """Администратор отдаёт этому чату ничей общий парк прежней версии"""
+    cars, orders = await async_db.claim_legacy_fleet(message.chat.id)
+    if cars or orders:
+        await message.answer(f"Общий парк передан этому чату: машин {cars}, заказов {orders}.")
+    else:
+        await message.answer("Ничьего общего парка нет.")
+
+
+@router.message(Command("add"))
 async def cmd_add(message: types.Message):
     # Проверяем есть ли аргументы после /add
     text = message.text.strip()
@@ -185,30 +398,53 @@ async def cmd_add(message: types.Message):
 
     name, number, model = parts
 
-    if get_car_by_name(name):
+    if await get_car_by_name(message.chat.id, name):
         await message.answer(f"Машина '{name}' уже существует.")
         return
 
-    if add_car(name, number, model):
+    if await add_car(message.chat.id, name, number, model):
         await message.answer(f"✅ Машина добавлена:\n{name}: {number.upper()} ({model})")
     else:
         await message.answer("Ошибка при добавлении машины.")
 
 
-@dp.message(Command("del"))
+@router.message(Command("del"))
 async def cmd_del(message: types.Message):
-    cars = get_all_cars()
+    cars = await get_all_cars(message.chat.id)
     if not cars:
         await message.answer("База машин пуста.")
         return
 
-    await message.answer("Выбери машину для удаления:", reply_markup=get_delete_keyboard())
+    await message.answer("Выбери машину для удаления:", reply_markup=await get_delete_keyboard(message.chat.id))
+
+
+HISTORY_PAGE_SIZE = 5
+
+
+def format_history_page(orders: list[tuple]) -> tuple[str, InlineKeyboardMarkup | None]:
+    """
+    Страница истории заказов. orders запрошены с запасом в один заказ:
+    если он есть, показываем кнопку следующей страницы.
+    """
+    text = ""
+    for order in orders[:HISTORY_PAGE_SIZE]:
+        order_id, car_name, car_number, car_model, entry_time, created_at, response = order
+        text += f"• {car_name}: {entry_time.strftime('%d.%m %H:%M')} (заказ {created_at.strftime('%d.%m %H:%M')})\n"
+
+    if len(orders) <= HISTORY_PAGE_SIZE:
+        return text, None
+
+    created_ts, order_id = order_page_key(orders[HISTORY_PAGE_SIZE - 1])
+    markup = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="Дальше ➡️", callback_data=f"hist:{created_ts}:{order_id}")
+    ]])
+    return text, markup
 
 
-@dp.message(Command("history"))
+@router.message(Command("history"))
 async def cmd_history(message: types.Message):
-    active = get_active_orders()
-    recent = get_recent_orders(5)
+    active = await get_active_orders(message.chat.id)
+    recent = await get_recent_orders(message.chat.id, HISTORY_PAGE_SIZE + 1)
 
     text = ""
 
@@ -216,31 +452,114 @@ async def cmd_history(message: types.Message):
         text += "✅ Активные парковки:\n\n"
         for order in active:
             order_id, car_name, car_number, car_model, entry_time, created_at, response = order
-            entry_dt = datetime.fromisoformat(entry_time)
             text += f"• {car_name} ({car_number})\n"
-            text += f"  Въезд: {entry_dt.strftime('%d.%m.%Y %H:%M')}\n\n"
+            text += f"  Въезд: {entry_time.strftime('%d.%m.%Y %H:%M')}\n\n"
     else:
         text += "Нет активных парковок.\n\n"
 
+    markup = None
     if recent:
-        text += "📋 Последние заказы:\n\n"
-        for order in recent:
-            order_id, car_name, car_number, car_model, entry_time, created_at, response = order
-            entry_dt = datetime.fromisoformat(entry_time)
-            created_dt = datetime.fromisoformat(created_at)
-            text += f"• {car_name}: {entry_dt.strftime('%d.%m %H:%M')} (заказ {created_dt.strftime('%d.%m %H:%M')})\n"
+        page, markup = format_history_page(recent)
+        text += "📋 Последние заказы:\n\n" + page
+
+    await message.answer(text or "История пуста.", reply_markup=markup)
 
-    await message.answer(text or "История пуста.")
+
+@router.message(Command("plan"))
+async def cmd_plan(message: types.Message, scheduler: Scheduler):
+    parts = message.text.split(maxsplit=1)
+    if len(parts) < 2:
+        await message.answer(
+            "Плановый заказ:\n\n"
+            "/plan по будням 09:00 секвойя\n"
+            "/plan пн,ср,пт 08:30 панама\n"
+            "/plan ежедневно 10:00 паджеро\n"
+            "/plan завтра 10:00 секвойя — разовый\n\n"
+            f"Пропуск оформляется за {SCHEDULE_LEAD_MINUTES} мин до въезда."
+        )
+        return
+
+    text = parts[1].strip().lower()
+
+    # Имя машины — одно из слов
+    car = None
+    for word in re.split(r"[\s,]+", text):
+        car = await get_car_by_name(message.chat.id, word)
+        if car:
+            break
+
+    if not car:
+        await message.answer("Не нашёл машину. Список машин: /cars")
+        return
+
+    rest = re.sub(rf"(?<!\w){re.escape(car[1])}(?!\w)", " ", text)
+    weekdays = parse_weekdays(rest)
+    entry_time = parse_time(rest)
+
+    if entry_time is None:
+        await message.answer("Не понял время. Пример: /plan по будням 09:00 секвойя")
+        return
+
+    once_date = None if weekdays else entry_time.date().isoformat()
+    if not weekdays and entry_time <= datetime.now(MSK).replace(tzinfo=None):
+        await message.answer("Это время уже прошло.")
+        return
+
+    order = await add_scheduled_order(
+        message.chat.id, car[0], weekdays, entry_time.hour, entry_time.minute, once_date
+    )
+    next_time = scheduler.add(order)
+
+    when = describe_weekdays(weekdays) if weekdays else "разово"
+    text = f"✅ План #{order[0]}: {car[1]} ({car[2]}), {when} в {entry_time.strftime('%H:%M')}"
+    if next_time:
+        text += f"\nБлижайший въезд: {next_time.strftime('%d.%m.%Y %H:%M')}"
+    await message.answer(text)
+
+
+@router.message(Command("plans"))
+async def cmd_plans(message: types.Message, scheduler: Scheduler):
+    plans = scheduler.orders_for_chat(message.chat.id)
+    if not plans:
+        await message.answer("Планов нет. Добавить: /plan")
+        return
+
+    text = "🗓 Планы:\n\n"
+    for order, next_time in plans:
+        order_id, chat_id, car_id, weekdays, hour, minute = order[:6]
+        car = await get_car_by_id(message.chat.id, car_id)
+        car_name = car[1] if car else "?"
+        when = describe_weekdays(weekdays) if weekdays else "разово"
+        text += f"#{order_id} {car_name}: {when} в {hour:02d}:{minute:02d}, ближайший {next_time.strftime('%d.%m %H:%M')}\n"
+    text += "\nОтменить: /unplan номер"
+
+    await message.answer(text)
+
+
+@router.message(Command("unplan"))
+async def cmd_unplan(message: types.Message, scheduler: Scheduler):
+    parts = message.text.split()
+    if len(parts) < 2 or not parts[1].lstrip("#").isdigit():
+        await message.answer("Формат: /unplan номер\nСписок планов: /plans")
+        return
+
+    order_id = int(parts[1].lstrip("#"))
+    own = any(order[0] == order_id for order, _ in scheduler.orders_for_chat(message.chat.id))
+    if own and await scheduler.remove(order_id):
+        await message.answer(f"✅ План #{order_id} отменён.")
+    else:
+        await message.answer("План не найден.")
 
 
 # === Callback обработчики ===
 
-@dp.callback_query(F.data.startswith("del:"))
+@router.callback_query(F.data.startswith("del:"))
 async def callback_delete(callback: CallbackQuery):
     car_id = int(callback.data.split(":")[1])
-    car = get_car_by_id(car_id)
+    chat_id = callback.message.chat.id
+    car = await get_car_by_id(chat_id, car_id)
 
-    if car and delete_car_by_id(car_id):
+    if car and await delete_car_by_id(chat_id, car_id):
         await callback.message.edit_text(f"✅ Машина '{car[1]}' удалена.")
     else:
         await callback.message.edit_text("Машина не найдена.")
@@ -248,17 +567,34 @@ async def callback_delete(callback: CallbackQuery):
     await callback.answer()
 
 
-@dp.callback_query(F.data == "cancel")
+@router.callback_query(F.data.startswith("hist:"))
+async def callback_history_page(callback: CallbackQuery):
+    """Следующая страница истории"""
+    parts = callback.data.split(":")
+    before = (int(parts[1]), int(parts[2]))
+
+    orders = await get_recent_orders(callback.message.chat.id, HISTORY_PAGE_SIZE + 1, before=before)
+    if not orders:
+        await callback.answer(f"Дальше пусто. Заказы старше {ORDER_RETENTION_DAYS} дней в архиве.")
+        return
+
+    page, markup = format_history_page(orders)
+    await callback.message.answer("📋 Заказы раньше:\n\n" + page, reply_markup=markup)
+    await callback.message.edit_reply_markup(reply_markup=None)
+    await callback.answer()
+
+
+@router.callback_query(F.data == "cancel")
 async def callback_cancel(callback: CallbackQuery):
     await callback.message.edit_text("Отменено.")
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("menu:"))
+@router.callback_query(F.data.startswith("menu:"))
 async def callback_menu_car(callback: CallbackQuery):
     """Выбор машины в меню +"""
     car_id = int(callback.data.split(":")[1])
-    car = get_car_by_id(car_id)
+    car = await get_car_by_id(callback.message.chat.id, car_id)
 
     if not car:
         await callback.message.edit_text("Машина не найдена.")
@@ -274,14 +610,14 @@ async def callback_menu_car(callback: CallbackQuery):
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("day:"))
+@router.callback_query(F.data.startswith("day:"))
 async def callback_switch_day(callback: CallbackQuery):
     """Переключение Сегодня/Завтра"""
     parts = callback.data.split(":")
     car_id = int(parts[1])
     day = parts[2]
 
-    car = get_car_by_id(car_id)
+    car = await get_car_by_id(callback.message.chat.id, car_id)
     if not car:
         await callback.message.edit_text("Машина не найдена.")
         await callback.answer()
@@ -298,7 +634,7 @@ async def callback_switch_day(callback: CallbackQuery):
     await callback.answer()
 
 
-@dp.callback_query(F.data.startswith("time:"))
+@router.callback_query(F.data.startswith("time:"))
 async def callback_select_time(callback: CallbackQuery):
     """Выбор времени и оформление пропуска"""
     parts = callback.data.split(":")
@@ -306,7 +642,7 @@ async def callback_select_time(callback: CallbackQuery):
     day = parts[2]  # today или tomorrow
     hour = int(parts[3])
 
-    car = get_car_by_id(car_id)
+    car = await get_car_by_id(callback.message.chat.id, car_id)
     if not car:
         await callback.message.edit_text("Машина не найдена.")
         await callback.answer()
@@ -330,25 +666,21 @@ async def callback_select_time(callback: CallbackQuery):
     )
     await callback.answer()
 
-    result = await submit_pass(car_number, car_model, entry_time)
-    add_parking_order(car_name, car_number, car_model, entry_time, result.get("message", ""))
+    await order_pass(callback.message, car, entry_time)
 
-    response_text = result.get("message", "Нет ответа")
-    await callback.message.answer(f"Ответ сайта:\n\n{response_text}")
 
-
-@dp.callback_query(F.data.startswith("park:"))
+@router.callback_query(F.data.startswith("park:"))
 async def callback_park(callback: CallbackQuery):
     user_id = callback.from_user.id
     car_id = int(callback.data.split(":")[1])
 
-    if user_id not in pending_time:
+    entry_time = await pending_time.pop(user_id)
+    if entry_time is None:
         await callback.message.edit_text("Время не найдено. Напиши время заново.")
         await callback.answer()
         return
 
-    entry_time = pending_time.pop(user_id)
-    car = get_car_by_id(car_id)
+    car = await get_car_by_id(callback.message.chat.id, car_id)
 
     if not car:
         await callback.message.edit_text("Машина не найдена.")
@@ -364,29 +696,202 @@ async def callback_park(callback: CallbackQuery):
     )
     await callback.answer()
 
-    result = await submit_pass(car_number, car_model, entry_time)
+    await order_pass(callback.message, car, entry_time)
 
-    # Сохраняем в историю
-    add_parking_order(car_name, car_number, car_model, entry_time, result.get("message", ""))
 
-    response_text = result.get("message", "Нет ответа")
-    await callback.message.answer(f"Ответ сайта:\n\n{response_text}")
+@router.callback_query(F.data.startswith("pick:"))
+async def callback_pick(callback: CallbackQuery):
+    """Выбор нескольких машин для одного времени"""
+    user_id = callback.from_user.id
+    action = callback.data.split(":")[1]
+
+    entry_time = await pending_time.get(user_id)
+    if entry_time is None:
+        await callback.message.edit_text("Время не найдено. Напиши время заново.")
+        await callback.answer()
+        return
+
+    selected = set(await pending_picks.get(user_id, []))
+
+    if action == "start":
+        selected = set()
+    elif action == "go":
+        if not selected:
+            await callback.answer("Отметь хотя бы одну машину")
+            return
+
+        await pending_picks.pop(user_id)
+        await pending_time.pop(user_id)
+        cars = [car for car in await get_all_cars(callback.message.chat.id) if car[0] in selected]
+        await callback.message.edit_text(
+            f"Оформляю пропуска ({len(cars)})...\n"
+            + "\n".join(f"Машина: {car[1]} ({car[2]}, {car[3]})" for car in cars)
+            + f"\nВремя: {entry_time.strftime('%d.%m.%Y %H:%M')}"
+        )
+        await callback.answer()
+        await order_passes(callback.message, cars, entry_time)
+        return
+    else:
+        selected ^= {int(action)}
+
+    await pending_picks.set(user_id, sorted(selected))
+    await callback.message.edit_reply_markup(reply_markup=await get_pick_keyboard(callback.message.chat.id, selected))
+    await callback.answer()
+
+
+# === Inline-режим ===
+# "@бот сек 15" в чате с ботом: подсказки "машина + время", выбранная
+# отправляется обычным сообщением "секвойя 15:00" и оформляется как заказ
+# текстом. Подсказки берутся из парка этого чата, поэтому в других чатах
+# их нет: там имя из сообщения означало бы машину другого парка (или
+# никакую), а не ту, что показана в подсказке.
+# Inline-режим включается у @BotFather: /setinline
+
+INLINE_RESULTS = 20
+INLINE_HOURS = 3
+WEEKDAY_NAMES = ["понедельник", "вторник", "среда", "четверг", "пятница", "суббота", "воскресенье"]
+
+
+class InlineCache:
+    """
+    Готовые inline-подсказки по (пользователь, запрос, версия машин) на ttl секунд.
+    Пока пользователь набирает и стирает запрос, повторные варианты
+    отдаются без разбора. TTL у всех записей одинаковый, поэтому
+    просроченные всегда в начале.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._items: OrderedDict[tuple, tuple[float, list]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: tuple) -> list | None:
+        entry = self._items.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: tuple, results: list) -> list:
+        now = time.monotonic()
+        self._items[key] = (now + self.ttl, results)
+        self._items.move_to_end(key)
+        while self._items and (len(self._items) > self.max_size or next(iter(self._items.values()))[0] <= now):
+            self._items.popitem(last=False)
+        return results
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+inline_cache = InlineCache(INLINE_CACHE_TTL, STATE_MAX_SIZE)
+
+
+def entry_phrase(entry_time: datetime, now: datetime) -> str | None:
+    """Время въезда так, как его понимает parse_time: 'завтра 15:00'. None — дальше недели"""
+    days = (entry_time.date() - now.date()).days
+    clock = entry_time.strftime('%H:%M')
+    if days == 0:
+        return clock
+    if days == 1:
+        return f"завтра {clock}"
+    if days == 2:
+        return f"послезавтра {clock}"
+    if 0 < days < 7:
+        return f"{WEEKDAY_NAMES[entry_time.weekday()]} {clock}"
+    return None
+
+
+async def build_inline_results(user_id: int, query: str) -> list[InlineQueryResultArticle]:
+    """Подсказки: машины по началу первого слова (или все) × время из остального текста"""
+    now = datetime.now(MSK).replace(tzinfo=None, second=0, microsecond=0)
+    words = query.split(maxsplit=1)
+
+    cars = []
+    time_text = query
+    # Имя целиком и за ним время: "секвойя 15", "секвойя15:30".
+    # Одно слово без времени — начало имени: "сек" подсказывает и "секвойю"
+    if match := await match_car_prefix(user_id, query):
+        car, name_len = match
+        if name_len < len(query) and not query[name_len].isalpha():
+            cars, time_text = [car], query[name_len:]
+    if not cars and words and not words[0][0].isdigit():
+        cars = await cars_starting_with(user_id, words[0], INLINE_RESULTS)
+        if cars:
+            time_text = words[1] if len(words) > 1 else ""
+    if not cars:
+        cars = (await get_all_cars(user_id))[:INLINE_RESULTS]
+
+    time_text = time_text.strip()
+    if time_text:
+        entry_time = parse_time_or_hour(time_text, now)
+        if entry_time is not None and entry_time <= now:
+            # Сегодня это время уже прошло — предлагаем завтра
+            entry_time += timedelta(days=1)
+        entry_times = [entry_time] if entry_time else []
+    else:
+        next_hour = now.replace(minute=0) + timedelta(hours=1)
+        entry_times = [next_hour + timedelta(hours=i) for i in range(INLINE_HOURS)]
+
+    results = []
+    for entry_time in entry_times:
+        phrase = entry_phrase(entry_time, now)
+        if phrase is None:
+            continue
+        for car_id, name, number, model in cars:
+            results.append(InlineQueryResultArticle(
+                id=f"{car_id}:{entry_time.strftime('%Y%m%d%H%M')}",
+                title=f"{name} — {entry_time.strftime('%d.%m %H:%M')}",
+                description=f"{number} ({model})",
+                input_message_content=InputTextMessageContent(message_text=f"{name} {phrase}"),
+            ))
+    return results[:INLINE_RESULTS]
+
+
+@router.inline_query()
+async def inline_order(inline_query: InlineQuery):
+    """Inline-подсказки для заказа в одно касание"""
+    if inline_query.chat_type != "sender":
+        await inline_query.answer([], cache_time=INLINE_CACHE_TTL, is_personal=True, button=InlineQueryResultsButton(
+            text="Заказ — в чате с ботом", start_parameter="inline",
+        ))
+        return
+
+    user_id = inline_query.from_user.id
+    query = inline_query.query.strip().lower()
+
+    car_registry = await get_car_registry(user_id)
+    key = (user_id, query, car_registry.version)
+    results = inline_cache.get(key)
+    if results is None:
+        results = inline_cache.put(key, await build_inline_results(user_id, query))
+
+    button = None
+    if not results:
+        button = InlineQueryResultsButton(
+            text="Нет машин — добавить" if not car_registry.all() else "Не понял время",
+            start_parameter="inline",
+        )
+    await inline_query.answer(results, cache_time=INLINE_CACHE_TTL, is_personal=True, button=button)
 
 
 # === Обработка сообщений с временем ===
 
-@dp.message(F.text == "+")
+@router.message(F.text == "+")
 async def handle_plus_menu(message: types.Message):
     """Интерактивное меню по нажатию +"""
-    cars = get_all_cars()
+    cars = await get_all_cars(message.chat.id)
     if not cars:
         await message.answer("База машин пуста. Добавь машину: /add")
         return
 
-    await message.answer("Выбери машину:", reply_markup=get_menu_cars_keyboard())
+    await message.answer("Выбери машину:", reply_markup=await get_menu_cars_keyboard(message.chat.id))
 
 
-@dp.message()
+@router.message()
 async def handle_message(message: types.Message):
     text = message.text
     if not text:
@@ -394,17 +899,18 @@ async def handle_message(message: types.Message):
 
     text_lower = text.strip().lower()
 
-    # Проверяем, указано ли имя машины
-    cars = get_all_cars()
-    found_car = None
+    # Имена машин чата в начале сообщения (самое длинное совпадение),
+    # несколько через запятую — пакетный заказ
+    found_cars = []
     time_part = text_lower
 
-    for car_id, name, number, model in cars:
-        if text_lower.startswith(name.lower()):
-            found_car = (car_id, name, number, model)
-            time_part = text_lower[len(name):].strip()
-            break
+    while match := await match_car_prefix(message.chat.id, time_part):
+        car, name_len = match
+        if car not in found_cars:
+            found_cars.append(car)
+        time_part = CAR_SEPARATOR_RE.sub("", time_part[name_len:], count=1)
 
+    time_part = time_part.strip()
     entry_time = parse_time(time_part)
 
     if entry_time is None:
@@ -412,12 +918,23 @@ async def handle_message(message: types.Message):
             "Не понял время. Примеры:\n"
             "  15:30\n"
             "  завтра 10:00\n"
-            "  секвойя 18:45"
+            "  секвойя 18:45\n"
+            "  секвойя, панама 18:45"
         )
         return
 
+    # Несколько машин — оформляем все сразу
+    if len(found_cars) > 1:
+        await message.answer(
+            f"Оформляю пропуска ({len(found_cars)})...\n"
+            + "\n".join(f"Машина: {car[1]} ({car[2]}, {car[3]})" for car in found_cars)
+            + f"\nВремя: {entry_time.strftime('%d.%m.%Y %H:%M')}"
+        )
+        await order_passes(message, found_cars, entry_time)
+
     # Если машина указана явно — сразу оформляем
-    if found_car:
+    elif found_cars:
+        found_car = found_cars[0]
         car_id, car_name, car_number, car_model = found_car
 
         await message.answer(
@@ -426,23 +943,139 @@ async def handle_message(message: types.Message):
             f"Время: {entry_time.strftime('%d.%m.%Y %H:%M')}"
         )
 
-        result = await submit_pass(car_number, car_model, entry_time)
-        add_parking_order(car_name, car_number, car_model, entry_time, result.get("message", ""))
-
-        response_text = result.get("message", "Нет ответа")
-        await message.answer(f"Ответ сайта:\n\n{response_text}")
+        await order_pass(message, found_car, entry_time)
     else:
         # Показываем клавиатуру для выбора машины
-        pending_time[message.from_user.id] = entry_time
+        await pending_time.set(message.from_user.id, entry_time)
         await message.answer(
             f"Время: {entry_time.strftime('%d.%m.%Y %H:%M')}\n\nВыбери машину:",
-            reply_markup=get_cars_keyboard("park")
+            reply_markup=await get_cars_keyboard(message.chat.id, "park")
         )
 
 
+async def archive_loop(interval: float = 6 * 3600):
+    """Периодически переносит старые заказы в архив"""
+    while True:
+        # По пачке за вызов: между пачками поток БД выполняет запросы обработчиков
+        moved = batch = await archive_orders(ORDER_RETENTION_DAYS)
+        while batch == ARCHIVE_BATCH_SIZE:
+            batch = await archive_orders(ORDER_RETENTION_DAYS)
+            moved += batch
+        if moved:
+            print(f"В архив перенесено заказов: {moved}", flush=True)
+        await asyncio.sleep(interval)
+
+
+def create_webhook_app(bot: Bot, dp: Dispatcher):
+    """aiohttp-приложение, принимающее обновления от Telegram на WEBHOOK_PATH"""
+    from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+    from aiohttp import web
+
+    class DrainingRequestHandler(SimpleRequestHandler):
+        """Перед закрытием сессии бота дожидается обновлений, которые ещё обрабатываются"""
+
+        async def close(self):
+            if self._background_feed_update_tasks:
+                await asyncio.gather(*self._background_feed_update_tasks, return_exceptions=True)
+            await super().close()
+
+    app = web.Application()
+    # Telegram получает 200 сразу, обновление обрабатывается в фоне: ошибка
+    # обработчика не вызовет повторную доставку (и второй пропуск), а долгий
+    # заказ не держит соединение Telegram. При остановке runner.cleanup()
+    # дожидается фоновых обработчиков до закрытия сессии, lifecycle — после
+    DrainingRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=WEBHOOK_SECRET or None,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Запуск в режиме webhook до SIGINT/SIGTERM"""
+    from aiohttp import web
+
+    check_webhook_config()
+    runner = web.AppRunner(create_webhook_app(bot, dp))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    # Без WEBHOOK_URL вебхук у Telegram не регистрируется: обновления можно слать POST-ом вручную
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+        )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    try:
+        await stop.wait()
+    finally:
+        if WEBHOOK_URL:
+            await bot.delete_webhook()
+        # Дожидается обработки уже принятых обновлений
+        await runner.cleanup()
+        await bot.session.close()
+
+
+def register_metrics():
+    """Счётчики компонентов в /metrics"""
+    registry.collector("parkspot_submit_queue", submit_queue.stats)
+    registry.collector("parkspot_cookies", parkspot_session.stats)
+    registry.collector("parkspot_breaker", parkspot_breaker.stats)
+    registry.collector("parkspot_car_cache", car_cache_stats)
+    registry.collector("parkspot_keyboard_cache", keyboard_cache.stats)
+    registry.collector("parkspot_inline_cache", inline_cache.stats)
+    registry.collector("parkspot_pending_time", pending_time.stats)
+    registry.collector("parkspot_throttle", throttling.stats)
+    registry.collector("parkspot_send", send_limiter.stats)
+    registry.collector("parkspot_profiler", profiler.stats)
+
+
+@asynccontextmanager
+async def lifecycle(scheduler: Scheduler, metrics_port: int = METRICS_PORT, archive: bool = True):
+    """Фоновые части бота на время работы: метрики, диалоги, планировщик, архивация"""
+    register_metrics()
+    metrics_runner = await start_metrics_server(METRICS_HOST, metrics_port) if metrics_port else None
+    await pending_time.load()
+    await pending_picks.load()
+    await scheduler.start()
+    archive_task = asyncio.create_task(archive_loop()) if archive else None
+    if PROFILE_ON_START:
+        await profiler.start(PROFILE_ON_START)
+    try:
+        yield
+    finally:
+        await profiler.stop()
+        if archive_task is not None:
+            archive_task.cancel()
+        await scheduler.stop()
+        await submit_queue.stop()
+        await parkspot_session.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        async_db.shutdown()
+
+
 async def main():
-    print("Бот запущен...", flush=True)
-    await dp.start_polling(bot)
+    bot = create_bot()
+    scheduler = Scheduler(partial(fire_scheduled_order, bot))
+    dp = create_dispatcher(scheduler)
+
+    print(f"Бот запущен ({RUN_MODE})...", flush=True)
+    await init_db()
+    async with lifecycle(scheduler):
+        if RUN_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
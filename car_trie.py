@@ -0,0 +1,94 @@
+"""Префиксное дерево по именам машин для разбора сообщений вида 'секвойя 15:30'"""
+
+
+class _Node:
+    __slots__ = ("children", "car")
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        self.car: tuple | None = None
+
+
+class CarNameTrie:
+    """
+    Trie по именам машин в нижнем регистре.
+
+    longest_prefix() находит самое длинное имя, с которого начинается текст,
+    за время, пропорциональное длине текста, а не числу машин.
+    starting_with() перечисляет имена с заданным началом (для inline-подсказок).
+    """
+
+    def __init__(self):
+        self._root = _Node()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def clear(self) -> None:
+        self._root = _Node()
+        self._size = 0
+
+    def insert(self, name: str, car: tuple) -> None:
+        node = self._root
+        for ch in name.lower():
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _Node()
+            node = child
+        if node.car is None:
+            self._size += 1
+        node.car = car
+
+    def remove(self, name: str) -> bool:
+        """Удалить имя, подрезая опустевшие ветки. True если имя было"""
+        path = []
+        node = self._root
+        for ch in name.lower():
+            child = node.children.get(ch)
+            if child is None:
+                return False
+            path.append((node, ch))
+            node = child
+        if node.car is None:
+            return False
+        node.car = None
+        self._size -= 1
+        for parent, ch in reversed(path):
+            child = parent.children[ch]
+            if child.car is not None or child.children:
+                break
+            del parent.children[ch]
+        return True
+
+    def longest_prefix(self, text: str) -> tuple[tuple, int] | None:
+        """
+        Самое длинное имя машины, с которого начинается text (уже в нижнем регистре).
+        Возвращает (машина, длина имени) или None.
+        """
+        node = self._root
+        found = None
+        for i, ch in enumerate(text, 1):
+            node = node.children.get(ch)
+            if node is None:
+                break
+            if node.car is not None:
+                found = (node.car, i)
+        return found
+
+    def starting_with(self, prefix: str, limit: int | None = None) -> list[tuple]:
+        """Машины, имя которых начинается с prefix (в нижнем регистре), по алфавиту, не больше limit"""
+        node = self._root
+        for ch in prefix:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+
+        found = []
+        stack = [node]
+        while stack and (limit is None or len(found) < limit):
+            node = stack.pop()
+            if node.car is not None:
+                found.append(node.car)
+            stack.extend(node.children[ch] for ch in sorted(node.children, reverse=True))
+        return found
@@ -0,0 +1,386 @@
+"""
+Запуск на нескольких процессах.
+
+    CLUSTER_WORKERS=4 WEBHOOK_URL=https://... python cluster.py
+
+Главный процесс принимает webhook от Telegram и раскладывает обновления
+по воркерам: чат всегда попадает к воркеру chat_id % CLUSTER_WORKERS,
+поэтому его обновления обрабатываются по порядку. Воркер — обычный
+Dispatcher со своим планировщиком (только заказы своих чатов).
+
+Запись в базу идёт через один процесс-писатель, чтение — в каждом
+воркере напрямую (WAL). Так SQLite не упирается в блокировку записи.
+Одновременные заявки на parkspot.ru (SUBMIT_WORKERS) делятся между
+воркерами. Выигрыш есть только при нескольких ядрах: на одном ядре
+два воркера медленнее одного процесса (loadtest.py --workers).
+
+GET /health отвечает 503, если какой-то процесс умер; тогда кластер
+останавливается с кодом 1, перезапуск — дело супервизора.
+"""
+import asyncio
+import itertools
+import multiprocessing
+import pickle
+import queue
+import signal
+import threading
+
+# Как часто главный процесс проверяет, живы ли воркеры и писатель.
+# Умерший процесс на месте не перезапускается: он мог умереть посреди
+# чтения очереди, не отпустив её блокировку, и новый повис бы на ней.
+# Поэтому кластер останавливается с ненулевым кодом, а поднимает его
+# супервизор (systemd, docker restart) — с новыми очередями
+WATCH_INTERVAL = 5
+
+# Сколько при остановке ждать воркер, прежде чем завершить его принудительно
+STOP_TIMEOUT = 60
+
+# Процессы запускаются через spawn: этот модуль импортируется в каждом из них,
+# поэтому модули бота подключаются только внутри функций
+
+
+def update_chat_id(update: dict) -> int:
+    """Чат обновления (для inline-запросов и т.п. — пользователь), 0 — если не определить"""
+    for event in update.values():
+        if not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        if "from" in event:
+            return event["from"]["id"]
+    return 0
+
+
+def submit_share(total: int, index: int, count: int) -> int:
+    """
+    Доля воркера index в одновременных заявках на parkspot.ru: в сумме total,
+    чтобы сайт не получал count × total запросов. Не меньше одной на воркер.
+    """
+    return max(total // count + (index < total % count), 1)
+
+
+# === Процесс-писатель ===
+
+def writer_main(requests, responses: list):
+    """
+    Выполняет функции записи database.py по очереди, одним соединением.
+    Запрос: (номер воркера, id запроса, имя функции, аргументы), None — остановка.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    import database
+
+    database.init_db()
+    while (request := requests.get()) is not None:
+        worker, request_id, name, args = request
+        try:
+            reply = (request_id, True, getattr(database, name)(*args))
+        except Exception as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(repr(e))
+            reply = (request_id, False, e)
+        responses[worker].put(reply)
+    database.close_db()
+
+
+class WriterClient:
+    """
+    Сторона воркера: отправляет функции записи писателю и ждёт ответа,
+    не блокируя event loop. Подключается через async_db.use_writer.
+    """
+
+    def __init__(self, worker: int, requests, responses):
+        self.worker = worker
+        self.requests = requests
+        self.responses = responses
+        self.calls = 0
+        self._ids = itertools.count()
+        self._futures: dict[int, asyncio.Future] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._thread = threading.Thread(target=self._read, name="writer-client", daemon=True)
+        self._thread.start()
+
+    def _read(self):
+        while (reply := self.responses.get()) is not None:
+            self._loop.call_soon_threadsafe(self._resolve, *reply)
+
+    def _resolve(self, request_id: int, ok: bool, result):
+        future = self._futures.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(result)
+
+    async def call(self, name: str, *args):
+        request_id = next(self._ids)
+        future = self._loop.create_future()
+        self._futures[request_id] = future
+        self.calls += 1
+        self.requests.put((self.worker, request_id, name, args))
+        return await future
+
+    def close(self):
+        if self._thread is not None:
+            self.responses.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "waiting": len(self._futures)}
+
+
+# === Воркер ===
+
+def worker_main(index: int, count: int, updates, requests, responses, ready,
+                bot_factory=None, results=None):
+    """
+    Процесс-обработчик: Dispatcher для чатов chat_id % count == index.
+    ready — семафор, который отпускается после запуска;
+    bot_factory — функция, создающая Bot (по умолчанию bot.create_bot);
+    results — очередь, куда при остановке отправляется
+    (номер, время обработки каждого обновления, время окончания последнего).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    # Общие лимиты обновлений и исходящих сообщений делятся между воркерами.
+    # Меняем до импорта bot: он читает их при импорте
+    import config
+    for name in ("GLOBAL_RATE_LIMIT", "GLOBAL_RATE_BURST", "SEND_RATE_LIMIT"):
+        setattr(config, name, getattr(config, name) / count)
+    config.SUBMIT_WORKERS = submit_share(config.SUBMIT_WORKERS, index, count)
+
+    asyncio.run(_run_worker(index, count, updates, requests, responses, ready, bot_factory, results))
+
+
+async def _run_worker(index, count, updates, requests, responses, ready, bot_factory, results):
+    from functools import partial
+    import time
+
+    import async_db
+    import bot as bot_module
+    from config import METRICS_PORT
+    from metrics import registry
+    from scheduler import Scheduler
+
+    writer = WriterClient(index, requests, responses)
+    writer.start()
+    async_db.use_writer(writer)
+    registry.collector("parkspot_writer_client", writer.stats)
+
+    bot = (bot_factory or bot_module.create_bot)()
+    scheduler = Scheduler(partial(bot_module.fire_scheduled_order, bot), partition=(index, count))
+    dp = bot_module.create_dispatcher(scheduler)
+    latencies: list[float] = []
+    finished_at = 0.0
+
+    # Последняя задача каждого чата: следующее обновление чата ждёт её,
+    # разные чаты обрабатываются параллельно
+    tails: dict[int, asyncio.Task] = {}
+
+    async def handle(update: dict, previous: asyncio.Task | None):
+        nonlocal finished_at
+        if previous is not None:
+            await asyncio.wait([previous])
+        start = time.perf_counter()
+        try:
+            await dp.feed_raw_update(bot, update)
+        except Exception as e:
+            print(f"Воркер {index}: ошибка обработки {update.get('update_id')}: {e}", flush=True)
+        if results is not None:
+            latencies.append(time.perf_counter() - start)
+            finished_at = time.time()
+
+    def forget(chat_id: int, task: asyncio.Task):
+        if tails.get(chat_id) is task:
+            del tails[chat_id]
+
+    loop = asyncio.get_running_loop()
+    metrics_port = METRICS_PORT + index if METRICS_PORT else 0
+    async with bot_module.lifecycle(scheduler, metrics_port=metrics_port, archive=index == 0):
+        print(f"Воркер {index} из {count} запущен", flush=True)
+        ready.release()
+        while (update := await loop.run_in_executor(None, updates.get)) is not None:
+            chat_id = update_chat_id(update)
+            task = asyncio.create_task(handle(update, tails.get(chat_id)))
+            tails[chat_id] = task
+            task.add_done_callback(partial(forget, chat_id))
+
+        if tails:
+            await asyncio.wait(list(tails.values()))
+        await bot.session.close()
+
+    if results is not None:
+        results.put((index, latencies, finished_at))
+
+
+# === Главный процесс ===
+
+class Cluster:
+    """Процесс-писатель и count воркеров с очередями между ними"""
+
+    def __init__(self, count: int, bot_factory=None, collect_results: bool = False):
+        context = multiprocessing.get_context("spawn")
+        self.count = count
+        self.updates = [context.Queue() for _ in range(count)]
+        self.requests = context.Queue()
+        self.responses = [context.Queue() for _ in range(count)]
+        self.results = context.Queue() if collect_results else None
+        self.collected: list[tuple[int, list[float], float]] = []
+        self._ready = context.Semaphore(0)
+        self._writer = context.Process(
+            target=writer_main, args=(self.requests, self.responses), name="parkspot-writer",
+        )
+        self._workers = [
+            context.Process(
+                target=worker_main,
+                args=(index, count, self.updates[index], self.requests, self.responses[index],
+                      self._ready, bot_factory, self.results),
+                name=f"parkspot-worker-{index}",
+            )
+            for index in range(count)
+        ]
+
+    def start(self):
+        self._writer.start()
+        for worker in self._workers:
+            worker.start()
+
+    def wait_ready(self):
+        """Дождаться запуска всех воркеров"""
+        for _ in self._workers:
+            self._ready.acquire()
+
+    def feed(self, update: dict):
+        """Передать обновление воркеру его чата"""
+        self.updates[update_chat_id(update) % self.count].put(update)
+
+    def dead(self) -> list[str]:
+        """Имена завершившихся процессов (пусто — все живы)"""
+        return [
+            f"{process.name} (код {process.exitcode})"
+            for process in (self._writer, *self._workers) if not process.is_alive()
+        ]
+
+    def stop(self):
+        """Дождаться обработки переданных обновлений и остановить процессы"""
+        for updates in self.updates:
+            updates.put(None)
+        if self.results is not None:
+            # Умерший воркер результата не пришлёт: ждём, пока есть живые
+            self.collected = []
+            while len(self.collected) < self.count:
+                try:
+                    self.collected.append(self.results.get(timeout=1))
+                except queue.Empty:
+                    if not any(worker.is_alive() for worker in self._workers):
+                        break
+        for worker in self._workers:
+            self._join(worker)
+        self.requests.put(None)
+        self._join(self._writer)
+
+    @staticmethod
+    def _join(process):
+        process.join(STOP_TIMEOUT)
+        if process.is_alive():
+            print(f"{process.name} не остановился за {STOP_TIMEOUT} с, завершаю", flush=True)
+            process.terminate()
+            process.join()
+
+
+async def run_cluster(count: int) -> int:
+    """
+    Webhook-сервер, раздающий обновления воркерам, до SIGINT/SIGTERM
+    или смерти одного из процессов. Возвращает код выхода.
+    """
+    import secrets
+
+    from aiogram import Bot
+    from aiohttp import web
+
+    import database
+    from config import (
+        WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL, check_webhook_config, get_bot_token,
+    )
+
+    check_webhook_config()
+    # Схема готовится до запуска процессов, писатель застаёт её актуальной
+    database.init_db()
+    database.close_db()
+
+    cluster = Cluster(count)
+    cluster.start()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, cluster.wait_ready)
+    dead: list[str] = []
+    stop = asyncio.Event()
+
+    async def webhook(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and not secrets.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(), WEBHOOK_SECRET.encode(),
+        ):
+            return web.Response(status=401)
+        # Обновление для умершего воркера не обработается: пусть Telegram повторит позже
+        if dead:
+            return web.Response(status=503)
+        cluster.feed(await request.json())
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        if dead:
+            return web.Response(status=503, text="\n".join(dead))
+        return web.Response(text="ok")
+
+    async def watch():
+        while not (found := cluster.dead()):
+            await asyncio.sleep(WATCH_INTERVAL)
+        dead.extend(found)
+        print(f"Завершились: {', '.join(found)}; останавливаю кластер", flush=True)
+        stop.set()
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, webhook)
+    app.router.add_get("/health", health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+
+    bot = Bot(token=get_bot_token())
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+        )
+    print(f"Бот запущен (cluster, воркеров: {count})...", flush=True)
+
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    watcher = asyncio.create_task(watch())
+    try:
+        await stop.wait()
+    finally:
+        watcher.cancel()
+        if WEBHOOK_URL:
+            await bot.delete_webhook()
+        await runner.cleanup()
+        await bot.session.close()
+        await loop.run_in_executor(None, cluster.stop)
+    return 1 if dead else 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    from config import CLUSTER_WORKERS
+    sys.exit(asyncio.run(run_cluster(CLUSTER_WORKERS)))
@@ -1,9 +1,16 @@
 import os
+from datetime import timedelta, timezone
 
-# Telegram Bot Token (установить в переменных окружения)
+# Telegram Bot Token (установить в переменных окружения).
+# Проверяется при запуске бота, а не при импорте — модули можно
+# импортировать в утилитах и без токена
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не установлен! Добавь переменную окружения.")
+
+
+def get_bot_token() -> str:
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN не установлен! Добавь переменную окружения.")
+    return BOT_TOKEN
 
 # База машин: имя -> (номер, модель)
 CARS = {
@@ -15,5 +22,101 @@ CARS = {
 # Машина по умолчанию
 DEFAULT_CAR = "секвойя"
 
+# Московский часовой пояс (UTC+3)
+MSK = timezone(timedelta(hours=3))
+
+# Машины и заказы у каждого чата свои. Чат, которому достаются машины
+# по умолчанию и парк с историей общей базы прежних версий. Если не задан (0),
+# они остаются ничьими, пока администратор не отправит /legacy в нужный чат
+LEGACY_CHAT_ID = int(os.getenv("LEGACY_CHAT_ID", 0))
+
+# Для скольких чатов держать список машин в памяти
+CAR_CACHE_MAX_CHATS = int(os.getenv("CAR_CACHE_MAX_CHATS", 10000))
+
 # URL сайта
-PARKSPOT_URL = "https://parkspot.ru/"
+PARKSPOT_URL = os.getenv("PARKSPOT_URL", "https://parkspot.ru/")
+
+# Сколько секунд переиспользовать cookies parkspot.ru без повторного GET
+PARKSPOT_COOKIE_TTL = int(os.getenv("PARKSPOT_COOKIE_TTL", 30 * 60))
+
+# Режим работы: "polling" (по умолчанию) или "webhook". Внутри бота разница
+# около 1 мс на обновление (python bench.py webhook), webhook экономит лишь
+# запрос getUpdates к Telegram; нужен для cluster.py и хостингов без долгих соединений
+RUN_MODE = os.getenv("RUN_MODE", "polling")
+
+# Настройки webhook: публичный адрес, на который Telegram шлёт обновления,
+# и адрес aiohttp-сервера. По умолчанию сервер слушает только локальный адрес
+# (за reverse proxy); на внешнем интерфейсе без WEBHOOK_SECRET не запустится
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", 8080)))
+
+_LOCAL_HOSTS = {"127.0.0.1", "localhost", "::1"}
+
+
+def check_webhook_config():
+    """Сервер, доступный извне, принимает обновления только с секретом"""
+    if WEBHOOK_HOST not in _LOCAL_HOSTS and not WEBHOOK_SECRET:
+        raise ValueError(
+            f"WEBHOOK_HOST={WEBHOOK_HOST} открывает webhook снаружи, задай WEBHOOK_SECRET "
+            "(или слушай 127.0.0.1 за reverse proxy)."
+        )
+
+# Число процессов-обработчиков при запуске через cluster.py
+CLUSTER_WORKERS = int(os.getenv("CLUSTER_WORKERS", os.cpu_count() or 1))
+
+# Сколько заявок на parkspot.ru отправляется одновременно
+# (в режиме cluster — на все воркеры вместе, но не меньше одной на воркер)
+SUBMIT_WORKERS = int(os.getenv("SUBMIT_WORKERS", 4))
+
+# Повторы идемпотентных запросов к parkspot.ru и circuit breaker:
+# после BREAKER_THRESHOLD ошибок подряд сайт считается недоступным
+# на BREAKER_RESET_TIMEOUT секунд, потом проверяется пробным запросом
+PARKSPOT_RETRIES = int(os.getenv("PARKSPOT_RETRIES", 3))
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+
+# За сколько минут до времени въезда оформлять плановый заказ
+SCHEDULE_LEAD_MINUTES = int(os.getenv("SCHEDULE_LEAD_MINUTES", 60))
+
+# Заказы старше стольких дней переносятся в архив (сжатые, без дублей ответов)
+ORDER_RETENTION_DAYS = int(os.getenv("ORDER_RETENTION_DAYS", 30))
+
+# Незавершённый выбор (время, отмеченные машины) живёт STATE_TTL секунд,
+# хранится не больше STATE_MAX_SIZE пользователей; STATE_PERSIST=0 — только в памяти
+STATE_TTL = int(os.getenv("STATE_TTL", 30 * 60))
+STATE_MAX_SIZE = int(os.getenv("STATE_MAX_SIZE", 10000))
+STATE_PERSIST = os.getenv("STATE_PERSIST", "1") == "1"
+
+# Сколько секунд inline-подсказки пользователя переиспользуются без пересчёта
+# (столько же их кеширует у себя Telegram)
+INLINE_CACHE_TTL = int(os.getenv("INLINE_CACHE_TTL", 30))
+
+# Лимиты входящих обновлений (в секунду и запас на всплеск): на пользователя и общий
+USER_RATE_LIMIT = float(os.getenv("USER_RATE_LIMIT", 1))
+USER_RATE_BURST = float(os.getenv("USER_RATE_BURST", 5))
+GLOBAL_RATE_LIMIT = float(os.getenv("GLOBAL_RATE_LIMIT", 30))
+GLOBAL_RATE_BURST = float(os.getenv("GLOBAL_RATE_BURST", 60))
+
+# Лимиты исходящих сообщений под ограничения Telegram
+SEND_RATE_LIMIT = float(os.getenv("SEND_RATE_LIMIT", 25))
+SEND_CHAT_RATE_LIMIT = float(os.getenv("SEND_CHAT_RATE_LIMIT", 1))
+SEND_CHAT_RATE_BURST = float(os.getenv("SEND_CHAT_RATE_BURST", 3))
+
+# Telegram id администраторов через запятую: им доступна команда /profile
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").replace(",", " ").split()}
+
+# Профилирование обработчиков (profiling.py): отчёты пишутся в PROFILE_DIR.
+# PROFILE_ON_START=N — профилировать первые N обновлений после запуска,
+# PROFILE_SAMPLE_RATE — доля профилируемых обновлений, окно не дольше PROFILE_MAX_SECONDS
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_ON_START = int(os.getenv("PROFILE_ON_START", 0))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 1))
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", 600))
+
+# HTTP-эндпоинт /metrics (METRICS_PORT=0 — выключен).
+# В режиме cluster у воркера с номером n — порт METRICS_PORT + n
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
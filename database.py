@@ -1,20 +1,493 @@
+import bisect
+import hashlib
+import itertools
+import os
 import sqlite3
+import threading
+import time
+import zlib
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
 
-DB_PATH = Path(__file__).parent / "parkspot.db"
+from car_trie import CarNameTrie
+from config import CAR_CACHE_MAX_CHATS, LEGACY_CHAT_ID, MSK
+from metrics import DB_SECONDS, timed
 
+DB_PATH = Path(os.getenv("PARKSPOT_DB", Path(__file__).parent / "parkspot.db"))
 
-def get_connection():
-    return sqlite3.connect(DB_PATH)
+# Настройки соединения: WAL позволяет читать во время записи,
+# synchronous=NORMAL в WAL-режиме не делает fsync на каждый commit
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",
+    "PRAGMA busy_timeout=5000",
+)
+
+# Запросы держим константами: sqlite3 кеширует подготовленные
+# выражения по тексту SQL, так что повторные вызовы не компилируют их заново
+# Машины и заказы разделены по чатам-владельцам (chat_id): все выборки
+# идут по индексам, начинающимся с chat_id, и не трогают чужие парки
+SQL_CHAT_CARS = 'SELECT id, name, number, model FROM cars WHERE chat_id = ? ORDER BY name'
+SQL_ADD_CAR = 'INSERT INTO cars (chat_id, name, number, model) VALUES (?, ?, ?, ?)'
+SQL_DELETE_CAR_BY_ID = 'DELETE FROM cars WHERE id = ? AND chat_id = ?'
+SQL_ADD_ORDER = '''
+    INSERT INTO parking_orders (chat_id, car_name, car_number, car_model, entry_ts, created_ts, response)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_ACTIVE_ORDERS = '''
+    SELECT id, car_name, car_number, car_model, entry_ts, created_ts, response
+    FROM parking_orders
+    WHERE chat_id = ? AND entry_ts >= ?
+    ORDER BY entry_ts
+'''
+SQL_RECENT_ORDERS = '''
+    SELECT id, car_name, car_number, car_model, entry_ts, created_ts, response
+    FROM parking_orders
+    WHERE chat_id = ?
+    ORDER BY created_ts DESC, id DESC
+    LIMIT ?
+'''
+SQL_ORDERS_BEFORE = '''
+    SELECT id, car_name, car_number, car_model, entry_ts, created_ts, response
+    FROM parking_orders
+    WHERE chat_id = ? AND (created_ts, id) < (?, ?)
+    ORDER BY created_ts DESC, id DESC
+    LIMIT ?
+'''
+SQL_ORDERS_TO_ARCHIVE = '''
+    SELECT id, chat_id, car_name, car_number, car_model, entry_ts, created_ts, response
+    FROM parking_orders
+    WHERE created_ts < ?
+    ORDER BY created_ts, id
+    LIMIT ?
+'''
+SQL_ADD_RESPONSE = 'INSERT OR IGNORE INTO order_responses (hash, body) VALUES (?, ?)'
+SQL_RESPONSE_ID = 'SELECT id FROM order_responses WHERE hash = ?'
+SQL_ADD_ARCHIVED = '''
+    INSERT INTO parking_orders_archive (id, chat_id, car_name, car_number, car_model, entry_ts, created_ts, response_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_DELETE_ORDER = 'DELETE FROM parking_orders WHERE id = ?'
+SQL_SAVE_STATE = '''
+    INSERT OR REPLACE INTO pending_state (namespace, user_id, value, expires_at)
+    VALUES (?, ?, ?, ?)
+'''
+SQL_DELETE_STATE = 'DELETE FROM pending_state WHERE namespace = ? AND user_id = ?'
+SQL_PURGE_STATES = 'DELETE FROM pending_state WHERE expires_at <= ?'
+SQL_LOAD_STATES = 'SELECT user_id, value, expires_at FROM pending_state WHERE namespace = ?'
+SQL_SCHEDULED_COLUMNS = 'id, chat_id, car_id, weekdays, hour, minute, once_date, last_entry'
+SQL_ADD_SCHEDULED = '''
+    INSERT INTO scheduled_orders (chat_id, car_id, weekdays, hour, minute, once_date, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_SCHEDULED_ORDERS = f'SELECT {SQL_SCHEDULED_COLUMNS} FROM scheduled_orders ORDER BY id'
+SQL_SCHEDULED_BY_ID = f'SELECT {SQL_SCHEDULED_COLUMNS} FROM scheduled_orders WHERE id = ?'
+SQL_SCHEDULED_FIRED = 'UPDATE scheduled_orders SET last_entry = ? WHERE id = ?'
+SQL_DELETE_SCHEDULED = 'DELETE FROM scheduled_orders WHERE id = ?'
+SQL_TABLE_EXISTS = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?"
+SQL_LEGACY_CARS = 'SELECT 1 FROM cars WHERE chat_id = 0 LIMIT 1'
+SQL_LEGACY_ORDERS = 'SELECT 1 FROM parking_orders WHERE chat_id = 0 LIMIT 1'
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.RLock()
+_initialized = False
+
+# В базе есть ничей общий парк (chat_id = 0): машины по умолчанию или парк
+# прежней версии, если LEGACY_CHAT_ID не задан. Сам он никому не достаётся:
+# его отдаёт чату LEGACY_CHAT_ID или команда /legacy администратора
+legacy_fleet_unclaimed = False
+
+
+def _car_name(car: tuple) -> str:
+    return car[1]
+
+
+# Версии кешей машин общие для всех чатов: кеш, вытесненный и загруженный
+# заново, не повторит версию, под которой лежат готовые клавиатуры и подсказки
+_registry_versions = itertools.count(1)
+
+
+class CarRegistry:
+    """
+    Кеш машин одного чата в памяти процесса: индексы по id и по имени в нижнем регистре.
+
+    Загружается из базы один раз, дальше add_car/delete_car* обновляют его
+    сразу после записи (write-through). version меняется при каждом изменении.
+    """
+
+    def __init__(self):
+        self._by_id: dict[int, tuple] = {}
+        self._by_name: dict[str, tuple] = {}
+        self._sorted: list[tuple] = []
+        self._trie = CarNameTrie()
+        self.loaded = False
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, cars: list[tuple]) -> None:
+        self._by_id = {car[0]: car for car in cars}
+        self._by_name = {car[1].lower(): car for car in cars}
+        self._trie.clear()
+        for car in cars:
+            self._trie.insert(car[1], car)
+        self._reindex()
+        self.loaded = True
+
+    def _reindex(self) -> None:
+        self._sorted = sorted(self._by_id.values(), key=_car_name)
+        self.version = next(_registry_versions)
+
+    def _resort(self, removed: tuple | None, added: tuple | None) -> None:
+        """
+        Поправить отсортированный список на одну машину без полной сортировки.
+        Список заменяется целиком: event loop читает его без блокировки.
+        """
+        cars = self._sorted.copy()
+        if removed is not None:
+            del cars[bisect.bisect_left(cars, removed[1], key=_car_name)]
+        if added is not None:
+            bisect.insort(cars, added, key=_car_name)
+        self._sorted = cars
+        self.version = next(_registry_versions)
+
+    def all(self) -> list[tuple]:
+        self.hits += 1
+        return list(self._sorted)
+
+    def by_id(self, car_id: int) -> tuple | None:
+        self.hits += 1
+        return self._by_id.get(car_id)
+
+    def by_name(self, name: str) -> tuple | None:
+        self.hits += 1
+        return self._by_name.get(name.lower())
+
+    def match_prefix(self, text: str) -> tuple[tuple, int] | None:
+        """Машина с самым длинным именем, с которого начинается text: (машина, длина имени)"""
+        self.hits += 1
+        return self._trie.longest_prefix(text.lower())
+
+    def starting_with(self, prefix: str, limit: int | None = None) -> list[tuple]:
+        """Машины, имя которых начинается с prefix, по алфавиту"""
+        self.hits += 1
+        return self._trie.starting_with(prefix.lower(), limit)
+
+    def put(self, car: tuple) -> None:
+        previous = self._by_id.get(car[0])
+        if previous is not None:
+            self._by_name.pop(previous[1].lower(), None)
+            self._trie.remove(previous[1])
+        self._by_id[car[0]] = car
+        self._by_name[car[1].lower()] = car
+        self._trie.insert(car[1], car)
+        self._resort(previous, car)
+
+    def remove(self, car_id: int) -> None:
+        car = self._by_id.pop(car_id, None)
+        if car is not None:
+            self._by_name.pop(car[1].lower(), None)
+            self._trie.remove(car[1])
+            self._resort(car, None)
+
+    def invalidate(self) -> None:
+        self.loaded = False
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "cars": len(self._by_id),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "version": self.version,
+        }
+
+
+# Кеши машин по чатам: chat_id -> CarRegistry. Меняется только в потоке БД под _lock,
+# из event loop словарь только читается (см. async_db). Хранится не больше
+# CAR_CACHE_MAX_CHATS чатов: вытесняется загруженный раньше всех
+car_registries: dict[int, CarRegistry] = {}
+
+
+def car_cache_stats() -> dict:
+    """Сводная статистика кешей машин всех чатов"""
+    registries = list(car_registries.values())
+    hits = sum(registry.hits for registry in registries)
+    misses = sum(registry.misses for registry in registries)
+    total = hits + misses
+    return {
+        "chats": len(registries),
+        "cars": sum(len(registry._by_id) for registry in registries),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / total if total else 0.0,
+    }
+
+
+def get_connection() -> sqlite3.Connection:
+    """Общее соединение на весь процесс, открывается при первом обращении"""
+    global _conn
+    if _conn is None:
+        with _lock:
+            if _conn is None:
+                conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=256)
+                for pragma in PRAGMAS:
+                    conn.execute(pragma)
+                _conn = conn
+    return _conn
+
+
+def close_db():
+    """Закрыть общее соединение (при остановке бота)"""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+
+# Время в parking_orders хранится целыми секундами UTC (epoch)
+SQL_CREATE_ORDERS = '''
+    CREATE TABLE IF NOT EXISTS parking_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        car_name TEXT NOT NULL,
+        car_number TEXT NOT NULL,
+        car_model TEXT NOT NULL,
+        entry_ts INTEGER NOT NULL,
+        created_ts INTEGER NOT NULL,
+        response TEXT
+    )
+'''
+
+
+def to_epoch(dt: datetime) -> int:
+    """datetime -> секунды UTC. Время без tzinfo считается московским."""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=MSK)
+    return int(dt.timestamp())
+
+
+def from_epoch(ts: int) -> datetime:
+    """Секунды UTC -> московское время"""
+    return datetime.fromtimestamp(ts, MSK)
+
+
+def _order_row(row: tuple) -> tuple:
+    order_id, car_name, car_number, car_model, entry_ts, created_ts, response = row
+    return order_id, car_name, car_number, car_model, from_epoch(entry_ts), from_epoch(created_ts), response
+
+
+def _local_epoch(text: str) -> int | None:
+    """ISO-время сервера -> секунды UTC, None — если не разобрать"""
+    try:
+        return int(datetime.fromisoformat(text).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def _register_epoch_functions(conn: sqlite3.Connection):
+    conn.create_function('msk_epoch', 1, lambda s: to_epoch(datetime.fromisoformat(s)))
+    conn.create_function('local_epoch', 1, _local_epoch)
+
+
+# Перенос заказов из текстовой схемы; нечитаемое время заказа заменяется временем въезда
+SQL_COPY_ORDERS_V0 = '''
+    INSERT INTO parking_orders ({id}car_name, car_number, car_model, entry_ts, created_ts, response)
+    SELECT {id}car_name, car_number, car_model, msk_epoch(entry_time),
+           COALESCE(local_epoch(created_at), msk_epoch(entry_time)), response
+    FROM parking_orders_v0
+'''
+
+
+def _migrate_order_timestamps(conn: sqlite3.Connection):
+    """
+    v1: entry_time/created_at из ISO-текста в целые epoch-секунды и индексы.
+    entry_time писался по Москве, created_at — по локальному времени сервера.
+    """
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(parking_orders)')}
+    if 'entry_time' in columns:
+        _register_epoch_functions(conn)
+        conn.execute('ALTER TABLE parking_orders RENAME TO parking_orders_v0')
+        conn.execute(SQL_CREATE_ORDERS)
+        conn.execute(SQL_COPY_ORDERS_V0.format(id='id, '))
+        conn.execute('DROP TABLE parking_orders_v0')
+
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_entry ON parking_orders (entry_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_created ON parking_orders (created_ts, id)')
+
+
+def _migrate_order_archive(conn: sqlite3.Connection):
+    """
+    v2: архив старых заказов. Тексты ответов сайта хранятся один раз
+    (по sha1), сжатыми zlib.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS order_responses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            hash BLOB UNIQUE NOT NULL,
+            body BLOB NOT NULL
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS parking_orders_archive (
+            id INTEGER PRIMARY KEY,
+            car_name TEXT NOT NULL,
+            car_number TEXT NOT NULL,
+            car_model TEXT NOT NULL,
+            entry_ts INTEGER NOT NULL,
+            created_ts INTEGER NOT NULL,
+            response_id INTEGER REFERENCES order_responses (id)
+        )
+    ''')
+
+
+def _migrate_pending_state(conn: sqlite3.Connection):
+    """v3: незавершённые диалоги пользователей (state_store)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS pending_state (
+            namespace TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (namespace, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _migrate_chat_fleets(conn: sqlite3.Connection):
+    """
+    v4: у машин и заказов появляется чат-владелец. Общий парк и история
+    прежней установки достаются чату LEGACY_CHAT_ID, а если он не задан —
+    остаются ничьими (chat_id = 0) до claim_legacy_fleet. Имя машины
+    уникально в пределах чата.
+    """
+    conn.execute('ALTER TABLE cars RENAME TO cars_v3')
+    conn.execute('''
+        CREATE TABLE cars (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            number TEXT NOT NULL,
+            model TEXT NOT NULL,
+            UNIQUE (chat_id, name)
+        )
+    ''')
+    conn.execute('''
+        INSERT INTO cars (id, chat_id, name, number, model)
+        SELECT id, ?, name, number, model FROM cars_v3
+    ''', (LEGACY_CHAT_ID,))
+    conn.execute('DROP TABLE cars_v3')
+
+    for table in ('parking_orders', 'parking_orders_archive'):
+        conn.execute(f'ALTER TABLE {table} ADD COLUMN chat_id INTEGER NOT NULL DEFAULT 0')
+        conn.execute(f'UPDATE {table} SET chat_id = ?', (LEGACY_CHAT_ID,))
+
+    # idx_orders_created остаётся для архивации, она идёт по всем чатам
+    conn.execute('DROP INDEX IF EXISTS idx_orders_entry')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_chat_entry ON parking_orders (chat_id, entry_ts)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_chat_created ON parking_orders (chat_id, created_ts, id)')
+
+
+# Миграции по порядку: MIGRATIONS[n] переводит схему из версии n в n + 1
+MIGRATIONS = [
+    _migrate_order_timestamps,
+    _migrate_order_archive,
+    _migrate_pending_state,
+    _migrate_chat_fleets,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
 
 
 def init_db():
-    """Инициализация базы данных"""
+    """
+    Подготовить базу: создать таблицы и применить миграции.
+    Вызывается явно при запуске; если схема уже актуальна, DDL не выполняется,
+    повторные вызовы ничего не делают.
+    """
+    global _initialized, legacy_fleet_unclaimed
+    if _initialized:
+        return
     conn = get_connection()
+    with _lock, conn:
+        if _initialized:
+            return
+        cursor = conn.cursor()
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if version < SCHEMA_VERSION:
+            _create_schema(conn, version)
+        if cursor.execute(SQL_TABLE_EXISTS, ('parking_orders_v0',)).fetchone():
+            _resume_order_timestamps(conn)
+        legacy_fleet_unclaimed = bool(
+            cursor.execute(SQL_LEGACY_CARS).fetchone() or cursor.execute(SQL_LEGACY_ORDERS).fetchone()
+        )
+        _initialized = True
+
+    # Чат для общего парка задали после обновления — отдаём парк ему
+    if legacy_fleet_unclaimed and LEGACY_CHAT_ID:
+        claim_legacy_fleet(LEGACY_CHAT_ID)
+    elif legacy_fleet_unclaimed:
+        print("Общий парк ничей: задай LEGACY_CHAT_ID или отправь /legacy в нужный чат (ADMIN_IDS)", flush=True)
+
+
+@contextmanager
+def _immediate(conn: sqlite3.Connection):
+    """
+    Явная транзакция BEGIN IMMEDIATE ... COMMIT. sqlite3 сам открывает
+    транзакцию только перед DML, а DDL коммитит сразу — без этого
+    миграция, упавшая посередине, оставила бы схему наполовину изменённой.
+    """
+    level = conn.isolation_level
+    conn.isolation_level = None
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        yield
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    else:
+        conn.execute('COMMIT')
+    finally:
+        conn.isolation_level = level
+
+
+def _resume_order_timestamps(conn: sqlite3.Connection):
+    """
+    Старые версии мигрировали v1 без транзакции: упав на переносе заказов,
+    они оставляли историю в parking_orders_v0, а при следующем запуске
+    продолжали с пустой parking_orders. Переносим её сейчас — с новыми id,
+    старые могли уже занять новые заказы; история остаётся ничьей
+    (chat_id = 0) до claim_legacy_fleet.
+    """
+    with _immediate(conn):
+        _register_epoch_functions(conn)
+        moved = conn.execute(SQL_COPY_ORDERS_V0.format(id='')).rowcount
+        conn.execute('DROP TABLE parking_orders_v0')
+    print(f"Заказы из незавершённой миграции перенесены: {moved}", flush=True)
+
+
+def _create_schema(conn: sqlite3.Connection, version: int):
+    """Исходные таблицы и миграции начиная с версии version, каждая в своей транзакции"""
+    with _immediate(conn):
+        _create_base_tables(conn, version)
+
+    # Миграции схемы по PRAGMA user_version: миграция и номер версии
+    # фиксируются вместе, упавшая откатывается целиком
+    for number, migrate in enumerate(MIGRATIONS[version:], version + 1):
+        with _immediate(conn):
+            migrate(conn)
+            conn.execute(f'PRAGMA user_version = {number}')
+
+
+def _create_base_tables(conn: sqlite3.Connection, version: int):
+    """Исходная схема (её дополняют миграции) и машины по умолчанию для новой базы"""
     cursor = conn.cursor()
 
-    # Таблица машин
+    # Таблица машин (исходная схема, chat_id добавляет миграция v4)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS cars (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -25,21 +498,28 @@ def init_db():
     ''')
 
     # Таблица заказов парковки
+    cursor.execute(SQL_CREATE_ORDERS)
+
+    # Плановые заказы: повторяющиеся (weekdays — маска дней, Пн = 1)
+    # или разовые (weekdays = 0, дата в once_date).
+    # last_entry — время въезда, на которое заказ уже срабатывал,
+    # created_at — время создания по Москве, ISO с поясом
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS parking_orders (
+        CREATE TABLE IF NOT EXISTS scheduled_orders (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            car_name TEXT NOT NULL,
-            car_number TEXT NOT NULL,
-            car_model TEXT NOT NULL,
-            entry_time TEXT NOT NULL,
-            created_at TEXT NOT NULL,
-            response TEXT
+            chat_id INTEGER NOT NULL,
+            car_id INTEGER NOT NULL,
+            weekdays INTEGER NOT NULL,
+            hour INTEGER NOT NULL,
+            minute INTEGER NOT NULL,
+            once_date TEXT,
+            last_entry TEXT,
+            created_at TEXT NOT NULL
         )
     ''')
 
-    # Добавляем машины по умолчанию если база пустая
-    cursor.execute('SELECT COUNT(*) FROM cars')
-    if cursor.fetchone()[0] == 0:
+    # Машины по умолчанию — в новую базу; миграция v4 отдаёт их в общий парк
+    if version == 0 and not cursor.execute('SELECT 1 FROM cars LIMIT 1').fetchone():
         default_cars = [
             ("секвойя", "А606ВО 797", "Тойота"),
             ("панама", "У657НУ 797", "Порше"),
@@ -47,126 +527,287 @@ def init_db():
         ]
         cursor.executemany('INSERT INTO cars (name, number, model) VALUES (?, ?, ?)', default_cars)
 
-    conn.commit()
-    conn.close()
-
 
 # === Машины ===
 
-def get_all_cars() -> list[tuple]:
-    """Получить все машины: [(id, name, number, model), ...]"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, number, model FROM cars ORDER BY name')
-    cars = cursor.fetchall()
-    conn.close()
-    return cars
+@timed(DB_SECONDS)
+def get_car_registry(chat_id: int) -> CarRegistry:
+    """Кеш машин чата, при первом обращении загружается из базы"""
+    registry = car_registries.get(chat_id)
+    if registry is None or not registry.loaded:
+        conn = get_connection()
+        with _lock:
+            registry = car_registries.get(chat_id)
+            if registry is None:
+                while len(car_registries) >= CAR_CACHE_MAX_CHATS:
+                    del car_registries[next(iter(car_registries))]
+                registry = car_registries[chat_id] = CarRegistry()
+            if not registry.loaded:
+                registry.misses += 1
+                registry.load(conn.execute(SQL_CHAT_CARS, (chat_id,)).fetchall())
+    return registry
 
 
-def get_car_by_name(name: str) -> tuple | None:
-    """Получить машину по имени"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, number, model FROM cars WHERE LOWER(name) = LOWER(?)', (name,))
-    car = cursor.fetchone()
-    conn.close()
-    return car
+@timed(DB_SECONDS)
+def get_all_cars(chat_id: int) -> list[tuple]:
+    """Получить все машины чата: [(id, name, number, model), ...]"""
+    return get_car_registry(chat_id).all()
 
 
-def get_car_by_id(car_id: int) -> tuple | None:
-    """Получить машину по ID"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('SELECT id, name, number, model FROM cars WHERE id = ?', (car_id,))
-    car = cursor.fetchone()
-    conn.close()
-    return car
+@timed(DB_SECONDS)
+def get_car_by_name(chat_id: int, name: str) -> tuple | None:
+    """Получить машину чата по имени"""
+    return get_car_registry(chat_id).by_name(name)
+
+
+@timed(DB_SECONDS)
+def get_car_by_id(chat_id: int, car_id: int) -> tuple | None:
+    """Получить машину чата по ID (None, если машина чужая)"""
+    return get_car_registry(chat_id).by_id(car_id)
+
 
+@timed(DB_SECONDS)
+def match_car_prefix(chat_id: int, text: str) -> tuple[tuple, int] | None:
+    """Найти машину чата, имя которой стоит в начале текста (самое длинное совпадение)"""
+    return get_car_registry(chat_id).match_prefix(text)
 
-def add_car(name: str, number: str, model: str) -> bool:
-    """Добавить машину. Возвращает True если успешно."""
+
+@timed(DB_SECONDS)
+def cars_starting_with(chat_id: int, prefix: str, limit: int | None = None) -> list[tuple]:
+    """Машины чата, имя которых начинается с prefix"""
+    return get_car_registry(chat_id).starting_with(prefix, limit)
+
+
+@timed(DB_SECONDS)
+def add_car(chat_id: int, name: str, number: str, model: str) -> bool:
+    """Добавить машину в парк чата. Возвращает True если успешно."""
+    registry = get_car_registry(chat_id)
+    conn = get_connection()
+    car = (name.lower(), number.upper(), model)
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO cars (name, number, model) VALUES (?, ?, ?)',
-                      (name.lower(), number.upper(), model))
-        conn.commit()
-        conn.close()
+        with _lock, conn:
+            car_id = conn.execute(SQL_ADD_CAR, (chat_id, *car)).lastrowid
+            registry.put((car_id, *car))
         return True
     except sqlite3.IntegrityError:
         return False
 
 
-def delete_car(name: str) -> bool:
-    """Удалить машину по имени. Возвращает True если удалена."""
+@timed(DB_SECONDS)
+def delete_car(chat_id: int, name: str) -> bool:
+    """Удалить машину чата по имени. Возвращает True если удалена."""
+    car = get_car_by_name(chat_id, name)
+    if car is None:
+        return False
+    return delete_car_by_id(chat_id, car[0])
+
+
+@timed(DB_SECONDS)
+def delete_car_by_id(chat_id: int, car_id: int) -> bool:
+    """Удалить машину чата по ID"""
+    registry = get_car_registry(chat_id)
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM cars WHERE LOWER(name) = LOWER(?)', (name,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
+    with _lock, conn:
+        deleted = conn.execute(SQL_DELETE_CAR_BY_ID, (car_id, chat_id)).rowcount > 0
+        if deleted:
+            registry.remove(car_id)
     return deleted
 
 
-def delete_car_by_id(car_id: int) -> bool:
-    """Удалить машину по ID"""
+@timed(DB_SECONDS)
+def claim_legacy_fleet(chat_id: int) -> tuple[int, int]:
+    """
+    Передать ничей общий парк и его историю заказов чату chat_id.
+    Возвращает число переданных машин и заказов ((0, 0) — парк уже забран).
+    """
+    global legacy_fleet_unclaimed
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM cars WHERE id = ?', (car_id,))
-    deleted = cursor.rowcount > 0
-    conn.commit()
-    conn.close()
-    return deleted
+    with _lock, conn:
+        claimed = conn.execute('UPDATE OR IGNORE cars SET chat_id = ? WHERE chat_id = 0', (chat_id,)).rowcount
+        # Машины с теми же именами чат уже завёл сам — остаются его
+        conn.execute('DELETE FROM cars WHERE chat_id = 0')
+        orders = sum(
+            conn.execute(f'UPDATE {table} SET chat_id = ? WHERE chat_id = 0', (chat_id,)).rowcount
+            for table in ('parking_orders', 'parking_orders_archive')
+        )
+        car_registries.pop(chat_id, None)
+        legacy_fleet_unclaimed = False
+    if claimed or orders:
+        print(f"Общий парк передан чату {chat_id}, машин: {claimed}, заказов: {orders}", flush=True)
+    return claimed, orders
 
 
 # === Заказы парковки ===
 
-def add_parking_order(car_name: str, car_number: str, car_model: str,
+@timed(DB_SECONDS)
+def add_parking_order(chat_id: int, car_name: str, car_number: str, car_model: str,
                       entry_time: datetime, response: str) -> int:
-    """Добавить заказ парковки. Возвращает ID заказа."""
+    """Добавить заказ парковки в историю чата. Возвращает ID заказа."""
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO parking_orders (car_name, car_number, car_model, entry_time, created_at, response)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (car_name, car_number, car_model,
-          entry_time.isoformat(), datetime.now().isoformat(), response))
-    order_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return order_id
+    with _lock, conn:
+        cursor = conn.execute(SQL_ADD_ORDER, (
+            chat_id, car_name, car_number, car_model,
+            to_epoch(entry_time), int(time.time()), response,
+        ))
+        return cursor.lastrowid
 
 
-def get_active_orders() -> list[tuple]:
-    """Получить активные заказы (время въезда >= сейчас)"""
+@timed(DB_SECONDS)
+def add_parking_orders(chat_id: int, orders: list[tuple]) -> int:
+    """
+    Добавить несколько заказов в историю чата одной транзакцией.
+    orders: [(car_name, car_number, car_model, entry_time, response), ...]
+    Возвращает число добавленных заказов.
+    """
     conn = get_connection()
-    cursor = conn.cursor()
-    now = datetime.now().isoformat()
-    cursor.execute('''
-        SELECT id, car_name, car_number, car_model, entry_time, created_at, response
-        FROM parking_orders
-        WHERE entry_time >= ?
-        ORDER BY entry_time
-    ''', (now,))
-    orders = cursor.fetchall()
-    conn.close()
-    return orders
+    created_ts = int(time.time())
+    with _lock, conn:
+        conn.executemany(SQL_ADD_ORDER, [
+            (chat_id, car_name, car_number, car_model, to_epoch(entry_time), created_ts, response)
+            for car_name, car_number, car_model, entry_time, response in orders
+        ])
+    return len(orders)
 
 
-def get_recent_orders(limit: int = 10) -> list[tuple]:
-    """Получить последние заказы"""
+@timed(DB_SECONDS)
+def get_active_orders(chat_id: int) -> list[tuple]:
+    """
+    Получить активные заказы чата (время въезда >= сейчас):
+    [(id, car_name, car_number, car_model, entry_time, created_at, response), ...],
+    время — datetime по Москве
+    """
     conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT id, car_name, car_number, car_model, entry_time, created_at, response
-        FROM parking_orders
-        ORDER BY created_at DESC
-        LIMIT ?
-    ''', (limit,))
-    orders = cursor.fetchall()
-    conn.close()
-    return orders
-
-
-# Инициализация при импорте
-init_db()
+    with _lock:
+        rows = conn.execute(SQL_ACTIVE_ORDERS, (chat_id, int(time.time()))).fetchall()
+    return [_order_row(row) for row in rows]
+
+
+@timed(DB_SECONDS)
+def get_recent_orders(chat_id: int, limit: int = 10, before: tuple[int, int] | None = None) -> list[tuple]:
+    """
+    Получить последние заказы чата (формат как у get_active_orders).
+    before=(created_ts, id) — страница заказов, созданных раньше указанного
+    (keyset-пагинация, ключ берётся из последнего заказа предыдущей страницы).
+    """
+    conn = get_connection()
+    with _lock:
+        if before is None:
+            rows = conn.execute(SQL_RECENT_ORDERS, (chat_id, limit)).fetchall()
+        else:
+            rows = conn.execute(SQL_ORDERS_BEFORE, (chat_id, *before, limit)).fetchall()
+    return [_order_row(row) for row in rows]
+
+
+def order_page_key(order: tuple) -> tuple[int, int]:
+    """Ключ заказа для параметра before в get_recent_orders"""
+    return to_epoch(order[5]), order[0]
+
+
+# Сколько заказов переносит в архив один вызов archive_orders
+ARCHIVE_BATCH_SIZE = 500
+
+
+@timed(DB_SECONDS)
+def archive_orders(older_than_days: int, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """
+    Перенести в архив пачку (до batch_size) заказов старше older_than_days дней.
+    Одинаковые тексты ответов сохраняются один раз в сжатом виде.
+    Возвращает число перенесённых заказов; пока оно равно batch_size,
+    в базе могут оставаться заказы для архива. Пачка — короткая транзакция,
+    между вызовами база свободна для других запросов.
+    """
+    conn = get_connection()
+    cutoff = int(time.time()) - older_than_days * 86400
+    response_ids: dict[bytes, int] = {}
+
+    with _lock, conn:
+        rows = conn.execute(SQL_ORDERS_TO_ARCHIVE, (cutoff, batch_size)).fetchall()
+        for order_id, chat_id, car_name, car_number, car_model, entry_ts, created_ts, response in rows:
+            body = (response or "").encode()
+            digest = hashlib.sha1(body).digest()
+            response_id = response_ids.get(digest)
+            if response_id is None:
+                conn.execute(SQL_ADD_RESPONSE, (digest, zlib.compress(body)))
+                response_id = conn.execute(SQL_RESPONSE_ID, (digest,)).fetchone()[0]
+                response_ids[digest] = response_id
+            conn.execute(SQL_ADD_ARCHIVED, (
+                order_id, chat_id, car_name, car_number, car_model, entry_ts, created_ts, response_id,
+            ))
+            conn.execute(SQL_DELETE_ORDER, (order_id,))
+    return len(rows)
+
+
+
+# === Плановые заказы ===
+
+@timed(DB_SECONDS)
+def add_scheduled_order(chat_id: int, car_id: int, weekdays: int,
+                        hour: int, minute: int, once_date: str | None) -> tuple:
+    """Добавить плановый заказ. Возвращает строку заказа."""
+    conn = get_connection()
+    with _lock, conn:
+        order_id = conn.execute(SQL_ADD_SCHEDULED, (
+            chat_id, car_id, weekdays, hour, minute, once_date, datetime.now(MSK).isoformat(),
+        )).lastrowid
+        return conn.execute(SQL_SCHEDULED_BY_ID, (order_id,)).fetchone()
+
+
+@timed(DB_SECONDS)
+def get_scheduled_orders() -> list[tuple]:
+    """Все плановые заказы: [(id, chat_id, car_id, weekdays, hour, minute, once_date, last_entry), ...]"""
+    conn = get_connection()
+    with _lock:
+        return conn.execute(SQL_SCHEDULED_ORDERS).fetchall()
+
+
+@timed(DB_SECONDS)
+def mark_scheduled_order_fired(order_id: int, entry_time: datetime):
+    """Запомнить, что заказ сработал на это время въезда"""
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(SQL_SCHEDULED_FIRED, (entry_time.isoformat(), order_id))
+
+
+@timed(DB_SECONDS)
+def delete_scheduled_order(order_id: int) -> bool:
+    """Удалить плановый заказ"""
+    conn = get_connection()
+    with _lock, conn:
+        return conn.execute(SQL_DELETE_SCHEDULED, (order_id,)).rowcount > 0
+
+
+
+# === Состояния диалогов ===
+
+@timed(DB_SECONDS)
+def save_state(namespace: str, user_id: int, value: str, expires_at: float):
+    """Сохранить состояние пользователя"""
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(SQL_SAVE_STATE, (namespace, user_id, value, expires_at))
+
+
+@timed(DB_SECONDS)
+def delete_state(namespace: str, user_id: int):
+    """Удалить состояние пользователя"""
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(SQL_DELETE_STATE, (namespace, user_id))
+
+
+@timed(DB_SECONDS)
+def purge_states(now: float):
+    """Удалить все истёкшие к now состояния одним запросом"""
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(SQL_PURGE_STATES, (now,))
+
+
+@timed(DB_SECONDS)
+def load_states(namespace: str) -> list[tuple]:
+    """Неистёкшие состояния: [(user_id, value, expires_at), ...]. Истёкшие удаляются."""
+    conn = get_connection()
+    with _lock, conn:
+        conn.execute(SQL_PURGE_STATES, (time.time(),))
+        return conn.execute(SQL_LOAD_STATES, (namespace,)).fetchall()
+
@@ -0,0 +1,343 @@
+"""
+Нагрузочный прогон бота без сети.
+
+Синтетические обновления ("+", "секвойя 15:30", выбор дня и часа) подаются
+прямо в dp.feed_update. Bot API подменён сессией-заглушкой, parkspot.ru —
+локальным aiohttp-сервером, база — временным файлом.
+
+    python loadtest.py --users 500 --concurrency 50 --stub-delay 0.05
+
+Печатает число обновлений в секунду и p50/p95/p99 времени обработки.
+
+    python loadtest.py --users 2000 --workers 4 --stub-delay 0
+
+То же через cluster.py: обновления раздаются процессам-воркерам по chat_id,
+запись в базу — через процесс-писатель. Пропускную способность при разном
+--workers можно сравнивать между собой; с --stub-delay 0, иначе замер
+упирается в ожидание заглушки parkspot.ru, а не в процессор.
+
+    python loadtest.py --startup 10
+
+Время холодного старта: каждый запуск — отдельный процесс, от импорта бота
+до первого обработанного обновления. Первый запуск создаёт схему базы,
+остальные застают её актуальной.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from functools import partial
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def start_parkspot_stub(delay: float):
+    """Заглушка parkspot.ru: GET / выдаёт cookie, POST заявки отвечает через delay секунд"""
+    from aiohttp import web
+
+    async def index(request):
+        response = web.Response(text="<html><body>parkspot</body></html>", content_type="text/html")
+        response.set_cookie("PHPSESSID", "loadtest")
+        return response
+
+    async def submit(request):
+        await request.post()
+        await asyncio.sleep(delay)
+        return web.Response(
+            text='<html><body><div class="alert alert-success">Заявка принята</div></body></html>',
+            content_type="text/html",
+        )
+
+    app = web.Application()
+    app.router.add_get("/", index)
+    app.router.add_post("/add_data_proc_7.php", submit)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/"
+
+
+def make_fake_bot():
+    """Bot с сессией-заглушкой; вызывается в воркерах cluster.py"""
+    from aiogram import Bot
+    return Bot(token="123456:LOADTEST", session=make_fake_session())
+
+
+def make_fake_session():
+    """Сессия Bot API, которая ничего не отправляет и считает вызовы"""
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import SendMessage
+    from aiogram.types import Chat, Message
+
+    class FakeSession(BaseSession):
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+            self._ids = itertools.count(1)
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            if isinstance(method, SendMessage):
+                return Message(
+                    message_id=next(self._ids),
+                    date=datetime.now(),
+                    chat=Chat(id=method.chat_id, type="private"),
+                    text=method.text,
+                )
+            return True
+
+        async def stream_content(self, *args, **kwargs):
+            raise NotImplementedError
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+
+class UpdateFactory:
+    """Синтетические обновления Telegram"""
+
+    def __init__(self):
+        from aiogram import types
+        self.types = types
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+
+    def _user(self, user_id: int):
+        return self.types.User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+
+    def _message(self, user_id: int, text: str):
+        return self.types.Message(
+            message_id=next(self._message_ids),
+            date=datetime.now(),
+            chat=self.types.Chat(id=user_id, type="private"),
+            from_user=self._user(user_id),
+            text=text,
+        )
+
+    def message(self, user_id: int, text: str):
+        return self.types.Update(update_id=next(self._update_ids), message=self._message(user_id, text))
+
+    def callback(self, user_id: int, data: str):
+        return self.types.Update(
+            update_id=next(self._update_ids),
+            callback_query=self.types.CallbackQuery(
+                id=str(next(self._update_ids)),
+                from_user=self._user(user_id),
+                chat_instance=str(user_id),
+                message=self._message(user_id, "menu"),
+                data=data,
+            ),
+        )
+
+
+def user_flow(factory: UpdateFactory, user_id: int, cars: list[tuple]) -> list:
+    """Сценарий одного пользователя: меню "+", заказ текстом и выбор машины по времени"""
+    car_id, car_name = cars[user_id % len(cars)][:2]
+    hour = 6 + user_id % 16
+    minute = user_id % 60
+    return [
+        factory.message(user_id, "+"),
+        factory.callback(user_id, f"menu:{car_id}"),
+        factory.callback(user_id, f"day:{car_id}:tomorrow"),
+        factory.callback(user_id, f"time:{car_id}:tomorrow:{hour}"),
+        factory.message(user_id, f"{car_name} завтра {hour:02d}:{minute:02d}"),
+        factory.message(user_id, f"завтра {hour:02d}:{(minute + 1) % 60:02d}"),
+        factory.callback(user_id, f"park:{car_id}"),
+    ]
+
+
+async def seed_fleets(users: int) -> dict[int, list[tuple]]:
+    """У каждого пользователя свой чат и свой парк машин"""
+    from async_db import add_car, get_all_cars
+    from config import CARS
+
+    fleets = {}
+    for user_id in range(1, users + 1):
+        for name, (number, model) in CARS.items():
+            await add_car(user_id, name, number, model)
+        fleets[user_id] = await get_all_cars(user_id)
+    return fleets
+
+
+def print_latencies(latencies: list[float], elapsed: float):
+    print(f"обновлений: {len(latencies)} за {elapsed:.2f} с — {len(latencies) / elapsed:.0f} в секунду")
+    print(f"задержка: p50 {percentile(latencies, 0.50) * 1000:.1f} мс, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.1f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс, "
+          f"среднее {statistics.mean(latencies) * 1000:.1f} мс")
+
+
+async def run_load(args, stub_runner):
+    import bot as bot_module
+    from aiogram import Bot
+    from async_db import init_db
+    from scheduler import Scheduler
+
+    session = make_fake_session()
+    fake_bot = Bot(token="123456:LOADTEST", session=session)
+    factory = UpdateFactory()
+    await init_db()
+    dp = bot_module.create_dispatcher(Scheduler(partial(bot_module.fire_scheduled_order, fake_bot)))
+    fleets = await seed_fleets(args.users)
+
+    latencies: list[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_user(user_id: int):
+        async with semaphore:
+            for update in user_flow(factory, user_id, fleets[user_id]):
+                start = time.perf_counter()
+                await dp.feed_update(fake_bot, update)
+                latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(user_id) for user_id in range(1, args.users + 1)))
+    elapsed = time.perf_counter() - started
+
+    await bot_module.submit_queue.stop()
+    await bot_module.parkspot_session.close()
+    await stub_runner.cleanup()
+
+    print_latencies(latencies, elapsed)
+    print(f"вызовов Bot API: {session.calls}")
+    print(f"очередь заявок: {bot_module.submit_queue.stats()}")
+    print(f"cookies parkspot.ru: {bot_module.parkspot_session.stats()}")
+
+
+async def run_cluster_load(args, stub_runner):
+    """Нагрузка на cluster.py: args.workers воркеров и процесс-писатель"""
+    import async_db
+    from cluster import Cluster
+
+    await async_db.init_db()
+    fleets = await seed_fleets(args.users)
+    async_db.shutdown()
+
+    factory = UpdateFactory()
+    updates = [
+        update.model_dump(mode="json", by_alias=True, exclude_none=True)
+        for user_id in range(1, args.users + 1)
+        for update in user_flow(factory, user_id, fleets[user_id])
+    ]
+
+    loop = asyncio.get_running_loop()
+    cluster = Cluster(args.workers, bot_factory=make_fake_bot, collect_results=True)
+    cluster.start()
+    await loop.run_in_executor(None, cluster.wait_ready)
+
+    started = time.time()
+    for update in updates:
+        cluster.feed(update)
+    await loop.run_in_executor(None, cluster.stop)
+    await stub_runner.cleanup()
+
+    latencies = [latency for _, worker_latencies, _ in cluster.collected for latency in worker_latencies]
+    elapsed = max(finished_at for _, _, finished_at in cluster.collected) - started
+    print(f"воркеров: {args.workers}")
+    print_latencies(latencies, elapsed)
+    for index, worker_latencies, _ in sorted(cluster.collected):
+        print(f"  воркер {index}: {len(worker_latencies)} обновлений")
+
+
+async def startup_child():
+    """Один холодный старт в отдельном процессе. Печатает длительность этапов в JSON"""
+    phases = {}
+    started = time.perf_counter()
+
+    import bot as bot_module
+    phases["import"] = time.perf_counter() - started
+
+    import async_db
+    from aiogram import Bot
+    from scheduler import Scheduler
+    mark = time.perf_counter()
+    await async_db.init_db()
+    phases["init_db"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    fake_bot = Bot(token="123456:LOADTEST", session=make_fake_session())
+    dp = bot_module.create_dispatcher(Scheduler(partial(bot_module.fire_scheduled_order, fake_bot)))
+    phases["create"] = time.perf_counter() - mark
+
+    mark = time.perf_counter()
+    await dp.feed_update(fake_bot, UpdateFactory().message(1, "/cars"))
+    phases["first_update"] = time.perf_counter() - mark
+
+    phases["total"] = time.perf_counter() - started
+    async_db.shutdown()
+    print(json.dumps(phases))
+
+
+def run_startup(runs: int):
+    """Запускает startup_child runs раз на одной базе и печатает сводку"""
+    results = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--startup-child"],
+            check=True, capture_output=True, text=True, env=os.environ,
+        ).stdout
+        phases = json.loads(output.strip().splitlines()[-1])
+        phases["process"] = time.perf_counter() - started
+        results.append(phases)
+
+    print(f"холодных стартов: {runs} (первый — с созданием схемы)")
+    for phase in ("import", "init_db", "create", "first_update", "total", "process"):
+        values = [result[phase] for result in results]
+        rest = values[1:] or values
+        print(f"{phase:>13}: первый {values[0] * 1000:7.1f} мс, "
+              f"медиана остальных {statistics.median(rest) * 1000:7.1f} мс")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="число синтетических пользователей")
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="сколько пользователей одновременно (без --workers)")
+    parser.add_argument("--workers", type=int, help="прогнать через cluster.py с таким числом воркеров")
+    parser.add_argument("--stub-delay", type=float, default=0.05, help="задержка ответа заглушки parkspot.ru, с")
+    parser.add_argument("--startup", type=int, metavar="N", help="замерить N холодных стартов вместо нагрузки")
+    parser.add_argument("--startup-child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_child:
+        await startup_child()
+        return
+
+    # Окружение задаётся до импорта модулей бота: они читают его при импорте
+    tmp = tempfile.mkdtemp(prefix="parkspot-loadtest-")
+    os.environ["PARKSPOT_DB"] = os.path.join(tmp, "parkspot.db")
+    if args.startup:
+        run_startup(args.startup)
+        return
+
+    stub_runner, stub_url = await start_parkspot_stub(args.stub_delay)
+    os.environ["PARKSPOT_URL"] = stub_url
+    os.environ.setdefault("USER_RATE_LIMIT", "1000")
+    os.environ.setdefault("USER_RATE_BURST", "1000")
+    os.environ.setdefault("GLOBAL_RATE_LIMIT", "1000000")
+    os.environ.setdefault("GLOBAL_RATE_BURST", "1000000")
+    os.environ.setdefault("METRICS_PORT", "0")
+
+    if args.workers:
+        await run_cluster_load(args, stub_runner)
+    else:
+        await run_load(args, stub_runner)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
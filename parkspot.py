@@ -1,19 +1,147 @@
-import requests
+import asyncio
 import re
+import time
 from datetime import datetime
-from config import PARKSPOT_URL
+from html.parser import HTMLParser
 
+import aiohttp
+from yarl import URL
 
-def extract_text(html: str) -> str:
-    """Извлекает текст из HTML, убирая теги"""
-    # Убираем script и style
-    html = re.sub(r'<script[^>]*>.*?</script>', '', html, flags=re.DOTALL | re.IGNORECASE)
-    html = re.sub(r'<style[^>]*>.*?</style>', '', html, flags=re.DOTALL | re.IGNORECASE)
-    # Убираем теги
-    text = re.sub(r'<[^>]+>', ' ', html)
-    # Убираем лишние пробелы
-    text = re.sub(r'\s+', ' ', text).strip()
-    return text
+from config import (
+    PARKSPOT_URL, PARKSPOT_COOKIE_TTL, PARKSPOT_RETRIES,
+    BREAKER_THRESHOLD, BREAKER_RESET_TIMEOUT,
+)
+from metrics import EXTRACT_TEXT_SECONDS, HTTP_SECONDS, SUBMIT_RESULTS, timed
+from resilience import CircuitBreaker, retry
+
+# Коды ответа, по которым считаем, что сессия на сайте протухла
+STALE_STATUSES = (401, 403, 419, 440)
+
+# Сетевые ошибки, после которых идемпотентный запрос можно повторить
+RETRY_EXCEPTIONS = (aiohttp.ClientError, asyncio.TimeoutError)
+
+
+# Признаки элемента со статусом заявки в id/class
+STATUS_WORDS = ("alert", "message", "msg", "status", "result", "notice", "error", "success")
+STATUS_ATTR_RE = re.compile("|".join(STATUS_WORDS), re.IGNORECASE)
+
+# Теги, текст внутри которых не показываем
+SKIP_TAGS = {"script", "style", "noscript", "template"}
+
+# Размер куска HTML, который отдаём парсеру за раз
+CHUNK_SIZE = 4096
+
+
+class _TextExtractor(HTMLParser):
+    """
+    Потоковый разбор HTML в текст. Останавливается, как только закрылся
+    элемент со статусом заявки. Набрав limit символов текста страницы,
+    больше его не копит, но статус ищет до конца страницы.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+        self.done = False
+        self.words: list[str] = []
+        self.status_words: list[str] = []
+        self._length = 0
+        self._pending: list[str] = []
+        self._skip = 0
+        self._status_tag: str | None = None
+        self._status_depth = 0
+
+    def _flush(self):
+        if not self._pending:
+            return
+        words = "".join(self._pending).split()
+        self._pending.clear()
+        if self._skip or not words:
+            return
+        if self._status_tag:
+            self.status_words.extend(words)
+        if not self.full:
+            self.words.extend(words)
+            self._length += sum(len(w) + 1 for w in words)
+
+    @property
+    def in_status(self) -> bool:
+        return self._status_tag is not None
+
+    @property
+    def full(self) -> bool:
+        """Текста страницы набрано больше limit символов (в _length и пробел после последнего слова)"""
+        return self._length > self.limit + 1
+
+    def handle_starttag(self, tag, attrs):
+        self._flush()
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif self._status_tag == tag:
+            self._status_depth += 1
+        elif self._status_tag is None and not self.status_words:
+            attrs = dict(attrs)
+            marker = f"{attrs.get('id') or ''} {attrs.get('class') or ''}"
+            if STATUS_ATTR_RE.search(marker):
+                self._status_tag = tag
+                self._status_depth = 1
+
+    def handle_endtag(self, tag):
+        self._flush()
+        if tag in SKIP_TAGS:
+            self._skip = max(self._skip - 1, 0)
+        elif self._status_tag == tag:
+            self._status_depth -= 1
+            if self._status_depth == 0:
+                self._status_tag = None
+                if self.status_words:
+                    self.done = True
+
+    def handle_data(self, data):
+        # Текст вне статуса сверх лимита не нужен
+        if self.full and not self._status_tag:
+            return
+        self._pending.append(data)
+        # Длинный текстовый узел: дальше лимита всё равно не покажем
+        if len(data) > self.limit:
+            self._flush()
+
+    def close(self):
+        super().close()
+        self._flush()
+
+    def text(self) -> str:
+        text = " ".join(self.status_words or self.words)
+        if len(text) > self.limit:
+            text = text[:self.limit] + "..."
+        return text
+
+
+@timed(EXTRACT_TEXT_SECONDS)
+def extract_text(html: str, limit: int = 2000) -> str:
+    """
+    Извлекает текст из HTML для сообщения в Telegram.
+    Если в ответе есть элемент со статусом (alert, message, result...),
+    возвращает только его текст. Результат обрезается до limit символов.
+    """
+    parser = _TextExtractor(limit)
+    searched = False
+    for start in range(0, len(html), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        parser.feed(html[start:end])
+        if parser.done:
+            break
+        # Текст набран: если в неразобранной части нет ни одного признака
+        # статуса, дальше искать нечего (rawdata — хвост, который парсер ещё держит)
+        if parser.full and not parser.in_status and not searched:
+            searched = True
+            # lower() и find быстрее регулярного выражения с IGNORECASE на всю страницу
+            rest = html[max(end - len(parser.rawdata), 0):].lower()
+            if not any(word in rest for word in STATUS_WORDS):
+                break
+    else:
+        parser.close()
+    return parser.text()
 
 
 def parse_car_number(car_number: str) -> tuple[str, str]:
@@ -30,6 +158,114 @@ def parse_car_number(car_number: str) -> tuple[str, str]:
     return regnum, regreg
 
 
+class ParkspotSession:
+    """
+    Долгоживущая сессия parkspot.ru.
+
+    Держит keep-alive соединения и cookie jar между заявками. Главная страница
+    запрашивается только когда cookies истекли или сайт ответил, что сессия
+    устарела. Счётчики hits/misses показывают, сколько GET удалось сэкономить.
+    """
+
+    def __init__(self, base_url: str = PARKSPOT_URL, cookie_ttl: int = PARKSPOT_COOKIE_TTL):
+        self.base_url = base_url
+        self.cookie_ttl = cookie_ttl
+        self.hits = 0       # POST на уже имеющихся cookies
+        self.misses = 0     # пришлось делать GET за cookies
+        self.stale = 0      # сайт отверг сессию, cookies обновлены принудительно
+        self._session: aiohttp.ClientSession | None = None
+        self._cookies_at = 0.0
+        self._cookies_count = 0
+        self._lock = asyncio.Lock()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=10),
+            )
+            self._cookies_at = 0.0
+        return self._session
+
+    def _cookies_valid(self) -> bool:
+        if not self._cookies_at or time.monotonic() - self._cookies_at > self.cookie_ttl:
+            return False
+        # Если сайт выдавал cookies, а в jar их уже нет — они истекли
+        if self._cookies_count:
+            return bool(self._session.cookie_jar.filter_cookies(URL(self.base_url)))
+        return True
+
+    async def _refresh_cookies(self) -> None:
+        session = self._get_session()
+
+        async def get_main_page():
+            with HTTP_SECONDS.time("GET"):
+                async with session.get(self.base_url) as resp:
+                    resp.raise_for_status()
+                    await resp.read()
+
+        # GET главной страницы идемпотентен — его можно повторять
+        await retry(get_main_page, attempts=PARKSPOT_RETRIES, exceptions=RETRY_EXCEPTIONS)
+        self._cookies_count = len(session.cookie_jar.filter_cookies(URL(self.base_url)))
+        self._cookies_at = time.monotonic()
+
+    async def _ensure_cookies(self, force: bool = False) -> None:
+        async with self._lock:
+            if not force and self._cookies_valid():
+                self.hits += 1
+                return
+            self.misses += 1
+            await self._refresh_cookies()
+
+    async def post(self, path: str, data: dict) -> tuple[int, str]:
+        """POST формы на сайт. Возвращает (HTTP статус, HTML ответа)"""
+        session = self._get_session()
+        url = self.base_url.rstrip('/') + path
+        await self._ensure_cookies()
+
+        status, html = await self._post(session, url, data)
+        if status in STALE_STATUSES:
+            # Сайт не принял сессию — обновляем cookies и повторяем один раз
+            self.stale += 1
+            await self._ensure_cookies(force=True)
+            status, html = await self._post(session, url, data)
+        return status, html
+
+    @staticmethod
+    async def _post(session: aiohttp.ClientSession, url: str, data: dict) -> tuple[int, str]:
+        with HTTP_SECONDS.time("POST"):
+            async with session.post(url, data=data) as resp:
+                return resp.status, await resp.text(errors="replace")
+
+    async def ping(self, timeout: float = 5) -> bool:
+        """GET главной страницы без изменения cookies"""
+        session = self._get_session()
+        with HTTP_SECONDS.time("PING"):
+            async with session.get(self.base_url, timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                await resp.read()
+                return resp.status == 200
+
+    def stats(self) -> dict:
+        """Счётчики переиспользования cookies"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+# Общая сессия на весь процесс
+parkspot_session = ParkspotSession()
+
+
 async def submit_pass(car_number: str, car_model: str, entry_time: datetime) -> dict:
     """
     Отправляет заявку на пропуск через сайт parkspot.ru
@@ -42,13 +278,16 @@ async def submit_pass(car_number: str, car_model: str, entry_time: datetime) ->
     Returns:
         dict с результатом: {"success": bool, "message": str}
     """
-    try:
-        session = requests.Session()
+    result = await _submit_pass(car_number, car_model, entry_time)
+    SUBMIT_RESULTS.inc(result="success" if result["success"] else "failure")
+    return result
+
 
-        # Получаем страницу для cookies
-        resp = session.get(PARKSPOT_URL, timeout=10)
-        resp.raise_for_status()
+async def _submit_pass(car_number: str, car_model: str, entry_time: datetime) -> dict:
+    if not await parkspot_breaker.allow():
+        return {"success": False, "message": "Сайт parkspot.ru недоступен, попробуйте позже"}
 
+    try:
         # Разбираем номер на части
         regnum, regreg = parse_car_number(car_number)
 
@@ -62,25 +301,30 @@ async def submit_pass(car_number: str, car_model: str, entry_time: datetime) ->
             "PAS_PLAN_FROM": time_str,  # Время въезда
         }
 
-        # Отправляем на правильный endpoint
-        submit_url = PARKSPOT_URL.rstrip('/') + "/add_data_proc_7.php"
-        resp = session.post(submit_url, data=data, timeout=10)
+        # Отправляем на правильный endpoint. POST не повторяем: заявка
+        # могла дойти до сайта, повтор создал бы второй пропуск
+        try:
+            status, html = await parkspot_session.post("/add_data_proc_7.php", data)
+        except RETRY_EXCEPTIONS:
+            parkspot_breaker.record_failure()
+            raise
 
-        # Извлекаем текст из ответа
-        raw_text = extract_text(resp.text)
+        if status >= 500:
+            parkspot_breaker.record_failure()
+        else:
+            parkspot_breaker.record_success()
 
-        # Ограничиваем длину для Telegram
-        if len(raw_text) > 2000:
-            raw_text = raw_text[:2000] + "..."
+        # Извлекаем текст из ответа (с ограничением длины для Telegram)
+        raw_text = extract_text(html, limit=2000)
 
-        if resp.status_code == 200:
+        if status == 200:
             return {"success": True, "message": raw_text}
         else:
-            return {"success": False, "message": f"HTTP {resp.status_code}: {raw_text}"}
+            return {"success": False, "message": f"HTTP {status}: {raw_text}"}
 
-    except requests.Timeout:
+    except asyncio.TimeoutError:
         return {"success": False, "message": "Таймаут соединения"}
-    except requests.RequestException as e:
+    except aiohttp.ClientError as e:
         return {"success": False, "message": f"Ошибка сети: {str(e)}"}
     except Exception as e:
         return {"success": False, "message": f"Ошибка: {str(e)}"}
@@ -89,7 +333,14 @@ async def submit_pass(car_number: str, car_model: str, entry_time: datetime) ->
 async def test_connection() -> bool:
     """Проверяет доступность сайта"""
     try:
-        resp = requests.get(PARKSPOT_URL, timeout=5)
-        return resp.status_code == 200
-    except:
+        return await parkspot_session.ping(timeout=5)
+    except Exception:
         return False
+
+
+# Circuit breaker для parkspot.ru, пробный запрос в half-open — test_connection
+parkspot_breaker = CircuitBreaker(
+    probe=test_connection,
+    failure_threshold=BREAKER_THRESHOLD,
+    reset_timeout=BREAKER_RESET_TIMEOUT,
+)
@@ -0,0 +1,204 @@
+"""
+Профилирование обработки обновлений по запросу.
+
+Администратор (ADMIN_IDS) пишет /profile 200 — следующие 200 обновлений
+(или доля из них: /profile 200 0.25) профилируются cProfile, сводный
+отчёт пишется в PROFILE_DIR. То же при запуске: PROFILE_ON_START=200.
+Пока профилирование выключено, middleware стоит одной проверки флага.
+"""
+import asyncio
+import cProfile
+import io
+import os
+import pstats
+import random
+import sys
+from datetime import datetime
+from pathlib import Path
+
+from aiogram import BaseMiddleware, F, Router, types
+from aiogram.filters import Command, CommandObject
+
+import async_db
+from config import ADMIN_IDS, PROFILE_DIR, PROFILE_MAX_SECONDS, PROFILE_SAMPLE_RATE
+
+# С Python 3.12 cProfile работает через sys.monitoring и видит все потоки сразу,
+# раньше — только поток, в котором включён; поток БД тогда профилируется отдельно
+_PROFILES_ALL_THREADS = sys.version_info >= (3, 12)
+
+# Сколько строк в текстовом отчёте
+REPORT_LINES = 60
+
+
+class Profiler(BaseMiddleware):
+    """
+    Outer-middleware для dp.update. Включённый, профилирует обновление
+    с вероятностью sample_rate, по одному за раз (два cProfile не работают
+    одновременно), и копит статистику. Пока обновление профилируется,
+    в отчёт попадают и корутины, которые event loop выполняет в это время
+    (очередь заявок, другие обновления).
+
+    После limit обновлений или max_seconds секунд пишет отчёт: .prof
+    (для snakeviz, pstats) и .txt с функциями по суммарному времени.
+    """
+
+    def __init__(self, directory: str | Path = PROFILE_DIR, max_seconds: float = PROFILE_MAX_SECONDS):
+        self.directory = Path(directory)
+        self.max_seconds = max_seconds
+        self.active = False
+        self.limit = 0
+        self.sample_rate = 1.0
+        self.profiled = 0
+        self.reports = 0
+        self._busy = False
+        self._timer: asyncio.TimerHandle | None = None
+        self._stopping: asyncio.Task | None = None
+        self._stats: pstats.Stats | None = None
+        self._db_profile: cProfile.Profile | None = None
+        self._notify: tuple | None = None
+
+    async def start(self, limit: int, sample_rate: float = PROFILE_SAMPLE_RATE, notify=None) -> bool:
+        """
+        Профилировать limit обновлений. notify=(bot, chat_id) — куда сообщить об отчёте.
+        False — профилирование уже идёт.
+        """
+        if self.active:
+            return False
+        self.limit = limit
+        self.sample_rate = sample_rate
+        self.profiled = 0
+        self._stats = None
+        self._notify = notify
+        if not _PROFILES_ALL_THREADS:
+            self._db_profile = cProfile.Profile()
+            await async_db.run(self._db_profile.enable)
+        self._timer = asyncio.get_running_loop().call_later(self.max_seconds, self._expire)
+        self.active = True
+        return True
+
+    def _expire(self):
+        self._stopping = asyncio.create_task(self.stop())
+
+    async def stop(self, notify=None) -> list[Path]:
+        """
+        Выключить и записать отчёты. Возвращает пути к файлам.
+        notify=(bot, chat_id) — сообщить об отчёте сюда, а не тому, кто запускал.
+        """
+        if not self.active:
+            return []
+        self.active = False
+        self._timer.cancel()
+        notify = notify or self._notify
+        self._notify = None
+
+        stats = {"updates": self._stats}
+        if self._db_profile is not None:
+            await async_db.run(self._db_profile.disable)
+            stats["db"] = pstats.Stats(self._db_profile) if self._db_profile.getstats() else None
+            self._db_profile = None
+        self._stats = None
+
+        loop = asyncio.get_running_loop()
+        paths = await loop.run_in_executor(None, self._write_reports, stats, self.profiled)
+        self.reports += 1
+        print(f"Профилирование: {self.profiled} обновлений, отчёты: {', '.join(map(str, paths))}", flush=True)
+
+        if notify is not None:
+            bot, chat_id = notify
+            text = "\n".join(str(path) for path in paths) or "нечего записывать"
+            await bot.send_message(chat_id, f"Профилирование ({self.profiled} обновлений) завершено:\n{text}")
+        return paths
+
+    def _write_reports(self, stats: dict, updates: int) -> list[Path]:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        paths = []
+        for name, data in stats.items():
+            if data is None:
+                continue
+            # pid — в режиме cluster отчёты воркеров пишутся в одну папку
+            base = self.directory / f"profile-{stamp}-{os.getpid()}-{name}"
+            data.dump_stats(base.with_suffix(".prof"))
+
+            report = io.StringIO()
+            report.write(f"{name}: обновлений {updates}, доля {self.sample_rate}\n\n")
+            data.stream = report
+            data.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(REPORT_LINES)
+            base.with_suffix(".txt").write_text(report.getvalue(), encoding="utf-8")
+            paths.append(base.with_suffix(".txt"))
+        return paths
+
+    async def __call__(self, handler, event, data):
+        if not self.active:
+            return await handler(event, data)
+        if self._busy or random.random() >= self.sample_rate:
+            return await handler(event, data)
+
+        self._busy = True
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return await handler(event, data)
+        finally:
+            profile.disable()
+            self._busy = False
+            # Профилирование могли остановить, пока шло это обновление (/profile stop)
+            if self.active:
+                if self._stats is None:
+                    self._stats = pstats.Stats(profile)
+                else:
+                    self._stats.add(profile)
+                self.profiled += 1
+                if self.profiled >= self.limit:
+                    await self.stop()
+
+    def stats(self) -> dict:
+        return {"active": int(self.active), "profiled": self.profiled, "reports": self.reports}
+
+
+profiler = Profiler()
+
+# Команда /profile только для ADMIN_IDS; роутер подключается раньше основного,
+# чтобы команду не перехватил разбор времени
+profiling_router = Router()
+
+
+@profiling_router.message(Command("profile"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_profile(message: types.Message, command: CommandObject):
+    args = (command.args or "").split()
+
+    if not args:
+        state = f"идёт, профилировано {profiler.profiled} из {profiler.limit}" if profiler.active else "выключено"
+        await message.answer(
+            f"Профилирование: {state}.\n\n"
+            "/profile N — профилировать N обновлений\n"
+            "/profile N 0.25 — каждое четвёртое из них\n"
+            "/profile stop — остановить и записать отчёт"
+        )
+        return
+
+    if args[0] == "stop":
+        if not profiler.active:
+            await message.answer("Профилирование не идёт.")
+            return
+        # Об отчёте stop() сообщит в этот чат
+        await profiler.stop(notify=(message.bot, message.chat.id))
+        return
+
+    try:
+        limit = int(args[0])
+        sample_rate = float(args[1]) if len(args) > 1 else PROFILE_SAMPLE_RATE
+    except ValueError:
+        await message.answer("Формат: /profile N [доля]")
+        return
+    if limit <= 0 or not 0 < sample_rate <= 1:
+        await message.answer("N — больше нуля, доля — от 0 до 1.")
+        return
+
+    if await profiler.start(limit, sample_rate, notify=(message.bot, message.chat.id)):
+        await message.answer(
+            f"Профилирую {limit} обновлений (доля {sample_rate}), "
+            f"не дольше {PROFILE_MAX_SECONDS // 60} мин. Отчёт пришлю сюда."
+        )
+    else:
+        await message.answer("Профилирование уже идёт: /profile stop")
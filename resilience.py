@@ -0,0 +1,82 @@
+"""Повторы с экспоненциальной задержкой и circuit breaker для внешних запросов"""
+import asyncio
+import random
+import time
+
+
+async def retry(func, attempts: int = 3, base_delay: float = 0.5, max_delay: float = 5.0,
+                exceptions: tuple = (Exception,)):
+    """
+    Вызывает корутинную функцию func() до attempts раз.
+    Между попытками ждёт случайное время от 0 до base_delay * 2^n (не больше max_delay).
+    Использовать только для идемпотентных запросов.
+    """
+    for attempt in range(attempts):
+        try:
+            return await func()
+        except exceptions:
+            if attempt == attempts - 1:
+                raise
+            delay = min(max_delay, base_delay * 2 ** attempt)
+            await asyncio.sleep(random.uniform(0, delay))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker: после failure_threshold ошибок подряд переходит в состояние
+    open и сразу отказывает. Через reset_timeout секунд (half-open) выполняет
+    пробный probe(); если он успешен — снова пропускает запросы.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, probe=None, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.probe = probe
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_lock = asyncio.Lock()
+
+    async def allow(self) -> bool:
+        """Можно ли сейчас обращаться к сервису"""
+        if self.state == self.CLOSED:
+            return True
+        if time.monotonic() - self.opened_at < self.reset_timeout or self._probe_lock.locked():
+            self.rejected += 1
+            return False
+
+        async with self._probe_lock:
+            self.state = self.HALF_OPEN
+            ok = False
+            if self.probe is not None:
+                try:
+                    ok = await self.probe()
+                except Exception:
+                    ok = False
+            if ok:
+                self.record_success()
+                return True
+            self._open()
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
@@ -0,0 +1,140 @@
+"""Планировщик повторяющихся и отложенных заказов пропусков"""
+import asyncio
+import heapq
+from datetime import date, datetime, time, timedelta
+
+from async_db import delete_scheduled_order, get_scheduled_orders, mark_scheduled_order_fired
+from config import MSK, SCHEDULE_LEAD_MINUTES
+
+# Дольше этого не спим без проверки часов (перевод времени, сон машины)
+MAX_SLEEP = 3600
+
+
+def next_entry(order: tuple, after: datetime) -> datetime | None:
+    """Ближайшее время въезда по заказу строго после after (None — больше не сработает)"""
+    order_id, chat_id, car_id, weekdays, hour, minute, once_date, last_entry = order
+    at = time(hour, minute)
+
+    if not weekdays:
+        entry = datetime.combine(date.fromisoformat(once_date), at)
+        return entry if entry > after else None
+
+    day = after.date()
+    for offset in range(8):
+        entry = datetime.combine(day + timedelta(days=offset), at)
+        if entry > after and weekdays >> entry.weekday() & 1:
+            return entry
+    return None
+
+
+class Scheduler:
+    """
+    Планировщик заказов на куче: в памяти лежат (время срабатывания, id, время въезда),
+    одна задача спит до ближайшего срабатывания. База читается только при старте,
+    дальше пишется лишь отметка о срабатывании.
+
+    fire(order, entry_time) — корутина, которая оформляет пропуск;
+    если она вернула False, заказ отменяется.
+    partition=(номер, всего) — загружать только заказы чатов с chat_id % всего == номер
+    (режим cluster: у каждого воркера свои чаты).
+    """
+
+    def __init__(self, fire, lead_minutes: int = SCHEDULE_LEAD_MINUTES,
+                 partition: tuple[int, int] | None = None):
+        self.fire = fire
+        self.lead = timedelta(minutes=lead_minutes)
+        self.partition = partition
+        self.fired = 0
+        self._orders: dict[int, tuple] = {}
+        self._heap: list[tuple[datetime, int, datetime]] = []
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        # Идущие срабатывания: event loop держит на задачи только слабые ссылки
+        self._firing: set[asyncio.Task] = set()
+
+    @staticmethod
+    def _now() -> datetime:
+        return datetime.now(MSK).replace(tzinfo=None)
+
+    async def start(self):
+        """Загрузить заказы из базы и запустить цикл"""
+        for order in await get_scheduled_orders():
+            if self.partition is None or order[1] % self.partition[1] == self.partition[0]:
+                self._push(order)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Уже начатые заказы пропусков доводим до конца
+        if self._firing:
+            await asyncio.gather(*self._firing, return_exceptions=True)
+
+    def _push(self, order: tuple, after: datetime | None = None) -> datetime | None:
+        last_entry = order[7]
+        if after is None:
+            after = self._now()
+            # Не повторяем срабатывание, которое уже было до перезапуска
+            if last_entry:
+                after = max(after, datetime.fromisoformat(last_entry))
+        entry = next_entry(order, after)
+        if entry is None:
+            self._orders.pop(order[0], None)
+            return None
+        self._orders[order[0]] = order
+        heapq.heappush(self._heap, (entry - self.lead, order[0], entry))
+        return entry
+
+    def add(self, order: tuple) -> datetime | None:
+        """Добавить новый заказ. Возвращает ближайшее время въезда"""
+        entry = self._push(order)
+        self._wakeup.set()
+        return entry
+
+    async def remove(self, order_id: int) -> bool:
+        """Удалить заказ (из кучи он уйдёт лениво при срабатывании)"""
+        self._orders.pop(order_id, None)
+        return await delete_scheduled_order(order_id)
+
+    def orders_for_chat(self, chat_id: int) -> list[tuple[tuple, datetime]]:
+        """Заказы чата с ближайшим временем въезда"""
+        upcoming = {order_id: entry for _, order_id, entry in self._heap}
+        return sorted(
+            ((order, upcoming[order_id]) for order_id, order in self._orders.items()
+             if order[1] == chat_id and order_id in upcoming),
+            key=lambda item: item[1],
+        )
+
+    async def _run(self):
+        while True:
+            now = self._now()
+            while self._heap and self._heap[0][0] <= now:
+                _, order_id, entry = heapq.heappop(self._heap)
+                order = self._orders.get(order_id)
+                if order is None:
+                    continue
+                task = asyncio.create_task(self._fire(order, entry))
+                self._firing.add(task)
+                task.add_done_callback(self._firing.discard)
+                if self._push(order, after=entry) is None:
+                    await delete_scheduled_order(order_id)
+
+            timeout = MAX_SLEEP
+            if self._heap:
+                timeout = min(timeout, (self._heap[0][0] - now).total_seconds())
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, order: tuple, entry_time: datetime):
+        self.fired += 1
+        await mark_scheduled_order_fired(order[0], entry_time)
+        try:
+            if await self.fire(order, entry_time) is False:
+                await self.remove(order[0])
+        except Exception as e:
+            print(f"Плановый заказ #{order[0]}: ошибка {e}", flush=True)
@@ -0,0 +1,123 @@
+"""Хранилище незавершённых диалогов (выбранное время, отмеченные машины)"""
+import json
+import time
+from collections import OrderedDict
+
+import async_db
+
+
+class StateEntry:
+    """Значение с моментом истечения (time.time())"""
+    __slots__ = ("value", "expires_at")
+
+    def __init__(self, value, expires_at: float):
+        self.value = value
+        self.expires_at = expires_at
+
+
+class SQLiteStateBackend:
+    """Сохранение состояний в таблицу pending_state, чтобы пережить перезапуск"""
+
+    def __init__(self, namespace: str, encode=json.dumps, decode=json.loads):
+        self.namespace = namespace
+        self.encode = encode
+        self.decode = decode
+
+    async def save(self, key: int, value, expires_at: float):
+        await async_db.save_state(self.namespace, key, self.encode(value), expires_at)
+
+    async def delete(self, key: int):
+        await async_db.delete_state(self.namespace, key)
+
+    async def load(self) -> list[tuple[int, object, float]]:
+        rows = await async_db.load_states(self.namespace)
+        return [(key, self.decode(value), expires_at) for key, value, expires_at in rows]
+
+    async def purge(self, now: float):
+        await async_db.purge_states(now)
+
+
+class StateStore:
+    """
+    Состояния пользователей с TTL и ограничением размера.
+
+    Записи лежат в порядке установки, а TTL у всех одинаковый, поэтому
+    просроченные всегда в начале и вычищаются при записи за O(1) на запись.
+    При переполнении вытесняются самые старые. backend — необязательное
+    сохранение в базу; просроченные удаляются из неё одним запросом
+    на всю пачку, а не по одному.
+    """
+
+    def __init__(self, ttl: float, max_size: int, backend: SQLiteStateBackend | None = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.backend = backend
+        self.expired = 0
+        self.evicted = 0
+        self._items: OrderedDict[int, StateEntry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    async def load(self):
+        """Загрузить сохранённые состояния из базы"""
+        if self.backend is None:
+            return
+        now = time.time()
+        for key, value, expires_at in sorted(await self.backend.load(), key=lambda row: row[2]):
+            if expires_at > now:
+                self._items[key] = StateEntry(value, expires_at)
+
+    async def get(self, key: int, default=None):
+        entry = self._items.get(key)
+        if entry is None:
+            return default
+        if entry.expires_at <= time.time():
+            # Строку в базе уберёт общая чистка, при загрузке истёкшие не читаются
+            del self._items[key]
+            self.expired += 1
+            return default
+        return entry.value
+
+    async def set(self, key: int, value):
+        expires_at = time.time() + self.ttl
+        self._items[key] = StateEntry(value, expires_at)
+        self._items.move_to_end(key)
+        await self._evict()
+        if self.backend is not None:
+            await self.backend.save(key, value, expires_at)
+
+    async def pop(self, key: int, default=None):
+        value = await self.get(key, default)
+        if key in self._items:
+            await self._drop(key)
+        return value
+
+    async def _drop(self, key: int):
+        del self._items[key]
+        if self.backend is not None:
+            await self.backend.delete(key)
+
+    async def _evict(self):
+        now = time.time()
+        expired = 0
+        while self._items:
+            key, entry = next(iter(self._items.items()))
+            if entry.expires_at <= now:
+                del self._items[key]
+                expired += 1
+            elif len(self._items) > self.max_size:
+                self.evicted += 1
+                await self._drop(key)
+            else:
+                break
+        if expired:
+            self.expired += expired
+            # Таблица OrderedDict сама не сжимается: после большой чистки пересобираем
+            if expired > len(self._items):
+                self._items = OrderedDict(self._items)
+            if self.backend is not None:
+                await self.backend.purge(now)
+
+    def stats(self) -> dict:
+        return {"size": len(self._items), "expired": self.expired, "evicted": self.evicted}
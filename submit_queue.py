@@ -0,0 +1,104 @@
+"""Очередь заявок на пропуск с ограниченным числом одновременных отправок"""
+import asyncio
+import time
+from datetime import datetime
+
+from config import SUBMIT_WORKERS
+from parkspot import submit_pass
+
+
+class SubmitQueue:
+    """
+    Очередь заявок на parkspot.ru с пулом из workers воркеров.
+
+    Одинаковые заявки (номер, время въезда), которые уже в очереди или
+    отправляются, не дублируются: повторный вызов ждёт тот же результат,
+    даже из другого чата. Чаты, ждущие заявку, запоминаются — история
+    пишется каждому из них по разу.
+    """
+
+    def __init__(self, workers: int = SUBMIT_WORKERS):
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._in_flight: dict[tuple, tuple[asyncio.Future, set[int]]] = {}
+        self._tasks: list[asyncio.Task] = []
+        self.submitted = 0
+        self.coalesced = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _ensure_started(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def submit(self, chat_id: int, car_number: str, car_model: str,
+                     entry_time: datetime) -> tuple[dict, bool]:
+        """
+        Поставить заявку чата в очередь и дождаться ответа сайта.
+
+        Returns:
+            (результат submit_pass, fresh) — fresh=False, если этот же чат
+            уже ждёт такую заявку (в историю её второй раз не пишем)
+        """
+        self._ensure_started()
+        key = (car_number.replace(" ", "").upper(), entry_time)
+        if key in self._in_flight:
+            future, chats = self._in_flight[key]
+            self.coalesced += 1
+        else:
+            future, chats = asyncio.get_running_loop().create_future(), set()
+            self._in_flight[key] = future, chats
+            self._queue.put_nowait((key, car_number, car_model, entry_time, future, time.monotonic()))
+            self.submitted += 1
+        fresh = chat_id not in chats
+        chats.add(chat_id)
+
+        # shield: отмена одного ожидающего не отменяет заявку для остальных
+        return await asyncio.shield(future), fresh
+
+    async def _worker(self):
+        while True:
+            key, car_number, car_model, entry_time, future, enqueued_at = await self._queue.get()
+            wait = time.monotonic() - enqueued_at
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            try:
+                result = await submit_pass(car_number, car_model, entry_time)
+            except Exception as e:
+                result = {"success": False, "message": f"Ошибка: {str(e)}"}
+            finally:
+                self._in_flight.pop(key, None)
+                self._queue.task_done()
+            self.completed += 1
+            if not future.done():
+                future.set_result(result)
+
+    async def stop(self, timeout: float = 30):
+        """Дождаться уже поставленных заявок и остановить воркеров"""
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        """Глубина очереди и время ожидания"""
+        return {
+            "depth": self._queue.qsize(),
+            "in_flight": len(self._in_flight),
+            "workers": self.workers,
+            "submitted": self.submitted,
+            "coalesced": self.coalesced,
+            "completed": self.completed,
+            "wait_avg": self.wait_total / self.completed if self.completed else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+# Общая очередь на весь процесс
+submit_queue = SubmitQueue()
@@ -0,0 +1,35 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# Тесты работают со своей базой: DB_PATH читается при импорте database
+os.environ.setdefault("PARKSPOT_DB", str(Path(tempfile.mkdtemp(prefix="parkspot-tests-")) / "parkspot.db"))
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+@pytest.fixture(scope="session")
+def fake_bot():
+    """Bot с сессией-заглушкой Bot API из loadtest"""
+    from loadtest import make_fake_bot
+    return make_fake_bot()
+
+
+@pytest.fixture(scope="session")
+def dispatcher():
+    """Dispatcher бота: роутер подключается один раз на процесс, поэтому общий на все тесты"""
+    import bot
+    from scheduler import Scheduler
+
+    async def fire(order, entry_time):
+        return True
+
+    return bot.create_dispatcher(Scheduler(fire))
+
+
+@pytest.fixture(scope="session")
+def updates():
+    from loadtest import UpdateFactory
+    return UpdateFactory()
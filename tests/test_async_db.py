@@ -0,0 +1,54 @@
+import asyncio
+import time
+from datetime import datetime
+
+import async_db
+import database
+
+SLOW_WRITE = 0.5
+
+
+def test_slow_write_does_not_delay_other_handlers(monkeypatch, dispatcher, fake_bot, updates):
+    add_parking_order = database.add_parking_order
+
+    def slow_add_parking_order(*args):
+        # commit упёрся в медленный диск
+        time.sleep(SLOW_WRITE)
+        return add_parking_order(*args)
+
+    monkeypatch.setattr(database, "add_parking_order", slow_add_parking_order)
+
+    async def scenario():
+        await async_db.init_db()
+        write = asyncio.create_task(async_db.add_parking_order(
+            101, "секвойя", "А606ВО 797", "Тойота", datetime(2026, 10, 14, 15, 30), "ok",
+        ))
+        await asyncio.sleep(0.05)
+
+        # Пока запись идёт, другой пользователь получает ответ на /start
+        started = time.perf_counter()
+        await dispatcher.feed_update(fake_bot, updates.message(202, "/start"))
+        handled = time.perf_counter() - started
+
+        order_id = await write
+        return handled, order_id
+
+    handled, order_id = asyncio.run(scenario())
+
+    assert handled < SLOW_WRITE / 5
+    assert database.get_recent_orders(101, 1)[0][0] == order_id
+
+
+def test_event_loop_keeps_ticking_during_slow_write(monkeypatch):
+    monkeypatch.setattr(database, "save_state", lambda *args: time.sleep(SLOW_WRITE))
+
+    async def scenario():
+        write = asyncio.create_task(async_db.save_state("test", 1, "{}", time.time() + 60))
+        lag = 0.0
+        while not write.done():
+            mark = time.perf_counter()
+            await asyncio.sleep(0.01)
+            lag = max(lag, time.perf_counter() - mark - 0.01)
+        return lag
+
+    assert asyncio.run(scenario()) < SLOW_WRITE / 5
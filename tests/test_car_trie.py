@@ -0,0 +1,62 @@
+from car_trie import CarNameTrie
+from database import CarRegistry
+
+SEQUOIA = (1, "секвойя", "А606ВО 797", "Тойота")
+PAN = (2, "пан", "В001ВО 797", "Лада")
+PANAMERA = (3, "панама", "У657НУ 797", "Порше")
+
+
+def make_trie(*cars) -> CarNameTrie:
+    trie = CarNameTrie()
+    for car in cars:
+        trie.insert(car[1], car)
+    return trie
+
+
+def test_longest_prefix_prefers_longer_name():
+    # Результат не зависит от порядка добавления
+    for trie in (make_trie(PAN, PANAMERA), make_trie(PANAMERA, PAN)):
+        assert trie.longest_prefix("панама 15:30") == (PANAMERA, 6)
+        assert trie.longest_prefix("пан 15:30") == (PAN, 3)
+        assert trie.longest_prefix("панорама 15:30") == (PAN, 3)
+        assert trie.longest_prefix("15:30") is None
+
+
+def test_remove_prunes_only_its_branch():
+    trie = make_trie(PAN, PANAMERA, SEQUOIA)
+
+    assert trie.remove("панама")
+    assert not trie.remove("панама")
+    assert trie.longest_prefix("панама 15:30") == (PAN, 3)
+    assert trie.remove("пан")
+    assert trie.longest_prefix("пан 15:30") is None
+    assert len(trie) == 1
+
+
+def test_starting_with_is_alphabetical_and_limited():
+    trie = make_trie(SEQUOIA, PANAMERA, PAN)
+
+    assert trie.starting_with("па") == [PAN, PANAMERA]
+    assert trie.starting_with("", limit=2) == [PAN, PANAMERA]
+    assert trie.starting_with("х") == []
+
+
+def test_registry_updates_incrementally():
+    registry = CarRegistry()
+    registry.load([SEQUOIA, PANAMERA])
+    version = registry.version
+
+    registry.put(PAN)
+    assert registry.all() == [PAN, PANAMERA, SEQUOIA]
+    assert registry.match_prefix("Пан 15:30") == (PAN, 3)
+
+    renamed = (PAN[0], "ауди", *PAN[2:])
+    registry.put(renamed)
+    assert registry.all() == [renamed, PANAMERA, SEQUOIA]
+    assert registry.by_name("пан") is None
+    assert registry.match_prefix("пан 15:30") is None
+
+    registry.remove(PANAMERA[0])
+    assert registry.all() == [renamed, SEQUOIA]
+    assert registry.match_prefix("панама 15:30") is None
+    assert registry.version > version
@@ -0,0 +1,41 @@
+import time
+
+from cluster import Cluster, submit_share
+from loadtest import make_fake_bot
+
+
+def start_update(update_id: int, chat_id: int) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": f"user{chat_id}"}
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": int(time.time()), "text": "/start",
+        "chat": {"id": chat_id, "type": "private"}, "from": user,
+    }}
+
+
+def test_stop_does_not_wait_for_dead_worker(monkeypatch):
+    # Воркеры — отдельные процессы, настройки получают через окружение
+    monkeypatch.setenv("METRICS_PORT", "0")
+    cluster = Cluster(2, bot_factory=make_fake_bot, collect_results=True)
+    cluster.start()
+    try:
+        cluster.wait_ready()
+        assert cluster.dead() == []
+
+        # Воркер 0 умирает (SIGTERM он игнорирует), воркер 1 работает дальше
+        cluster._workers[0].kill()
+        cluster._workers[0].join()
+        for update_id in range(1, 4):
+            cluster.feed(start_update(update_id, chat_id=1))
+        assert cluster.dead() == ["parkspot-worker-0 (код -9)"]
+    finally:
+        started = time.perf_counter()
+        cluster.stop()
+
+    assert time.perf_counter() - started < 10
+    assert [(index, len(latencies)) for index, latencies, _ in cluster.collected] == [(1, 3)]
+
+
+def test_submit_concurrency_is_shared_between_workers():
+    assert [submit_share(4, index, 3) for index in range(3)] == [2, 1, 1]
+    # Воркеров больше, чем заявок: по одной на воркер
+    assert [submit_share(4, index, 8) for index in range(8)] == [1] * 8
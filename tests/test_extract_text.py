@@ -0,0 +1,28 @@
+from parkspot import extract_text
+
+
+def test_status_element_wins_over_page_text():
+    html = (
+        "<html><head><title>parkspot</title><script>var x = '<div class=\"alert\">нет</div>';</script></head>"
+        "<body><ul><li>Главная</li></ul>"
+        '<div class="alert alert-success">Заявка <b>принята</b> <div>А606ВО 797</div></div>'
+        "<p>Подвал</p></body></html>"
+    )
+    assert extract_text(html) == "Заявка принята А606ВО 797"
+
+
+def test_page_text_without_status_skips_scripts_and_styles():
+    html = "<html><style>p { color: red }</style><body><p>Форма   заявки</p><script>alert(1)</script>ok</body></html>"
+    assert extract_text(html) == "Форма заявки ok"
+
+
+def test_long_text_is_cut_to_limit():
+    html = "<body>" + "<p>слово</p>" * 10_000 + "</body>"
+    text = extract_text(html, limit=100)
+    assert text.endswith("...")
+    assert len(text) == 103
+
+
+def test_status_after_limit_is_found():
+    html = "<body>" + "<p>Главная Помощь</p>" * 500 + '<div id="result">Заявка принята</div></body>'
+    assert extract_text(html, limit=100) == "Заявка принята"
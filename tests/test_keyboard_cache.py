@@ -0,0 +1,22 @@
+from aiogram.types import InlineKeyboardMarkup
+
+from bot import KeyboardCache
+
+
+def test_old_versions_are_evicted():
+    cache = KeyboardCache(max_size=3)
+
+    def keyboard(key):
+        # Как в боте: сначала поиск, при промахе сборка и put
+        return cache.get(key) or cache.put(key, InlineKeyboardMarkup(inline_keyboard=[]))
+
+    first = keyboard(("cars", 1, 0))
+    keyboard(("cars", 2, 0))
+    # Чат 1 пользуется своей клавиатурой, чат 2 дважды сменил машины
+    assert keyboard(("cars", 1, 0)) is first
+    keyboard(("cars", 2, 1))
+    keyboard(("cars", 2, 2))
+
+    assert cache.stats()["size"] == 3
+    assert cache.get(("cars", 2, 0)) is None
+    assert cache.get(("cars", 1, 0)) is first
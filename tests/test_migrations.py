@@ -0,0 +1,124 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+import async_db
+import database
+
+# Схема первых версий бота: время заказов — ISO-текст
+BASELINE_SCHEMA = '''
+    CREATE TABLE cars (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE NOT NULL,
+        number TEXT NOT NULL,
+        model TEXT NOT NULL
+    );
+    CREATE TABLE parking_orders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        car_name TEXT NOT NULL,
+        car_number TEXT NOT NULL,
+        car_model TEXT NOT NULL,
+        entry_time TEXT NOT NULL,
+        created_at TEXT NOT NULL,
+        response TEXT
+    );
+    INSERT INTO cars (name, number, model) VALUES ('секвойя', 'А606ВО 797', 'Тойота');
+'''
+
+GOOD_ORDER = ('секвойя', 'А606ВО 797', 'Тойота', '2025-03-01T09:30:00', '2025-02-28T20:00:00.123456', 'ok')
+
+
+@pytest.fixture
+def baseline_db(monkeypatch, tmp_path):
+    """База первой версии вместо общей базы тестов"""
+    path = tmp_path / "baseline.db"
+    conn = sqlite3.connect(path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.commit()
+    conn.close()
+
+    monkeypatch.setattr(database, "DB_PATH", path)
+    monkeypatch.setattr(database, "_conn", None)
+    monkeypatch.setattr(database, "_initialized", False)
+    monkeypatch.setattr(database, "car_registries", {})
+    yield path
+    database.close_db()
+
+
+def add_orders(path, *orders):
+    with sqlite3.connect(path) as conn:
+        conn.executemany(
+            'INSERT INTO parking_orders (car_name, car_number, car_model, entry_time, created_at, response) '
+            'VALUES (?, ?, ?, ?, ?, ?)', orders,
+        )
+    conn.close()
+
+
+def schema(path) -> tuple[int, set[str]]:
+    with sqlite3.connect(path) as conn:
+        version = conn.execute('PRAGMA user_version').fetchone()[0]
+        tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    return version, tables
+
+
+def test_failed_migration_leaves_database_untouched(baseline_db):
+    add_orders(baseline_db, GOOD_ORDER, GOOD_ORDER[:3] + ('не время', '2025-02-28T20:00:00', 'ok'))
+
+    for _ in range(2):
+        with pytest.raises(sqlite3.OperationalError):
+            database.init_db()
+        database.close_db()
+        version, tables = schema(baseline_db)
+        assert version == 0
+        assert 'parking_orders_v0' not in tables
+
+    # Заказы остались на месте, в прежней схеме
+    with sqlite3.connect(baseline_db) as conn:
+        assert conn.execute('SELECT COUNT(entry_time) FROM parking_orders').fetchone()[0] == 2
+    conn.close()
+
+
+def test_unreadable_created_at_falls_back_to_entry_time(baseline_db):
+    add_orders(baseline_db, GOOD_ORDER, GOOD_ORDER[:4] + ('вчера', 'ok'))
+
+    database.init_db()
+
+    rows = database.get_connection().execute('SELECT entry_ts, created_ts FROM parking_orders').fetchall()
+    assert len(rows) == 2
+    assert rows[1][0] == rows[1][1]
+    assert schema(baseline_db)[0] == database.SCHEMA_VERSION
+
+
+def test_leftover_table_from_interrupted_migration_is_resumed(baseline_db):
+    add_orders(baseline_db, GOOD_ORDER, GOOD_ORDER)
+    # Так базу оставляли прежние версии: таблица переименована, новая пуста
+    with sqlite3.connect(baseline_db) as conn:
+        conn.execute('ALTER TABLE parking_orders RENAME TO parking_orders_v0')
+        conn.execute(database.SQL_CREATE_ORDERS)
+    conn.close()
+
+    database.init_db()
+
+    version, tables = schema(baseline_db)
+    assert version == database.SCHEMA_VERSION
+    assert 'parking_orders_v0' not in tables
+    assert database.get_connection().execute('SELECT COUNT(*) FROM parking_orders').fetchone()[0] == 2
+
+
+def test_legacy_fleet_waits_for_explicit_claim(baseline_db):
+    add_orders(baseline_db, GOOD_ORDER)
+
+    async def scenario():
+        await async_db.init_db()
+        # Чат, первым обратившийся к боту, чужой парк не получает
+        stranger = await async_db.get_all_cars(111)
+        claimed = await async_db.claim_legacy_fleet(222)
+        return stranger, claimed, await async_db.get_all_cars(222), await async_db.get_recent_orders(111, 5)
+
+    stranger, claimed, cars, stranger_orders = asyncio.run(scenario())
+
+    assert stranger == [] and stranger_orders == []
+    assert claimed == (1, 1)
+    assert [car[1] for car in cars] == ['секвойя']
@@ -0,0 +1,36 @@
+import asyncio
+import time
+from datetime import datetime
+
+import parkspot
+from loadtest import start_parkspot_stub
+from parkspot import ParkspotSession, submit_pass
+from resilience import CircuitBreaker
+
+DELAY = 0.5
+SUBMISSIONS = 50
+
+
+def test_concurrent_submissions_do_not_queue_behind_each_other(monkeypatch):
+    async def scenario():
+        runner, url = await start_parkspot_stub(DELAY)
+        session = ParkspotSession(base_url=url)
+        monkeypatch.setattr(parkspot, "parkspot_session", session)
+        monkeypatch.setattr(parkspot, "parkspot_breaker", CircuitBreaker())
+        try:
+            started = time.perf_counter()
+            results = await asyncio.gather(*(
+                submit_pass("А606ВО 797", "Тойота", datetime(2026, 10, 14, 15, 30))
+                for _ in range(SUBMISSIONS)
+            ))
+            return results, time.perf_counter() - started
+        finally:
+            await session.close()
+            await runner.cleanup()
+
+    results, elapsed = asyncio.run(scenario())
+
+    assert all(result == {"success": True, "message": "Заявка принята"} for result in results)
+    # Пул держит 20 соединений: 50 заявок — три волны по одному медленному
+    # ответу, а не 50 ответов подряд, как при блокирующем клиенте
+    assert elapsed < 4 * DELAY
@@ -0,0 +1,131 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from aiohttp import web
+
+import parkspot
+import resilience
+from parkspot import ParkspotSession, submit_pass
+from resilience import CircuitBreaker
+
+ENTRY = datetime(2026, 10, 14, 15, 30)
+
+
+class FlakyParkspot:
+    """Заглушка parkspot.ru: первые fail_posts заявок и fail_gets GET отвечают 500"""
+
+    def __init__(self, fail_posts: int = 0, fail_gets: int = 0):
+        self.fail_posts = fail_posts
+        self.fail_gets = fail_gets
+        self.posts = 0
+        self.gets = 0
+
+    async def index(self, request):
+        self.gets += 1
+        if self.fail_gets:
+            self.fail_gets -= 1
+            return web.Response(status=500, text="down")
+        response = web.Response(text="<html><body>parkspot</body></html>", content_type="text/html")
+        response.set_cookie("PHPSESSID", "test")
+        return response
+
+    async def submit(self, request):
+        self.posts += 1
+        await request.post()
+        if self.fail_posts:
+            self.fail_posts -= 1
+            return web.Response(status=500, text='<div class="error">Ошибка сервера</div>', content_type="text/html")
+        return web.Response(text='<div class="alert">Заявка принята</div>', content_type="text/html")
+
+    async def start(self) -> tuple[web.AppRunner, str]:
+        app = web.Application()
+        app.router.add_get("/", self.index)
+        app.router.add_post("/add_data_proc_7.php", self.submit)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/"
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Повторы без пауз между попытками"""
+    monkeypatch.setattr(resilience.random, "uniform", lambda a, b: 0)
+
+
+async def with_stub(stub: FlakyParkspot, monkeypatch, scenario, breaker: CircuitBreaker | None = None):
+    runner, url = await stub.start()
+    session = ParkspotSession(base_url=url)
+    monkeypatch.setattr(parkspot, "parkspot_session", session)
+    monkeypatch.setattr(parkspot, "parkspot_breaker", breaker or CircuitBreaker())
+    try:
+        return await scenario()
+    finally:
+        await session.close()
+        await runner.cleanup()
+
+
+def test_main_page_get_is_retried(monkeypatch, no_backoff):
+    stub = FlakyParkspot(fail_gets=2)
+
+    result = asyncio.run(with_stub(stub, monkeypatch, lambda: submit_pass("А606ВО 797", "Тойота", ENTRY)))
+
+    assert result == {"success": True, "message": "Заявка принята"}
+    assert stub.gets == 3
+    assert stub.posts == 1
+
+
+def test_failed_post_is_not_retried(monkeypatch, no_backoff):
+    stub = FlakyParkspot(fail_posts=1)
+
+    result = asyncio.run(with_stub(stub, monkeypatch, lambda: submit_pass("А606ВО 797", "Тойота", ENTRY)))
+
+    assert result == {"success": False, "message": "HTTP 500: Ошибка сервера"}
+    # Заявка могла дойти до сайта: повтор создал бы второй пропуск
+    assert stub.posts == 1
+
+
+def test_breaker_opens_probes_and_closes(monkeypatch, no_backoff):
+    stub = FlakyParkspot(fail_posts=2)
+    states = []
+    probed_in = []
+
+    async def probe():
+        probed_in.append(breaker.state)
+        return await parkspot.test_connection()
+
+    breaker = CircuitBreaker(probe=probe, failure_threshold=2, reset_timeout=0.2)
+
+    async def scenario():
+        for _ in range(2):
+            await submit_pass("А606ВО 797", "Тойота", ENTRY)
+        states.append(breaker.state)
+
+        # open: заявки отклоняются сразу, сайт не трогаем
+        rejected = await submit_pass("А606ВО 797", "Тойота", ENTRY)
+        states.append(breaker.state)
+        posts_while_open = stub.posts
+
+        # half-open: пробный GET упал — снова open на reset_timeout
+        await asyncio.sleep(0.25)
+        stub.fail_gets = 1
+        await submit_pass("А606ВО 797", "Тойота", ENTRY)
+        states.append(breaker.state)
+
+        # Сайт поднялся: пробный GET успешен — closed, заявка уходит
+        await asyncio.sleep(0.25)
+        recovered = await submit_pass("А606ВО 797", "Тойота", ENTRY)
+        states.append(breaker.state)
+        return rejected, posts_while_open, recovered
+
+    rejected, posts_while_open, recovered = asyncio.run(with_stub(stub, monkeypatch, scenario, breaker))
+
+    assert states == [CircuitBreaker.OPEN, CircuitBreaker.OPEN, CircuitBreaker.OPEN, CircuitBreaker.CLOSED]
+    assert probed_in == [CircuitBreaker.HALF_OPEN, CircuitBreaker.HALF_OPEN]
+    assert rejected == {"success": False, "message": "Сайт parkspot.ru недоступен, попробуйте позже"}
+    assert posts_while_open == 2
+    assert stub.posts == 3
+    assert recovered == {"success": True, "message": "Заявка принята"}
+    assert breaker.rejected == 2
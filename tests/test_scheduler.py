@@ -0,0 +1,53 @@
+import asyncio
+import gc
+from datetime import datetime
+
+import async_db
+import database
+from config import MSK
+from scheduler import Scheduler
+
+# Срабатывание сразу: любой ежедневный заказ ближе суток
+LEAD_MINUTES = 24 * 60
+EVERY_DAY = 0b1111111
+
+
+def test_fire_survives_gc_and_stop_waits_for_it():
+    started = asyncio.Event()
+    fired = []
+
+    async def fire(order, entry_time):
+        started.set()
+        await asyncio.sleep(0.2)
+        fired.append(order[0])
+        return True
+
+    async def scenario():
+        await async_db.init_db()
+        order = await async_db.add_scheduled_order(404, 1, EVERY_DAY, 9, 30, None)
+        scheduler = Scheduler(fire, lead_minutes=LEAD_MINUTES)
+        await scheduler.start()
+        await started.wait()
+        # Ссылку на задачу держит только планировщик
+        gc.collect()
+        firing = len(scheduler._firing)
+        await scheduler.stop()
+        await scheduler.remove(order[0])
+        return order[0], firing
+
+    order_id, firing = asyncio.run(scenario())
+
+    assert firing == 1
+    assert fired == [order_id]
+
+
+def test_created_at_is_moscow_time():
+    order = database.add_scheduled_order(405, 1, EVERY_DAY, 9, 30, None)
+    created_at = database.get_connection().execute(
+        'SELECT created_at FROM scheduled_orders WHERE id = ?', (order[0],),
+    ).fetchone()[0]
+    database.delete_scheduled_order(order[0])
+
+    created_at = datetime.fromisoformat(created_at)
+    assert created_at.utcoffset() == MSK.utcoffset(None)
+    assert abs((datetime.now(MSK) - created_at).total_seconds()) < 60
@@ -0,0 +1,89 @@
+import asyncio
+import time
+import tracemalloc
+from datetime import datetime
+
+import state_store
+from state_store import StateStore
+
+USERS = 100_000
+
+
+class RecordingBackend:
+    """Backend в памяти: считает обращения к базе"""
+
+    def __init__(self):
+        self.saves = 0
+        self.deletes = 0
+        self.purges = 0
+
+    async def save(self, key, value, expires_at):
+        self.saves += 1
+
+    async def delete(self, key):
+        self.deletes += 1
+
+    async def purge(self, now):
+        self.purges += 1
+
+    async def load(self):
+        return []
+
+
+def test_stale_users_footprint_and_sweep(monkeypatch):
+    backend = RecordingBackend()
+    store = StateStore(ttl=60, max_size=2 * USERS, backend=backend)
+
+    async def scenario():
+        tracemalloc.start()
+        try:
+            before = tracemalloc.get_traced_memory()[0]
+            for user_id in range(USERS):
+                await store.set(user_id, datetime(2026, 1, 1, 15, 30))
+            filled = tracemalloc.get_traced_memory()[0] - before
+
+            # Все 100k пользователей бросили диалог: следующая запись вычищает их
+            now = time.time() + 120
+            monkeypatch.setattr(state_store.time, "time", lambda: now)
+            await store.set(USERS, datetime(2026, 1, 1, 15, 30))
+            swept = tracemalloc.get_traced_memory()[0] - before
+        finally:
+            tracemalloc.stop()
+        return filled, swept
+
+    filled, swept = asyncio.run(scenario())
+
+    # Запись: StateEntry со __slots__, datetime и узел OrderedDict
+    assert filled / USERS < 300
+    assert swept < filled / 100
+    assert len(store) == 1
+    assert store.stats()["expired"] == USERS
+    # Просроченные удалены из базы одним запросом, без удаления по одному
+    assert backend.purges == 1
+    assert backend.deletes == 0
+
+
+def test_expired_read_does_not_touch_backend(monkeypatch):
+    backend = RecordingBackend()
+    store = StateStore(ttl=60, max_size=10, backend=backend)
+    asyncio.run(store.set(1, "a"))
+
+    now = time.time() + 120
+    monkeypatch.setattr(state_store.time, "time", lambda: now)
+    assert asyncio.run(store.get(1, "missing")) == "missing"
+    assert len(store) == 0
+    assert backend.deletes == 0
+
+
+def test_overflow_evicts_oldest():
+    backend = RecordingBackend()
+    store = StateStore(ttl=60, max_size=3, backend=backend)
+
+    async def scenario():
+        for user_id in range(5):
+            await store.set(user_id, user_id)
+        return [await store.get(user_id) for user_id in range(5)]
+
+    assert asyncio.run(scenario()) == [None, None, 2, 3, 4]
+    assert backend.deletes == 2
+    assert store.stats()["evicted"] == 2
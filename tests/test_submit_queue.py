@@ -0,0 +1,39 @@
+import asyncio
+from datetime import datetime
+
+import async_db
+import bot
+import submit_queue
+from submit_queue import SubmitQueue
+
+CAR = (1, "секвойя", "А606ВО 797", "Тойота")
+ENTRY = datetime(2026, 10, 20, 9, 30)
+
+
+def test_shared_submission_is_recorded_for_every_chat(monkeypatch):
+    posts = []
+
+    async def submit_pass(car_number, car_model, entry_time):
+        posts.append(car_number)
+        await asyncio.sleep(0.1)
+        return {"success": True, "message": "Заявка принята"}
+
+    monkeypatch.setattr(submit_queue, "submit_pass", submit_pass)
+
+    async def scenario():
+        queue = SubmitQueue(2)
+        monkeypatch.setattr(bot, "submit_queue", queue)
+        await async_db.init_db()
+        before = {chat: len(await async_db.get_recent_orders(chat, 10)) for chat in (111, 222)}
+        # Два чата заказывают одну машину на одно время, один из них — дважды
+        await asyncio.gather(
+            bot.submit_and_record(111, CAR, ENTRY),
+            bot.submit_and_record(222, CAR, ENTRY),
+            bot.submit_and_record(222, CAR, ENTRY),
+        )
+        await queue.stop()
+        after = {chat: len(await async_db.get_recent_orders(chat, 10)) for chat in (111, 222)}
+        return {chat: after[chat] - before[chat] for chat in after}
+
+    assert asyncio.run(scenario()) == {111: 1, 222: 1}
+    assert posts == ["А606ВО 797"]
@@ -0,0 +1,47 @@
+import asyncio
+
+from aiogram import Dispatcher, F, Router
+from aiogram.methods import AnswerCallbackQuery
+
+from loadtest import make_fake_bot
+from throttling import DROPPED_CALLBACK_TEXT, ThrottlingMiddleware
+
+
+def test_dropped_callback_is_answered(updates):
+    bot = make_fake_bot()
+    answered = []
+    make_request = bot.session.make_request
+
+    async def record(bot, method, timeout=None):
+        if isinstance(method, AnswerCallbackQuery):
+            answered.append(method)
+        return await make_request(bot, method, timeout)
+
+    bot.session.make_request = record
+
+    handled = []
+    router = Router()
+
+    @router.callback_query(F.data == "menu")
+    async def menu(callback):
+        handled.append(callback.id)
+        await callback.answer()
+
+    throttling = ThrottlingMiddleware(user_rate=0.001, user_burst=1, global_rate=1000, global_burst=1000)
+    dp = Dispatcher()
+    dp.update.outer_middleware(throttling)
+    dp.include_router(router)
+
+    async def scenario():
+        first, second = updates.callback(7001, "menu"), updates.callback(7001, "menu")
+        await dp.feed_update(bot, first)
+        await dp.feed_update(bot, second)
+        # Сообщение сверх лимита просто отбрасывается, без ответа
+        await dp.feed_update(bot, updates.message(7001, "/start"))
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert handled == [first.callback_query.id]
+    assert throttling.dropped_user == 2
+    assert [m.callback_query_id for m in answered] == [first.callback_query.id, second.callback_query.id]
+    assert answered[1].text == DROPPED_CALLBACK_TEXT
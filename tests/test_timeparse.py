@@ -0,0 +1,69 @@
+from datetime import datetime
+
+import pytest
+
+from bench import TIME_CORPUS, TIMEPARSE_NOW, expected_time
+from timeparse import EVERY_DAY, WORKDAYS, parse_time, parse_time_or_hour, parse_weekdays
+
+# Среда, 14 октября 2026, 12:00
+NOW = datetime(2026, 10, 14, 12, 0)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("15:30", datetime(2026, 10, 14, 15, 30)),
+    ("15.30", datetime(2026, 10, 14, 15, 30)),
+    ("1530", datetime(2026, 10, 14, 15, 30)),
+    ("15:00-17:00", datetime(2026, 10, 14, 15, 0)),
+    ("завтра 10:00", datetime(2026, 10, 15, 10, 0)),
+    ("завтра 1000", datetime(2026, 10, 15, 10, 0)),
+    ("послезавтра 9:05", datetime(2026, 10, 16, 9, 5)),
+    ("в пятницу 10:00", datetime(2026, 10, 16, 10, 0)),
+    ("пт 10:00", datetime(2026, 10, 16, 10, 0)),
+    ("в пятницу 1000", datetime(2026, 10, 16, 10, 0)),
+    # Сегодня среда, но 10:00 уже прошло
+    ("в среду 10:00", datetime(2026, 10, 21, 10, 0)),
+    ("через 2 часа", datetime(2026, 10, 14, 14, 0)),
+    ("через полчаса", datetime(2026, 10, 14, 12, 30)),
+])
+def test_parse_time(text, expected):
+    assert parse_time(text, NOW) == expected
+
+
+@pytest.mark.parametrize("text, expected", [
+    # Слова, начинающиеся как сокращения дней, — не дни недели
+    ("что 15:30", datetime(2026, 10, 14, 15, 30)),
+    ("все 15:30", datetime(2026, 10, 14, 15, 30)),
+    ("вся 15:30", datetime(2026, 10, 14, 15, 30)),
+    # 15:30 важнее числа без двоеточия в тексте
+    ("в 2030 году 10:00", datetime(2026, 10, 14, 10, 0)),
+    ("1530 или 16:00", datetime(2026, 10, 14, 16, 0)),
+])
+def test_parse_time_ignores_lookalikes(text, expected):
+    assert parse_time(text, NOW) == expected
+
+
+@pytest.mark.parametrize("text", ["в 2030 году", "номер 1530", "12345", "25:00", "привет"])
+def test_parse_time_rejects(text):
+    assert parse_time(text, NOW) is None
+
+
+def test_parse_time_or_hour():
+    assert parse_time_or_hour("завтра 15", NOW) == datetime(2026, 10, 15, 15, 0)
+    assert parse_time_or_hour("15:30", NOW) == datetime(2026, 10, 14, 15, 30)
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("по будням", WORKDAYS),
+    ("ежедневно", EVERY_DAY),
+    ("пн,ср,пт", 0b0010101),
+    ("по вторникам и четвергам", 0b0001010),
+    ("что все вся", 0),
+])
+def test_parse_weekdays(text, expected):
+    assert parse_weekdays(text) == expected
+
+
+@pytest.mark.parametrize("text, expected, old_understands", TIME_CORPUS)
+def test_message_corpus(text, expected, old_understands):
+    # Корпус бенчмарка timeparse: сообщения, какие пишут боту
+    assert parse_time(text, TIMEPARSE_NOW) == expected_time(expected)
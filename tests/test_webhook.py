@@ -0,0 +1,119 @@
+import asyncio
+import json
+
+import aiohttp
+from aiogram import Dispatcher
+from aiohttp import web
+
+import bot
+
+# Обновление в том виде, в каком его присылает Telegram
+START_UPDATE = {
+    "update_id": 815000001,
+    "message": {
+        "message_id": 17,
+        "from": {"id": 303, "is_bot": False, "first_name": "Анна", "language_code": "ru"},
+        "chat": {"id": 303, "first_name": "Анна", "type": "private"},
+        "date": 1760600000,
+        "text": "/start",
+        "entities": [{"offset": 0, "length": 6, "type": "bot_command"}],
+    },
+}
+
+
+async def serve(app: web.Application) -> tuple[web.AppRunner, str]:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}{bot.WEBHOOK_PATH}"
+
+
+async def post(url: str, update: dict, secret: str | None = None) -> int:
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret is not None else {}
+    async with aiohttp.ClientSession() as client:
+        async with client.post(url, data=json.dumps(update), headers=headers) as response:
+            return response.status
+
+
+def test_update_is_handled(monkeypatch, dispatcher, fake_bot):
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", "")
+
+    async def scenario():
+        runner, url = await serve(bot.create_webhook_app(fake_bot, dispatcher))
+        calls = fake_bot.session.calls
+        try:
+            status = await post(url, START_UPDATE)
+        finally:
+            await runner.cleanup()
+        return status, fake_bot.session.calls - calls
+
+    status, sent = asyncio.run(scenario())
+
+    assert status == 200
+    assert sent >= 1
+
+
+def test_wrong_secret_is_rejected(monkeypatch, dispatcher, fake_bot):
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", "s3cret")
+
+    async def scenario():
+        runner, url = await serve(bot.create_webhook_app(fake_bot, dispatcher))
+        calls = fake_bot.session.calls
+        try:
+            statuses = [await post(url, START_UPDATE), await post(url, START_UPDATE, "wrong")]
+        finally:
+            await runner.cleanup()
+        return statuses, fake_bot.session.calls - calls
+
+    statuses, sent = asyncio.run(scenario())
+
+    assert all(status == 401 for status in statuses)
+    assert sent == 0
+
+
+def test_handler_error_is_not_redelivered(monkeypatch, fake_bot):
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", "")
+    dp = Dispatcher()
+
+    @dp.message()
+    async def broken(message):
+        raise RuntimeError("Telegram не принял ответ")
+
+    async def scenario():
+        runner, url = await serve(bot.create_webhook_app(fake_bot, dp))
+        try:
+            return await post(url, START_UPDATE)
+        finally:
+            await runner.cleanup()
+
+    # Не 2xx Telegram доставил бы повторно — и заказ оформился бы второй раз
+    assert asyncio.run(scenario()) == 200
+
+
+def test_stop_drains_background_updates(monkeypatch, fake_bot):
+    monkeypatch.setattr(bot, "WEBHOOK_SECRET", "")
+    # Свой Dispatcher: роутер бота уже подключён к общему
+    dp = Dispatcher()
+    started = asyncio.Event()
+    finished = []
+
+    @dp.message()
+    async def slow(message):
+        started.set()
+        await asyncio.sleep(0.3)
+        finished.append(message.message_id)
+
+    async def scenario():
+        runner, url = await serve(bot.create_webhook_app(fake_bot, dp))
+        # Telegram получает ответ, не дожидаясь обработчика
+        status = await post(url, START_UPDATE)
+        await started.wait()
+        answered_before_handler = not finished
+        # Остановка посреди обработки: cleanup дожидается фонового обработчика
+        await runner.cleanup()
+        return status, answered_before_handler
+
+    assert asyncio.run(scenario()) == (200, True)
+    assert finished == [17]
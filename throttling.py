@@ -0,0 +1,154 @@
+"""Ограничение частоты входящих обновлений и исходящих сообщений"""
+import asyncio
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramAPIError, TelegramRetryAfter
+
+# Ответ на отброшенное нажатие кнопки: иначе у пользователя крутится индикатор
+DROPPED_CALLBACK_TEXT = "Слишком часто, подожди немного"
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        # now может быть снят до создания корзины — назад время не отматываем
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def take(self, now: float | None = None) -> bool:
+        """Взять токен, если есть"""
+        self._refill(time.monotonic() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def reserve(self, now: float | None = None) -> float:
+        """Занять токен в долг. Возвращает, сколько секунд подождать до него"""
+        self._refill(time.monotonic() if now is None else now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class _Buckets:
+    """Корзины по ключу (пользователь, чат), самые давние вытесняются"""
+
+    def __init__(self, rate: float, capacity: float, max_keys: int = 10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._items: OrderedDict[int, TokenBucket] = OrderedDict()
+
+    def get(self, key: int) -> TokenBucket:
+        bucket = self._items.get(key)
+        if bucket is None:
+            bucket = self._items[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._items) > self.max_keys:
+                self._items.popitem(last=False)
+        else:
+            self._items.move_to_end(key)
+        return bucket
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware для dp.update: лимит обновлений на пользователя и общий.
+    Лишние обновления отбрасываются; нажатие кнопки при этом получает короткий
+    ответ, сообщения — нет. Inline-запросы приходят на каждое нажатие клавиши
+    и отвечаются из кеша, на них действует только общий лимит.
+    """
+
+    def __init__(self, user_rate: float, user_burst: float, global_rate: float, global_burst: float):
+        self._users = _Buckets(user_rate, user_burst)
+        self._global = TokenBucket(global_rate, global_burst)
+        self.passed = 0
+        self.dropped_user = 0
+        self.dropped_global = 0
+
+    async def __call__(self, handler, event, data):
+        now = time.monotonic()
+        user = data.get("event_from_user")
+
+        if user is not None and event.inline_query is None and not self._users.get(user.id).take(now):
+            self.dropped_user += 1
+            return await self._drop(event, data)
+        if not self._global.take(now):
+            self.dropped_global += 1
+            return await self._drop(event, data)
+
+        self.passed += 1
+        return await handler(event, data)
+
+    @staticmethod
+    async def _drop(event, data):
+        if event.callback_query is None:
+            return None
+        try:
+            await data["bot"].answer_callback_query(event.callback_query.id, text=DROPPED_CALLBACK_TEXT)
+        except TelegramAPIError:
+            # Запрос устарел или Telegram не ответил — отбрасываем молча
+            pass
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "passed": self.passed,
+            "dropped_user": self.dropped_user,
+            "dropped_global": self.dropped_global,
+        }
+
+
+class SendLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: выстраивает в очередь методы с chat_id
+    (send_message, edit_message_text, ...) под лимиты Telegram — общий и на чат.
+    Если Telegram всё же ответил 429, ждёт retry_after и повторяет.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, max_retries: int = 3):
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = _Buckets(chat_rate, chat_burst)
+        self.max_retries = max_retries
+        self.sent = 0
+        self.delayed = 0
+        self.retried = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        now = time.monotonic()
+        delay = self._global.reserve(now)
+        if isinstance(chat_id, int):
+            delay = max(delay, self._chats.get(chat_id).reserve(now))
+        if delay > 0:
+            self.delayed += 1
+            await asyncio.sleep(delay)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                result = await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retried += 1
+                await asyncio.sleep(e.retry_after)
+            else:
+                self.sent += 1
+                return result
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "delayed": self.delayed, "retried": self.retried}
@@ -0,0 +1,160 @@
+"""Разбор времени въезда из текста сообщения"""
+import re
+from datetime import datetime, timedelta
+
+from config import MSK
+
+# Смещение в днях для слов-дат
+_DAY_OFFSETS = {"сегодня": 0, "завтра": 1, "послезавтра": 2}
+
+# Формы названий дней недели -> номер дня (Пн = 0). Только целые слова:
+# по основам "чт", "вс" совпадали бы "что", "все"
+_WEEKDAY_FORMS = (
+    "пн понедельник понедельника понедельникам",
+    "вт вторник вторника вторникам",
+    "ср среда среду среды средам",
+    "чт четверг четверга четвергам",
+    "пт пятница пятницу пятницы пятницам",
+    "сб суббота субботу субботы субботам",
+    "вс воскресенье воскресенья воскресеньям",
+)
+_WEEKDAYS = {form: day for day, forms in enumerate(_WEEKDAY_FORMS) for form in forms.split()}
+
+_WEEKDAY_PATTERN = "|".join(sorted(_WEEKDAYS, key=len, reverse=True))
+
+# Один общий шаблон: все токены находятся за один проход по строке.
+# 1530 без двоеточия — только отдельным словом, как у прежнего парсера.
+# Слова берутся целиком и ищутся в словарях дней — быстрее, чем пробовать
+# альтернативы всех названий дней с каждой буквы
+_TOKEN_RE = re.compile(r"""
+      (?<![\d:.])(?P<h>\d{1,2})[:.](?P<m>\d{2})(?:\s*[-–—]\s*\d{1,2}[:.]\d{2})?(?![\d:.])
+    | (?<!\S)(?P<hh>[01]\d|2[0-3])(?P<mm>[0-5]\d)(?!\S)
+    | \bчерез\s+(?P<in_n>\d{1,3})?\s*(?P<in_unit>полчаса|час|мин)[а-я]*
+    | (?P<word>[^\W\d_]+)
+""", re.VERBOSE)
+
+# Что может стоять рядом с 1530, кроме дня: "в пятницу 1530", "завтра, 1530"
+_FILLER_RE = re.compile(r"(?:\b(?:в|во|на|с)\b|[\s,])*")
+
+
+# Маски дней недели для повторяющихся заказов: бит 0 — Пн, бит 6 — Вс
+EVERY_DAY = 0b1111111
+WORKDAYS = 0b0011111
+WEEKEND = 0b1100000
+
+_REPEAT_RE = re.compile(r"""
+      \b(?P<every_day>ежедневно|каждый\s+день)\b
+    | \b(?P<workdays>будни|будням|рабочие)\b
+    | \b(?P<weekend>выходные|выходным)\b
+    | \b(?P<weekday>""" + _WEEKDAY_PATTERN + r""")\b
+""", re.VERBOSE)
+
+
+def parse_weekdays(text: str) -> int:
+    """
+    Дни недели для повторяющегося заказа в виде битовой маски (Пн = 1, Вс = 64).
+    Понимает 'ежедневно', 'по будням', 'выходные', 'пн,ср,пт'. 0 — дней нет.
+    """
+    mask = 0
+    for match in _REPEAT_RE.finditer(text.lower()):
+        kind = match.lastgroup
+        if kind == "every_day":
+            mask |= EVERY_DAY
+        elif kind == "workdays":
+            mask |= WORKDAYS
+        elif kind == "weekend":
+            mask |= WEEKEND
+        else:
+            mask |= 1 << _WEEKDAYS[match.group("weekday")]
+    return mask
+
+
+# Час без минут: "15", "завтра 9"
+_BARE_HOUR_RE = re.compile(r"(?<![\d:.])([01]?\d|2[0-3])(?![\d:.])")
+
+
+def _minute_now(now: datetime | None) -> datetime:
+    """Текущее время по Москве без tzinfo, с точностью до минуты"""
+    if now is None:
+        now = datetime.now(MSK)
+    return now.replace(tzinfo=None, second=0, microsecond=0)
+
+
+def _blank(text: str, spans: list[tuple[int, int]]) -> str:
+    """text с пробелами на месте spans"""
+    parts = []
+    position = 0
+    for start, end in spans:
+        parts.append(text[position:start])
+        parts.append(" " * (end - start))
+        position = end
+    parts.append(text[position:])
+    return "".join(parts)
+
+
+def parse_time(time_str: str, now: datetime | None = None) -> datetime | None:
+    """
+    Парсит время въезда из строки. Понимает:
+      15:30, 15.30, 1530, 15:00-17:00 (берётся начало),
+      завтра/послезавтра/сегодня 10:00, пятница 10:00, в пятницу 10:00,
+      через 2 часа, через 30 минут, через полчаса.
+    Возвращает время по Москве без tzinfo или None.
+    """
+    text = time_str.lower()
+    day_offset = None
+    weekday = None
+    clock = compact = None
+    # Места дней и 1530 в тексте: остальное проверяется, только если нашлось 1530
+    spans = []
+
+    for match in _TOKEN_RE.finditer(text):
+        kind = match.lastgroup
+        if kind == "word":
+            word = match.group("word")
+            if word in _DAY_OFFSETS:
+                day_offset = _DAY_OFFSETS[word]
+            elif word in _WEEKDAYS:
+                weekday = _WEEKDAYS[word]
+            else:
+                continue
+        elif kind == "in_unit":
+            unit = match.group("in_unit")
+            now = _minute_now(now)
+            if unit == "полчаса":
+                return now + timedelta(minutes=30)
+            n = int(match.group("in_n") or 1)
+            return now + (timedelta(hours=n) if unit == "час" else timedelta(minutes=n))
+        elif kind == "m":
+            clock = clock or match
+            continue
+        elif kind == "mm":
+            compact = compact or match
+        spans.append(match.span())
+
+    # 15:30 важнее 1530; 1530 — только если кроме него и дня в тексте ничего нет
+    if clock is not None:
+        hours, minutes = int(clock.group("h")), int(clock.group("m"))
+    elif compact is not None and _FILLER_RE.fullmatch(_blank(text, spans)):
+        hours, minutes = int(compact.group("hh")), int(compact.group("mm"))
+    else:
+        return None
+    if not (0 <= hours <= 23 and 0 <= minutes <= 59):
+        return None
+    now = _minute_now(now)
+
+    target_date = now.date()
+    if day_offset is not None:
+        target_date += timedelta(days=day_offset)
+    elif weekday is not None:
+        target_date += timedelta(days=(weekday - target_date.weekday()) % 7)
+
+    result = datetime.combine(target_date, datetime.min.time().replace(hour=hours, minute=minutes))
+    if weekday is not None and day_offset is None and result < now:
+        # Этот день недели сегодня, но время уже прошло — следующая неделя
+        result += timedelta(days=7)
+    return result
+
+
+def parse_time_or_hour(time_str: str, now: datetime | None = None) -> datetime | None:
+    """Как parse_time, но понимает и час без минут: 'завтра 15' — завтра в 15:00"""
+    return parse_time(time_str, now) or parse_time(_BARE_HOUR_RE.sub(r"\1:00", time_str, count=1), now)